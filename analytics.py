@@ -0,0 +1,441 @@
+"""Engagement analytics: posting, likes, follows and user cohorts.
+
+Computed by a job off the request path, e.g. nightly from cron:
+
+    FLASK_APP=app.py flask analytics
+
+The job has two steps:
+
+1. snapshot: the id columns of users, follows, messages (every shard,
+   plus the cold archive) and likes are read out in keyset batches of
+   ANALYTICS_BATCH rows. Each batch is a short range scan of a primary
+   key, so the live tables never see a long-running GROUP BY, and is
+   appended to one flat file per column under ANALYTICS_DIR/snapshot/.
+   Only one batch is ever held in memory;
+2. aggregate: vectorized counts over the column files, mapped into
+   memory. Message ids are snowflakes (see snowflake.py), so a
+   message's day comes from its id and a like's day from the liked
+   message's id. Once messages are sorted by id, the days and months the
+   dashboard looks at are a slice at the end.
+
+`flask analytics --from-snapshot` repeats step 2 only, without touching
+the database. benchmarks/bench_analytics.py times both steps.
+
+The results go to ANALYTICS_DIR/stats.json, which /admin/stats renders as
+is. Follows carry no timestamp, so follower growth is measured between
+snapshots: a new snapshot keeps the follower counts of the one it
+replaces in previous.npz.
+"""
+
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import tuple_
+
+from archive import message_archive
+from models import db, User, Follows, Message, Likes
+from queries import author_card_rows
+from shards import shard_router
+from snowflake import EPOCH, WORKER_BITS, SEQUENCE_BITS
+
+SNAPSHOT = 'snapshot'
+PREVIOUS = 'previous.npz'
+STATS = 'stats.json'
+
+# a snapshot's column files
+COLUMNS = {
+    'user_id': np.int32,
+    'followed': np.int32,
+    'follower': np.int32,
+    'message_id': np.int64,
+    'message_user': np.int32,
+    'like_message': np.int64,
+}
+
+COHORT_MONTHS = 12
+HISTORY = 365
+
+EPOCH_MS = np.datetime64(EPOCH, 'ms')
+
+
+def run(directory, batch_size=100_000, days=90, top=20,
+        from_snapshot=False, log=print):
+    """Snapshot the tables (unless `from_snapshot`), aggregate, and write
+    stats.json to `directory`. Returns the stats."""
+
+    os.makedirs(directory, exist_ok=True)
+
+    start = time.perf_counter()
+    if not from_snapshot:
+        snapshot(directory, batch_size, log)
+    read = time.perf_counter()
+
+    stats = aggregate(load_snapshot(directory), days, top,
+                      _load_previous(directory))
+    done = time.perf_counter()
+    log(f"Aggregated in {done - read:.1f}s")
+
+    _name_users(stats)
+    stats['seconds'] = {'snapshot': round(read - start, 2),
+                        'aggregate': round(done - read, 2)}
+    old = load_stats(directory) or {}
+    stats['history'] = [
+        entry for entry in old.get('history', [])
+        if entry['taken'] != stats['taken']
+    ][-(HISTORY - 1):] + [dict(stats['totals'], taken=stats['taken'])]
+
+    path = os.path.join(directory, STATS)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(stats, f)
+    os.replace(path + '.tmp', path)
+    return stats
+
+
+def load_stats(directory):
+    """The last run's stats, or None; the file is re-read only when a run
+    has replaced it."""
+
+    if not directory:
+        return None
+    path = os.path.join(directory, STATS)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    cached = _loaded.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path) as f:
+            cached = _loaded[path] = (mtime, json.load(f))
+    return cached[1]
+
+
+_loaded = {}
+
+
+##############################################################################
+# Snapshots
+
+
+def snapshot(directory, batch_size, log=print):
+    """Read the tables' id columns into a new ANALYTICS_DIR/snapshot/,
+    replacing the old one."""
+
+    new = os.path.join(directory, SNAPSHOT + '.new')
+    shutil.rmtree(new, ignore_errors=True)
+    os.makedirs(new)
+
+    with _ColumnWriter(new) as out:
+        for batch in _batches(db.session, [User.id], 1, batch_size):
+            out.append(user_id=batch[:, 0])
+        for batch in _batches(db.session, [Follows.user_being_followed_id,
+                                           Follows.user_following_id],
+                              2, batch_size):
+            out.append(followed=batch[:, 0], follower=batch[:, 1])
+        log(f"{out.rows['user_id']} users, {out.rows['followed']} follows")
+
+        for name in shard_router.shard_names():
+            session = shard_router.session(name)
+            for batch in _batches(session, [Message.id, Message.user_id], 1,
+                                  batch_size):
+                out.append(message_id=batch[:, 0], message_user=batch[:, 1])
+            for batch in _batches(session, [Likes.id, Likes.message_id], 1,
+                                  batch_size):
+                out.append(like_message=batch[:, 1])
+            log(f"Shard {name}: {out.rows['message_id']} messages, "
+                f"{out.rows['like_message']} likes so far")
+
+        for year, month in message_archive.months():
+            columns = message_archive.columns(year, month)
+            out.append(message_id=columns['id'],
+                       message_user=columns['user_id'])
+
+    _keep_previous(directory)
+    current = os.path.join(directory, SNAPSHOT)
+    shutil.rmtree(current, ignore_errors=True)
+    os.rename(new, current)
+
+
+class _ColumnWriter:
+    """Appends batches to a snapshot's column files."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.taken = datetime.utcnow()
+        self.rows = dict.fromkeys(COLUMNS, 0)
+
+    def __enter__(self):
+        self.files = {name: open(os.path.join(self.directory, name), 'wb')
+                      for name in COLUMNS}
+        return self
+
+    def append(self, **columns):
+        for name, values in columns.items():
+            values = np.asarray(values, dtype=COLUMNS[name])
+            self.files[name].write(values.tobytes())
+            self.rows[name] += len(values)
+
+    def __exit__(self, *exc):
+        for f in self.files.values():
+            f.close()
+        with open(os.path.join(self.directory, 'taken'), 'w') as f:
+            f.write(self.taken.isoformat(timespec='seconds'))
+
+
+def _batches(session, columns, key_length, batch_size):
+    """Every row of `columns` in (n, len(columns)) int64 arrays of up to
+    `batch_size` rows, paged on the first `key_length` columns (a primary
+    key)."""
+
+    key = columns[:key_length]
+    query = (session.query(*columns)
+             .filter(*[column.isnot(None) for column in columns[key_length:]])
+             .order_by(*key))
+
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            page = page.filter(tuple_(*key) > tuple_(*last)
+                               if key_length > 1 else key[0] > last[0])
+        rows = page.limit(batch_size).all()
+        if rows:
+            yield np.array(rows, dtype=np.int64)
+        if len(rows) < batch_size:
+            return
+        last = rows[-1][:key_length]
+
+
+def load_snapshot(directory):
+    """{column: array} of the current snapshot, mapped from its files,
+    with 'taken', when it was started."""
+
+    base = os.path.join(directory, SNAPSHOT)
+    arrays = {}
+    for name, dtype in COLUMNS.items():
+        path = os.path.join(base, name)
+        if os.path.getsize(path):
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r')
+        else:
+            arrays[name] = np.empty(0, dtype=dtype)
+    with open(os.path.join(base, 'taken')) as f:
+        arrays['taken'] = np.datetime64(f.read(), 's')
+    return arrays
+
+
+def _keep_previous(directory):
+    """Save the follower counts of the snapshot about to be replaced."""
+
+    if not os.path.isdir(os.path.join(directory, SNAPSHOT)):
+        return
+    old = load_snapshot(directory)
+    path = os.path.join(directory, PREVIOUS)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, taken=old['taken'],
+                 followers=np.bincount(old['followed']))
+    os.replace(path + '.tmp', path)
+
+
+def _load_previous(directory):
+    path = os.path.join(directory, PREVIOUS)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        return {'taken': f['taken'], 'followers': f['followers']}
+
+
+##############################################################################
+# Aggregates
+
+
+def aggregate(arrays, days=90, top=20, previous=None):
+    """The dashboard's numbers from snapshot `arrays`, as JSON-able dicts.
+
+    `days` is the window for daily activity and the most active users;
+    `previous` the follower counts of the last snapshot, if any. Users are
+    listed by id: run() adds their usernames.
+    """
+
+    taken = arrays['taken']
+    followed = arrays['followed']
+    like_message = arrays['like_message']
+
+    # shards and archive months are each in id order; timsort merges runs
+    order = np.argsort(arrays['message_id'], kind='stable')
+    message_id = arrays['message_id'][order]
+    message_user = arrays['message_user'][order]
+    del order
+
+    n_users = 1 + max([int(array.max()) for array in
+                       (arrays['user_id'], message_user, followed,
+                        arrays['follower']) if len(array)] or [0])
+    posted = np.zeros(n_users, dtype=bool)
+    posted[message_user] = True
+
+    # like -> index of its message
+    at = np.searchsorted(message_id, like_message)
+    found = at < len(message_id)
+    found[found] = message_id[at[found]] == like_message[found]
+    liked = at[found]
+
+    today = taken.astype('datetime64[D]')
+    first = today - (days - 1)
+    recent = np.searchsorted(message_id, _first_id(first))
+
+    return {
+        'taken': str(taken),
+        'totals': {
+            'users': len(arrays['user_id']),
+            'authors': int(np.count_nonzero(posted)),
+            'messages': len(message_id),
+            'likes': len(like_message),
+            'follows': len(followed),
+        },
+        'daily': _daily(message_id[recent:], message_user[recent:],
+                        liked[liked >= recent] - recent, first, days),
+        'active_users': _active_users(message_user[recent:],
+                                      liked[liked >= recent] - recent,
+                                      n_users, top),
+        'cohorts': _cohorts(message_id, message_user, n_users, today),
+        'followers': _followers(followed, n_users, previous, top),
+    }
+
+
+def _first_id(day):
+    """The smallest snowflake of datetime64 `day` or later."""
+
+    millis = (day - EPOCH_MS).astype('timedelta64[ms]').astype(np.int64)
+    return max(int(millis), 0) << (WORKER_BITS + SEQUENCE_BITS)
+
+
+def _time(ids):
+    """Creation times embedded in snowflake `ids`."""
+
+    millis = ids >> (WORKER_BITS + SEQUENCE_BITS)
+    return EPOCH_MS + millis.astype('timedelta64[ms]')
+
+
+def _daily(ids, users, liked, first, days):
+    """Posts, distinct authors and likes of each of the last `days` days,
+    from the messages (`ids`, `users`) posted in them and the indexes of
+    the `liked` ones; likes count on the day of the liked message."""
+
+    day = (_time(ids).astype('datetime64[D]') - first).astype(np.int64)
+    day = np.minimum(day, days - 1)     # posted while reading
+    posts = np.bincount(day, minlength=days)
+    pairs = np.unique(day << 32 | users)
+    authors = np.bincount(pairs >> 32, minlength=days)
+    likes = np.bincount(day[liked], minlength=days)
+
+    return [{'date': str(first + i),
+             'posts': int(posts[i]),
+             'authors': int(authors[i]),
+             'likes': int(likes[i]),
+             'like_rate': float(likes[i] / posts[i]) if posts[i] else 0.0}
+            for i in range(days)]
+
+
+def _active_users(users, liked, n_users, top):
+    """The `top` authors of the window, with the likes their posts of the
+    window got."""
+
+    posts = np.bincount(users, minlength=n_users)
+    likes = np.bincount(users[liked], minlength=n_users)
+
+    return [{'id': int(user_id),
+             'posts': int(posts[user_id]),
+             'likes': int(likes[user_id]),
+             'like_rate': float(likes[user_id] / posts[user_id])}
+            for user_id in _top(posts, top)]
+
+
+def _cohorts(message_id, message_user, n_users, today):
+    """Authors grouped by the month of their first post, over the last
+    COHORT_MONTHS months: each cohort's size, and the fraction of it
+    posting in each month since. `message_id` is sorted."""
+
+    this_month = int(today.astype('datetime64[M]').astype(np.int64))
+    start = this_month - (COHORT_MONTHS - 1)
+    tail = np.searchsorted(message_id, _first_id(
+        np.datetime64(start, 'M').astype('datetime64[D]')))
+
+    earlier = np.zeros(n_users, dtype=bool)
+    earlier[message_user[:tail]] = True
+    users = message_user[tail:]
+    months = (_time(message_id[tail:]).astype('datetime64[M]')
+              .astype(np.int64) - start)
+    months = np.minimum(months, COHORT_MONTHS - 1)
+
+    # the tail is in id order: a user's first index is their first post
+    authors, first = np.unique(users, return_index=True)
+    cohort_of = np.full(n_users, -1, dtype=np.int64)
+    cohort_of[authors] = months[first]
+    cohort_of[earlier] = -1
+    cohort = cohort_of[users]
+    keep = cohort >= 0
+    cell = cohort[keep] * COHORT_MONTHS + months[keep] - cohort[keep]
+
+    pairs = np.unique(cell << 32 | users[keep])
+    active = np.bincount(pairs >> 32, minlength=COHORT_MONTHS ** 2) \
+        .reshape(COHORT_MONTHS, COHORT_MONTHS)
+
+    cohorts = []
+    for i in range(COHORT_MONTHS):
+        size = int(active[i, 0])
+        cohorts.append({
+            'month': str(np.datetime64(start + i, 'M')),
+            'size': size,
+            'retention': [float(active[i, age] / size) if size else 0.0
+                          for age in range(COHORT_MONTHS - i)],
+        })
+    return cohorts
+
+
+def _followers(followed, n_users, previous, top):
+    """The most followed users and, against the previous snapshot, those
+    who gained the most followers."""
+
+    counts = np.bincount(followed, minlength=n_users)
+    result = {
+        'since': None,
+        'most_followed': [{'id': int(user_id),
+                           'followers': int(counts[user_id])}
+                          for user_id in _top(counts, top)],
+        'gainers': [],
+    }
+    if previous is not None:
+        before = np.zeros(n_users, dtype=np.int64)
+        old = previous['followers'][:n_users]
+        before[:len(old)] = old
+        gained = counts - before
+        result['since'] = str(previous['taken'])
+        result['gainers'] = [{'id': int(user_id),
+                              'followers': int(counts[user_id]),
+                              'gained': int(gained[user_id])}
+                             for user_id in _top(gained, top)]
+    return result
+
+
+def _top(values, n):
+    """Indexes of the `n` largest positive `values`, largest first."""
+
+    n = min(n, int(np.count_nonzero(values > 0)))
+    if n == 0:
+        return []
+    best = np.argpartition(-values, n - 1)[:n]
+    return best[np.argsort(-values[best], kind='stable')].tolist()
+
+
+def _name_users(stats):
+    """Add usernames to the users listed in `stats`."""
+
+    listed = (stats['active_users'] + stats['followers']['most_followed'] +
+              stats['followers']['gainers'])
+    names = {user_id: username for user_id, username, _ in
+             author_card_rows({entry['id'] for entry in listed})}
+    for entry in listed:
+        entry['username'] = names.get(entry['id'])
@@ -1,392 +1,129 @@
-import os
+"""Warbler application factory.
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
-from sqlalchemy.exc import IntegrityError
+Build an app with `create_app(profile)`, where profile is one of the names
+in config.PROFILES (or a config class). `app.app` is created on first
+access with the profile named by FLASK_ENV (default "production"), so
+`FLASK_APP=app.py flask run` and `from app import app` keep working while
+importing this module stays cheap.
+"""
 
-from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message, Likes
+import os
+import sys
+
+from flask import Flask
+from jinja2 import FileSystemBytecodeCache
+
+from config import PROFILES
+from models import connect_db
+from timeline_cache import timeline_cache
+from archive import message_archive
+from image_proxy import image_proxy
+from assets import assets
+from compression import CompressMiddleware
+from broker import timeline_broker
+from ratelimit import rate_limiter
+from author_cards import author_cards
+from shards import shard_router
+from taken_names import taken_names
+from deadlines import deadlines
+from profiler import request_profiler
+from warmup import hot_keys
+from notifications import notifier
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
-
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgres:///warbler'))
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
-
-connect_db(app)
-
-
-##############################################################################
-# User signup/login/logout
-
-
-@app.before_request
-def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
-
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
-
-    else:
-        g.user = None
-
-
-def do_login(user):
-    """Log in user."""
-
-    session[CURR_USER_KEY] = user.id
-
-
-def do_logout():
-    """Logout user."""
-
-    if CURR_USER_KEY in session:
-        del session[CURR_USER_KEY]
-
-
-@app.route('/signup', methods=["GET", "POST"])
-def signup():
-    """Handle user signup.
-
-    Create new user and add to DB. Redirect to home page.
-
-    If form not valid, present form.
-
-    If the there already is a user with that username: flash message
-    and re-present form.
-    """
-
-    form = UserAddForm()
-
-    if form.validate_on_submit():
-        try:
-            user = User.signup(
-                username=form.username.data,
-                password=form.password.data,
-                email=form.email.data,
-                image_url=form.image_url.data or User.image_url.default.arg,
-            )
-            db.session.commit()
-
-        except IntegrityError:
-            flash("Username already taken", 'danger')
-            return render_template('users/signup.html', form=form)
-
-        do_login(user)
-
-        return redirect("/")
-
-    else:
-        return render_template('users/signup.html', form=form)
-
-
-@app.route('/login', methods=["GET", "POST"])
-def login():
-    """Handle user login."""
-
-    form = LoginForm()
-
-    if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
-
-        if user:
-            do_login(user)
-            flash(f"Hello, {user.username}!", "success")
-            return redirect("/")
-
-        flash("Invalid credentials.", 'danger')
-
-    return render_template('users/login.html', form=form)
-
-
-@app.route('/logout')
-def logout():
-    """Handle logout of user."""
-
-    do_logout()
-    flash(f"Logout successful!", "success")
-    return redirect('/')
-
-
-##############################################################################
-# General user routes:
-
-@app.route('/users')
-def list_users():
-    """Page with listing of users.
-
-    Can take a 'q' param in querystring to search by that username.
-    """
-
-    search = request.args.get('q')
-
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
-
-    return render_template('users/index.html', users=users)
-
-
-@app.route('/users/<int:user_id>')
-def users_show(user_id):
-    """Show user profile."""
-
-    user = User.query.get_or_404(user_id)
-
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
-
-
-@app.route('/users/<int:user_id>/following')
-def show_following(user_id):
-    """Show list of people this user is following."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
-
-
-@app.route('/users/<int:user_id>/followers')
-def users_followers(user_id):
-    """Show list of followers of this user."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
-
-
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
-def add_follow(follow_id):
-    """Add a follow for the currently-logged-in user."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
-
-    return redirect(f"/users/{g.user.id}/following")
-
-
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
-def stop_following(follow_id):
-    """Have currently-logged-in-user stop following this user."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
-
-    return redirect(f"/users/{g.user.id}/following")
-
-
-@app.route('/users/<int:user_id>/likes')
-def show_likes(user_id):
-    """Show the current user's likes"""
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-    
-    likes = [msg.id for msg in g.user.likes]
-    messages = (Message
-                .query
-                .filter(Message.id.in_(likes))
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    
-    return render_template('users/likes.html', messages=messages)
-
-
-@app.route('/users/profile', methods=["GET", "POST"])
-def profile():
-    """Update profile for current user."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    form = UserEditForm()
-    curr_user_username = g.user.username
-
-    if form.validate_on_submit():
-        try:
-            user = User.authenticate(curr_user_username,
-                                 form.password.data)
-
-            user.username = form.username.data
-            user.email = form.email.data
-            user.image_url = form.image_url.data or User.image_url.default.arg
-            user.header_image_url = form.header_image_url.data or User.header_image_url.default.arg
-            user.bio = form.bio.data
-            db.session.commit()
-
-            return redirect(f'/users/{g.user.id}')
-
-        except IntegrityError:
-            flash("That password is incorrect. Please try again", 'danger')
-            return render_template('users/edit.html', form=form)
-    return render_template('users/edit.html', form=form)
-
-
-@app.route('/users/delete', methods=["POST"])
-def delete_user():
-    """Delete user."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    do_logout()
-
-    db.session.delete(g.user)
-    db.session.commit()
-
-    return redirect("/signup")
-
-
-##############################################################################
-# Messages routes:
-
-@app.route('/messages/new', methods=["GET", "POST"])
-def messages_add():
-    """Add a message:
-
-    Show form if GET. If valid, update message and redirect to user page.
-    """
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    form = MessageForm()
-
-    if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
-        db.session.commit()
-
-        return redirect(f"/users/{g.user.id}")
-
-    return render_template('messages/new.html', form=form)
-
-
-@app.route('/messages/<int:message_id>', methods=["GET"])
-def messages_show(message_id):
-    """Show a message."""
-
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
-
-
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
-def messages_destroy(message_id):
-    """Delete a message."""
-
-    msg = Message.query.get(message_id)
-
-    if not g.user or msg.user_id != g.user.id:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    db.session.delete(msg)
-    db.session.commit()
-
-    return redirect(f"/users/{g.user.id}")
-
-##############################################################################
-# Like routes:
-
-
-@app.route('/users/add_like/<int:msg_id>', methods=['POST'])
-def like_message(msg_id):
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-        
-    liked = Likes(user_id=g.user.id, message_id=msg_id)
-    db.session.add(liked)
-    db.session.commit()
-    return redirect('/')
-
-
-@app.route('/users/remove_like/<int:msg_id>', methods=['POST'])
-def remove_liked_message(msg_id):
-    liked = Likes.query.filter_by(user_id = g.user.id, message_id = msg_id).first()
-    db.session.delete(liked)
-    db.session.commit()
-    return redirect('/')
-
-
-##############################################################################
-# Homepage and error pages
-
-
-@app.route('/')
-def homepage():
-    """Show homepage:
-
-    - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
-    """
-
-    if g.user:
-        followed_ids = [f.id for f in g.user.following] + [g.user.id]
-        likes = [msg.id for msg in g.user.likes]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(followed_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        return render_template('home.html', messages=messages, likes=likes)
-
-    else:
-        return render_template('home-anon.html')
-
-
-##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+def create_app(profile=None):
+    """Create and configure a Warbler Flask app."""
+
+    # views imports CURR_USER_KEY from here
+    import views
+
+    if profile is None:
+        profile = os.environ.get('FLASK_ENV', 'production')
+    if isinstance(profile, str):
+        profile = PROFILES[profile]
+
+    app = Flask(__name__)
+    app.config.from_object(profile)
+
+    if app.config['DEBUG_TOOLBAR']:
+        # only development pays for importing the toolbar
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+        app.config['JINJA_CACHE_DIR'])
+
+    if _gevent_patched():
+        # let other greenlets run while psycopg2 waits on the server
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+    connect_db(app)
+    deadlines.init_app(app)
+    shard_router.init_app(app)
+    timeline_cache.init_app(app)
+    message_archive.init_app(app)
+    image_proxy.init_app(app)
+    assets.init_app(app)
+    timeline_broker.init_app(app)
+    rate_limiter.init_app(app)
+    author_cards.init_app(app)
+    taken_names.init_app(app)
+    hot_keys.init_app(app)
+    notifier.init_app(app)
+
+    app.register_blueprint(views.bp)
+    # after the blueprint, whose hooks set g.user
+    request_profiler.init_app(app)
+    for command in views.COMMANDS:
+        app.cli.add_command(command)
+
+    if app.config['PROXY_HOPS']:
+        app.wsgi_app = _trust_proxies(app.wsgi_app, app.config['PROXY_HOPS'])
+
+    app.wsgi_app = CompressMiddleware(
+        app.wsgi_app,
+        min_size=app.config['COMPRESS_MIN_SIZE'],
+        level=app.config['COMPRESS_LEVEL'],
+        brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'])
+
+    if app.config['PRECOMPILE_TEMPLATES']:
+        for name in app.jinja_env.list_templates(extensions=['html']):
+            app.jinja_env.get_template(name)
+
+    return app
+
+
+def _trust_proxies(wsgi_app, hops):
+    """Take the client's address from the X-Forwarded-For entry added
+    by the `hops`-th proxy from us."""
+
+    try:
+        # Werkzeug 0.14, as pinned
+        from werkzeug.contrib.fixers import ProxyFix
+    except ImportError:
+        # moved (and its arguments renamed) in Werkzeug 0.15
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        return ProxyFix(wsgi_app, x_for=hops)
+    return ProxyFix(wsgi_app, num_proxies=hops)
+
+
+def _gevent_patched():
+    """Are we on a gevent worker (or otherwise monkey-patched)?"""
+
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+
+def __getattr__(name):
+    """Create the module-level `app` lazily, on first use."""
+
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,302 @@
+"""Monthly partitions of the messages table and their cold archive.
+
+On Postgres `messages` can be range-partitioned by month. Message ids are
+snowflakes (see snowflake.py), so a month is simply a range of ids and the
+primary key doubles as the partition key. `create_partitions` makes sure
+partitions exist for the coming months.
+
+Partitions older than the retention window are moved by
+`archive_partitions` into compressed columnar files on local disk, one per
+month. `MessageArchive` reads those files back so profile pages can keep
+paging past the rows still in the database. The archive itself does not
+need Postgres and works with any database.
+
+Next to each month's file, a per-user file holds every author's messages
+that month as a separately compressed block, with an index of where each
+author's block starts. A profile page reads the index and just that
+author's blocks, rather than decoding whole months.
+"""
+
+import gzip
+import json
+import os
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+from sqlalchemy import text
+
+from snowflake import make_id, to_millis
+
+ArchivedMessage = namedtuple('ArchivedMessage',
+                             ['id', 'text', 'timestamp', 'user_id'])
+
+COLUMNS = ('user_id', 'id', 'timestamp', 'text')
+
+
+def month_start(year, month):
+    """First day of the given month, wrapping months past December."""
+
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1)
+
+
+def month_bounds(year, month):
+    """Message id range [low, high) covering the given month."""
+
+    low = make_id(to_millis(month_start(year, month)), 0, 0)
+    high = make_id(to_millis(month_start(year, month + 1)), 0, 0)
+    return low, high
+
+
+def partition_name(year, month):
+    return f"messages_y{year:04d}m{month:02d}"
+
+
+##############################################################################
+# Postgres partition maintenance
+
+
+def create_partitions(conn, months_ahead=3, since=None, now=None):
+    """Create any missing partitions up to `months_ahead` months from now.
+
+    Partitions start at this month, or at the month of `since` if given.
+    """
+
+    now = now or datetime.utcnow()
+    since = since or now
+    months = ((now.year - since.year) * 12 + now.month - since.month
+              + months_ahead)
+    created = []
+
+    for offset in range(months + 1):
+        start = month_start(since.year, since.month + offset)
+        name = partition_name(start.year, start.month)
+        low, high = month_bounds(start.year, start.month)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages "
+            f"FOR VALUES FROM ({low}) TO ({high})"))
+        created.append(name)
+
+    return created
+
+
+def list_partitions(conn):
+    """Names of the partitions currently attached to messages, oldest
+    first."""
+
+    rows = conn.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+        JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+        WHERE parent.relname = 'messages'
+        ORDER BY child.relname"""))
+    return [name for name, in rows]
+
+
+def archive_partitions(conn, archive, retention_months, now=None):
+    """Move partitions older than `retention_months` into `archive`.
+
+    Each partition is written to disk before it is detached and dropped.
+    Likes, tags and mentions of archived messages are deleted along with
+    them.
+    """
+
+    now = now or datetime.utcnow()
+    cutoff = month_start(now.year, now.month - retention_months)
+    archived = []
+
+    for name in list_partitions(conn):
+        year, month = int(name[10:14]), int(name[15:17])
+        if month_start(year, month) >= cutoff:
+            continue
+
+        rows = conn.execute(text(
+            f"SELECT user_id, id, timestamp, text FROM {name}"))
+        archive.write(year, month, rows)
+
+        low, high = month_bounds(year, month)
+        for table in ('likes', 'message_tags', 'message_mentions'):
+            conn.execute(text(f"DELETE FROM {table} WHERE message_id >= :low "
+                              "AND message_id < :high"), low=low, high=high)
+        conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+        conn.execute(text(f"DROP TABLE {name}"))
+        archived.append(name)
+
+    return archived
+
+
+##############################################################################
+# Cold archive
+
+
+class MessageArchive:
+    """Directory of gzipped columnar message files, one per month.
+
+    Each file holds one JSON array per column, with rows sorted by
+    (user_id, id descending) so one author's messages are a contiguous,
+    newest-first slice found by bisecting the user_id column.
+
+    users-YYYY-MM.blocks holds the same rows as one zlib-compressed JSON
+    block ({'id', 'timestamp', 'text'} columns) per author, and
+    users-YYYY-MM.index.json the sorted user ids with each block's offset
+    and size.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def init_app(self, app):
+        """Read the archive directory from the Flask app's config."""
+
+        self.directory = app.config.setdefault('MESSAGE_ARCHIVE_DIR',
+                                               self.directory)
+
+    def path(self, year, month):
+        return os.path.join(self.directory,
+                            f"messages-{year:04d}-{month:02d}.json.gz")
+
+    def users_path(self, year, month):
+        """Path of a month's per-user files, less .blocks/.index.json."""
+
+        return os.path.join(self.directory, f"users-{year:04d}-{month:02d}")
+
+    def write(self, year, month, rows):
+        """Write (user_id, id, timestamp, text) rows for one month."""
+
+        rows = sorted(rows, key=lambda row: (row[0], -row[1]))
+        columns = {name: [row[i] for row in rows]
+                   for i, name in enumerate(COLUMNS)}
+        columns['timestamp'] = [ts.isoformat() for ts in columns['timestamp']]
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(year, month)
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(columns, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+        self._write_users(year, month, columns)
+
+    def _write_users(self, year, month, columns):
+        """Write a month's per-user blocks and their index."""
+
+        base = self.users_path(year, month)
+        user_ids = columns['user_id']
+        index = {'user_id': [], 'offset': [], 'size': []}
+
+        with open(base + '.blocks.tmp', 'wb') as f:
+            start = 0
+            while start < len(user_ids):
+                end = bisect_right(user_ids, user_ids[start], start)
+                block = zlib.compress(json.dumps(
+                    {name: columns[name][start:end]
+                     for name in ('id', 'timestamp', 'text')},
+                    separators=(',', ':')).encode('utf-8'))
+                index['user_id'].append(user_ids[start])
+                index['offset'].append(f.tell())
+                index['size'].append(len(block))
+                f.write(block)
+                start = end
+        os.replace(base + '.blocks.tmp', base + '.blocks')
+
+        # written last: its presence means the blocks are complete
+        with open(base + '.index.json.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(base + '.index.json.tmp', base + '.index.json')
+
+    def months(self):
+        """Archived (year, month) pairs, newest first."""
+
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+
+        found = []
+        for filename in os.listdir(self.directory):
+            if filename.startswith('messages-') and filename.endswith('.gz'):
+                year, month = filename[9:16].split('-')
+                found.append((int(year), int(month)))
+        return sorted(found, reverse=True)
+
+    def boundary(self):
+        """Messages with ids below this are only in the archive; None
+        if nothing is archived."""
+
+        months = self.months()
+        return month_bounds(*months[0])[1] if months else None
+
+    def columns(self, year, month):
+        """One archived month as {column: list}, see COLUMNS."""
+
+        return _load(self.path(year, month))
+
+    def user_messages(self, user_id, before=None, limit=100):
+        """Up to `limit` archived messages of `user_id`, newest first,
+        with ids below `before` if given."""
+
+        found = []
+
+        for year, month in self.months():
+            low, _ = month_bounds(year, month)
+            if before is not None and low >= before:
+                continue
+
+            rows = self._user_rows(year, month, user_id)
+            if rows is None:
+                continue
+
+            for msg_id, timestamp, body in zip(rows['id'], rows['timestamp'],
+                                               rows['text']):
+                if before is not None and msg_id >= before:
+                    continue
+                found.append(ArchivedMessage(
+                    id=msg_id,
+                    text=body,
+                    timestamp=datetime.fromisoformat(timestamp),
+                    user_id=user_id))
+                if len(found) == limit:
+                    return found
+
+        return found
+
+    def _user_rows(self, year, month, user_id):
+        """`user_id`'s block of one month, or None if they have none."""
+
+        base = self.users_path(year, month)
+        if not os.path.exists(base + '.index.json'):
+            # archived before there were per-user files
+            self._write_users(year, month, self.columns(year, month))
+
+        index = _load_index(base + '.index.json')
+        i = bisect_left(index['user_id'], user_id)
+        if i == len(index['user_id']) or index['user_id'][i] != user_id:
+            return None
+
+        with open(base + '.blocks', 'rb') as f:
+            f.seek(index['offset'][i])
+            block = f.read(index['size'][i])
+        return json.loads(zlib.decompress(block))
+
+
+@lru_cache(maxsize=16)
+def _load(path):
+    """Parse an archive file; files never change once written."""
+
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=24)
+def _load_index(path):
+    """Parse a per-user index into compact arrays; never changes."""
+
+    with open(path, encoding='utf-8') as f:
+        return {name: array('q', values)
+                for name, values in json.load(f).items()}
+
+
+message_archive = MessageArchive()
@@ -0,0 +1,172 @@
+"""Fingerprinted, minified and precompressed static assets.
+
+`build` turns everything under `static/` into `static/build/`:
+
+- CSS is minified, and its url(...) references are rewritten to point at
+  the built copies.
+- PNG and JPEG images are re-encoded with Pillow's optimizer, if Pillow is
+  installed.
+- Every file gets a content hash in its name.
+- Text assets also get `.gz` and `.br` siblings (`.br` only if brotli is
+  installed).
+
+`manifest.json` maps each logical name (e.g. `stylesheets/style.css`) to
+its built file name. At runtime the `static_url()` Jinja global resolves
+logical names through the manifest. Without a build it falls back to the
+plain file.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt'}
+IMAGES = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+
+# Precompressed variants, most preferred first.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def minify_css(css):
+    """Strip comments and collapsible whitespace from a stylesheet."""
+
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    # colons only inside declaration blocks; in selectors a space before
+    # a pseudo-class is significant
+    css = re.sub(r'\{[^}]*\}',
+                 lambda m: re.sub(r'\s*:\s*', ':', m.group()), css)
+    css = css.replace(';}', '}')
+    return css.strip()
+
+
+def optimize_image(data, ext):
+    """Losslessly re-encode PNGs and re-encode JPEGs at high quality."""
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+
+    image = Image.open(BytesIO(data))
+    out = BytesIO()
+    if IMAGES[ext] == 'PNG':
+        image.save(out, 'PNG', optimize=True)
+    else:
+        image.save(out, 'JPEG', quality=85, optimize=True, progressive=True)
+
+    # keep the original if re-encoding didn't help
+    return out.getvalue() if out.tell() < len(data) else data
+
+
+def build(static_folder):
+    """Build all assets under `static_folder` and write the manifest."""
+
+    build_dir = os.path.join(static_folder, BUILD_DIR)
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+    names = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs
+                   if os.path.join(root, d) != build_dir]
+        for filename in files:
+            path = os.path.join(root, filename)
+            names.append(os.path.relpath(path, static_folder)
+                         .replace(os.sep, '/'))
+
+    # stylesheets go last, so url(...) references can be rewritten
+    names.sort(key=lambda name: (name.endswith('.css'), name))
+
+    manifest = {}
+    for name in names:
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            data = f.read()
+
+        base, ext = os.path.splitext(name)
+        ext = ext.lower()
+        if ext == '.css':
+            css = minify_css(data.decode('utf-8'))
+            css = re.sub(
+                r'url\(\s*["\']?/static/([^"\')]+)["\']?\s*\)',
+                lambda m: (f'url("/static/{BUILD_DIR}/'
+                           f'{manifest.get(m.group(1), m.group(1))}")'),
+                css)
+            data = css.encode('utf-8')
+        elif ext in IMAGES:
+            data = optimize_image(data, ext)
+
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        built = f"{base}.{digest}{ext}"
+        manifest[name] = built
+
+        out_path = os.path.join(build_dir, built)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, 'wb') as f:
+            f.write(data)
+
+        if ext in COMPRESSIBLE:
+            with open(out_path + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, 9))
+            if brotli is not None:
+                with open(out_path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+
+    with open(os.path.join(build_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+class Assets:
+    """Resolves logical static names to fingerprinted build files."""
+
+    def __init__(self):
+        self.manifest = {}
+
+    def init_app(self, app):
+        """Load the manifest and register the `static_url()` global."""
+
+        path = os.path.join(app.static_folder, BUILD_DIR, MANIFEST)
+        try:
+            with open(path) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+        app.add_template_global(self.static_url, 'static_url')
+
+    def static_url(self, name):
+        """URL of static file `name`, fingerprinted if it has been built."""
+
+        built = self.manifest.get(name)
+        if built is None:
+            return f"/static/{name}"
+        return f"/static/{BUILD_DIR}/{built}"
+
+
+def precompressed(path, accept_encodings):
+    """Best precompressed sibling of `path` the client accepts.
+
+    Returns (path, content encoding or None).
+    """
+
+    for encoding, suffix in ENCODINGS:
+        if accept_encodings.quality(encoding) and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+assets = Assets()
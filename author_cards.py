@@ -0,0 +1,321 @@
+"""Author display cards shared by every worker on a host.
+
+Every rendered message shows its author's username and picture. Instead
+of loading each author's User row (or keeping a dict per worker), the
+id, username and image_url of recently shown authors live in a
+fixed-size file mapped into every worker's memory, so one worker's
+database fetch serves all of them.
+
+Layout: a header, then sets of WAYS slots. A user id maps to one set and
+may sit in any of its slots; when the set is full, the oldest card is
+evicted. The file never grows, so memory is bounded by
+AUTHOR_CARDS_SLOTS. Cards that don't fit a slot (very long image URLs)
+are simply not cached.
+
+Readers take no lock. Each slot starts with a sequence number (a
+seqlock): a writer makes it odd, writes the card, then makes it even
+again. A reader copies the slot and checks that the sequence number was
+even and unchanged; otherwise it retries. Writers in different processes
+serialize on flock().
+
+Invalidation: profile() calls invalidate(), which drops the card and
+bumps its set's generation. A worker only stores a card it fetched if
+the generation is unchanged since before the fetch, so a fetch that
+raced with an update can't put the old card back. Cards are also
+dropped after AUTHOR_CARDS_TTL seconds, which bounds how long other
+hosts (with their own files) show an old card.
+
+Each layout version and size gets a file of its own,
+AUTHOR_CARDS_PATH.v<version>-<sets>x<slot size>, so a deploy that
+changes either never resizes a file that running workers have mapped
+(which would kill them with SIGBUS on their next access). A new file is
+sized and given its header under a temporary name, then linked into
+place. Files of other layouts are unlinked then; workers still using
+one keep their mapping until they exit. A file whose header doesn't
+match (damaged) is wiped in place.
+"""
+
+import fcntl
+import glob
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from queries import author_card_rows
+
+AuthorCard = namedtuple('AuthorCard', 'id username image_url')
+
+LAYOUT_VERSION = 1
+WAYS = 4
+SLOT_SIZE = 256
+
+HEADER = struct.Struct('<4sIII')           # magic, version, sets, slot size
+MAGIC = b'WCRD'
+GENERATION = struct.Struct('<Q')
+SEQ = struct.Struct('<Q')
+CARD = struct.Struct('<qdBH')              # user id, stored at,
+                                           # username len, image_url len
+SLOT = struct.Struct('<QqdBH')             # SEQ + CARD
+SET_SIZE = GENERATION.size + WAYS * SLOT_SIZE
+
+# a reader gives up (and treats the card as a miss) after this many
+# torn reads in a row
+READ_RETRIES = 5
+
+
+class AuthorCards:
+    """Shared-memory cache of AuthorCard by user id."""
+
+    def __init__(self, path=None, slots=65536, ttl=300):
+        self.path = path
+        self.sets = slots // WAYS
+        self.ttl = ttl
+        self._mm = None
+        self._lock_file = None
+        self._pid = None
+        self._thread_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure from AUTHOR_CARDS_* settings.
+
+        AUTHOR_CARDS_PATH None keeps the cache private to this process.
+        """
+
+        self.path = app.config.setdefault(
+            'AUTHOR_CARDS_PATH',
+            os.path.join(tempfile.gettempdir(), 'warbler-author-cards'))
+        self.sets = app.config.setdefault('AUTHOR_CARDS_SLOTS',
+                                          self.sets * WAYS) // WAYS
+        self.ttl = app.config.setdefault('AUTHOR_CARDS_TTL', self.ttl)
+        self._mm = None
+
+    ##########################################################################
+    # mapping
+
+    def _map(self):
+        """This process's mapping; reopened after fork, so each process
+        has its own flock()."""
+
+        if self._mm is not None and self._pid == os.getpid():
+            return self._mm
+
+        if self._lock_file is not None:
+            self._lock_file.close()
+        size = HEADER.size + self.sets * SET_SIZE
+        if self.path is None:
+            self._mm = mmap.mmap(-1, size)
+            self._lock_file = None
+        else:
+            fd = self._open(self.file_path(), size)
+            self._lock_file = os.fdopen(fd, 'r+b')
+            with self._locked():
+                self._mm = mmap.mmap(fd, size)
+                if HEADER.unpack_from(self._mm) != self._header():
+                    self._mm[:] = bytes(size)
+                    HEADER.pack_into(self._mm, 0, *self._header())
+        if self.path is None:
+            HEADER.pack_into(self._mm, 0, *self._header())
+        self._pid = os.getpid()
+        return self._mm
+
+    def file_path(self):
+        """The file for this layout version and size."""
+
+        return f"{self.path}.v{LAYOUT_VERSION}-{self.sets}x{SLOT_SIZE}"
+
+    def _open(self, path, size):
+        """Descriptor of `path`, created complete if missing."""
+
+        try:
+            return os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            pass
+
+        directory, name = os.path.split(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory or None,
+                                        prefix=name + '.tmp-')
+        try:
+            os.ftruncate(fd, size)
+            os.pwrite(fd, HEADER.pack(*self._header()), 0)
+            os.link(tmp_path, path)
+        except FileExistsError:
+            # another process got there first: use theirs
+            os.close(fd)
+            return os.open(path, os.O_RDWR)
+        except BaseException:
+            os.close(fd)
+            raise
+        finally:
+            os.unlink(tmp_path)
+
+        for stale in glob.glob(glob.escape(self.path) + '.v*'):
+            if stale != path:
+                os.unlink(stale)
+        return fd
+
+    def _header(self):
+        return MAGIC, LAYOUT_VERSION, self.sets, SLOT_SIZE
+
+    def _locked(self):
+        return _WriteLock(self._thread_lock, self._lock_file)
+
+    def _set_offset(self, user_id):
+        return HEADER.size + (user_id % self.sets) * SET_SIZE
+
+    ##########################################################################
+    # reading
+
+    def get(self, user_id):
+        """Card for `user_id`, or None if there's no such user."""
+
+        return self.get_many([user_id]).get(user_id)
+
+    def get_many(self, user_ids):
+        """{user id: AuthorCard} for `user_ids`; unknown users are left out.
+
+        Misses are fetched from the database in one query and stored.
+        """
+
+        mm = self._map()
+        now = time.time()
+        cards = {}
+        missing = {}
+        for user_id in set(user_ids):
+            card, generation = self._read(mm, user_id, now)
+            if card is None:
+                missing[user_id] = generation
+            else:
+                cards[user_id] = card
+
+        if missing:
+            fetched = [AuthorCard(*row) for row in author_card_rows(missing)]
+            self._store(mm, fetched, missing)
+            cards.update((card.id, card) for card in fetched)
+        return cards
+
+    def _read(self, mm, user_id, now):
+        """(card or None, the set's generation when it was read)."""
+
+        offset = self._set_offset(user_id)
+        for _ in range(READ_RETRIES):
+            generation, = GENERATION.unpack_from(mm, offset)
+            for way in range(WAYS):
+                slot = offset + GENERATION.size + way * SLOT_SIZE
+                seq, = SEQ.unpack_from(mm, slot)
+                data = mm[slot:slot + SLOT_SIZE]
+                seq_after, = SEQ.unpack_from(mm, slot)
+                if seq % 2 or seq != seq_after:
+                    break                   # torn: a writer is in the slot
+
+                _, slot_user, stored_at, name_len, url_len = \
+                    SLOT.unpack_from(data)
+                if slot_user != user_id:
+                    continue
+                if now - stored_at > self.ttl:
+                    return None, generation
+                start = SLOT.size
+                username = data[start:start + name_len].decode()
+                image_url = data[start + name_len:
+                                 start + name_len + url_len].decode()
+                return (AuthorCard(user_id, username, image_url or None),
+                        generation)
+            else:
+                return None, generation
+        return None, generation
+
+    ##########################################################################
+    # writing
+
+    def _store(self, mm, cards, generations):
+        now = time.time()
+        with self._locked():
+            for card in cards:
+                offset = self._set_offset(card.id)
+                generation, = GENERATION.unpack_from(mm, offset)
+                if generation != generations[card.id]:
+                    continue                # invalidated while we fetched
+                payload = (card.username.encode() +
+                           (card.image_url or '').encode())
+                if SLOT.size + len(payload) > SLOT_SIZE:
+                    continue
+                self._write(mm, self._victim(mm, offset, card.id),
+                            card, payload, now)
+
+    def _victim(self, mm, offset, user_id):
+        """Slot to write `user_id`'s card to: its own, a free one, or the
+        oldest."""
+
+        slots = [offset + GENERATION.size + way * SLOT_SIZE
+                 for way in range(WAYS)]
+        entries = [SLOT.unpack_from(mm, slot)[1:3] for slot in slots]
+        for slot, (slot_user, _) in zip(slots, entries):
+            if slot_user == user_id:
+                return slot
+        for slot, (slot_user, _) in zip(slots, entries):
+            if slot_user == 0:
+                return slot
+        return min(zip(slots, entries), key=lambda e: e[1][1])[0]
+
+    def _write(self, mm, slot, card, payload, now):
+        seq, = SEQ.unpack_from(mm, slot)
+        SEQ.pack_into(mm, slot, seq + 1)
+        mm[slot + SLOT.size:slot + SLOT.size + len(payload)] = payload
+        CARD.pack_into(mm, slot + SEQ.size, card.id, now,
+                       len(card.username.encode()),
+                       len((card.image_url or '').encode()))
+        SEQ.pack_into(mm, slot, seq + 2)
+
+    def _drop(self, mm, offset, user_id=None):
+        """Bump the set's generation and empty its slot for `user_id` (or
+        every slot)."""
+
+        generation, = GENERATION.unpack_from(mm, offset)
+        GENERATION.pack_into(mm, offset, generation + 1)
+        for way in range(WAYS):
+            slot = offset + GENERATION.size + way * SLOT_SIZE
+            seq, slot_user = SLOT.unpack_from(mm, slot)[:2]
+            if slot_user and (user_id is None or slot_user == user_id):
+                SEQ.pack_into(mm, slot, seq + 1)
+                CARD.pack_into(mm, slot + SEQ.size, 0, 0, 0, 0)
+                SEQ.pack_into(mm, slot, seq + 2)
+
+    def invalidate(self, user_id):
+        """Drop `user_id`'s card on this host, e.g. after a profile edit."""
+
+        mm = self._map()
+        with self._locked():
+            self._drop(mm, self._set_offset(user_id), user_id)
+
+    def clear(self):
+        """Drop every card."""
+
+        mm = self._map()
+        with self._locked():
+            for offset in range(HEADER.size, len(mm), SET_SIZE):
+                self._drop(mm, offset)
+
+
+class _WriteLock:
+    """Excludes other threads, and other processes when the cache is a
+    file."""
+
+    def __init__(self, thread_lock, lock_file):
+        self.thread_lock = thread_lock
+        self.lock_file = lock_file
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+
+author_cards = AuthorCards()
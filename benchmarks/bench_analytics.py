@@ -0,0 +1,140 @@
+"""The analytics job at scale: reading a snapshot, and aggregating one.
+
+- aggregate: a synthetic snapshot of --messages messages (default 50M) by
+  1M users over three years, with a like per five messages and 20
+  follows per user, is written in the snapshot's file format, then
+  aggregated as `flask analytics --from-snapshot` would;
+- read (with --read): snapshots the tables of DATABASE_URL, a Postgres
+  database it may write to (e.g. a scratch `warbler-bench`). --seed N
+  first fills it up to N messages with generate_series.
+
+run it from the project root like:
+
+    python -m benchmarks.bench_analytics [--messages 50000000]
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.bench_analytics --read --seed 5000000
+"""
+
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault('FLASK_ENV', 'production')
+
+from analytics import (_ColumnWriter, SNAPSHOT, aggregate,  # noqa: E402
+                       load_snapshot, snapshot)
+from snowflake import make_id, to_millis  # noqa: E402
+
+USERS = 1_000_000
+YEARS = 3
+CHUNK = 5_000_000
+
+
+def synthetic(directory, messages, seed=0):
+    """Write a snapshot of `messages` messages to `directory`."""
+
+    rng = np.random.default_rng(seed)
+    out_dir = os.path.join(directory, SNAPSHOT)
+    os.makedirs(out_dir)
+
+    with _ColumnWriter(out_dir) as out:
+        end = to_millis(out.taken)
+        start = end - YEARS * 365 * 86_400_000
+        out.append(user_id=np.arange(1, USERS + 1))
+        for low in range(1, USERS + 1, CHUNK // 20):
+            followers = np.arange(low, min(low + CHUNK // 20, USERS + 1))
+            followed = (followers[:, None] * 7 + np.arange(20)) % USERS + 1
+            out.append(followed=followed.ravel(),
+                       follower=np.repeat(followers, 20))
+
+        # in id order, chunk by chunk, like a shard read
+        step = (end - start) // max(messages // CHUNK, 1)
+        for i, low in enumerate(range(0, messages, CHUNK)):
+            n = min(CHUNK, messages - low)
+            millis = np.sort(rng.integers(start + i * step,
+                                          start + (i + 1) * step, n))
+            ids = make_id(millis, 1, 0) | (np.arange(n) & 0xfff)
+            # a few users post most messages
+            users = (rng.random(n) ** 3 * USERS).astype(np.int64) + 1
+            out.append(message_id=ids, message_user=users,
+                       like_message=ids[::5])
+
+
+def bench_aggregate(messages):
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        synthetic(tmp, messages)
+        print(f"synthetic snapshot: {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        stats = aggregate(load_snapshot(tmp))
+        elapsed = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"aggregate: {stats['totals']['messages']:,} messages, "
+          f"{stats['totals']['likes']:,} likes, "
+          f"{stats['totals']['follows']:,} follows in {elapsed:.1f}s "
+          f"(peak RSS {peak:,.0f} MB)")
+
+
+def bench_read(seed):
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        if seed:
+            seed_messages(db, seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            snapshot(tmp, app.config['ANALYTICS_BATCH'], log=lambda line: None)
+            elapsed = time.perf_counter() - start
+            rows = sum(os.path.getsize(os.path.join(tmp, SNAPSHOT, name))
+                       for name in ('message_id', 'like_message')) // 8
+    print(f"read: {rows:,} message and like rows in {elapsed:.1f}s "
+          f"({rows / elapsed:,.0f} rows/s)")
+
+
+def seed_messages(db, count):
+    """Fill the database up to `count` messages (and likes of a fifth)."""
+
+    db.create_all()
+    with db.engine.begin() as conn:
+        conn.execute("""
+            INSERT INTO users (id, username, email, password)
+            SELECT g, 'bench' || g, 'bench' || g || '@bench.test', 'x'
+            FROM generate_series(1, 100000) g
+            ON CONFLICT DO NOTHING""")
+        have = conn.execute("SELECT count(*) FROM messages").scalar()
+        if have < count:
+            # one message per 5ms, going back from now
+            conn.execute(f"""
+                INSERT INTO messages (id, text, timestamp, user_id)
+                SELECT (floor(extract(epoch FROM now() - g * interval '5 ms'
+                                      - timestamp '2010-01-01') * 1000)::bigint << 22)
+                       | (1 << 12) | (g %% 4096),
+                       'bench', now(), 1 + (g * 7919) %% 100000
+                FROM generate_series({have + 1}::bigint, {count}) g
+                ON CONFLICT DO NOTHING""")
+            conn.execute("""
+                INSERT INTO likes (user_id, message_id)
+                SELECT 1 + (id %% 100000), id FROM messages
+                WHERE id %% 5 = 0
+                ON CONFLICT DO NOTHING""")
+            conn.execute("ANALYZE")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=50_000_000)
+    parser.add_argument('--read', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.read:
+        bench_read(args.seed)
+    else:
+        bench_aggregate(args.messages)
@@ -0,0 +1,176 @@
+"""Author cards: shared mmap cache vs. a dict per worker vs. the database.
+
+Pages show 60 authors drawn from a skewed (Zipf-like) popularity over
+USERS users. Measures:
+
+- the cost of looking up one page's authors when warm, for each source;
+- with WORKERS processes each rendering PAGES pages, how many cards had
+  to come from the database, and the memory each approach holds.
+
+Uses DATABASE_URL if set (it must have a users table with at least
+USERS users), otherwise a temporary SQLite file it fills itself.
+
+run it from the project root like:
+
+    python -m benchmarks.bench_author_cards [--users 20000] [--pages 2000]
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+WORKERS = 4
+PAGE = 60
+# the shared file is this big whatever is in it
+SLOTS = 16384
+
+
+def page_authors(rng, user_ids):
+    """One page's authors; a few authors are shown far more than the rest."""
+
+    return [user_ids[min(int(rng.paretovariate(1.2)) - 1, len(user_ids) - 1)]
+            for _ in range(PAGE)]
+
+
+def app_context(cards_path):
+    os.environ.setdefault('FLASK_ENV', 'testing')
+    from app import create_app
+
+    app = create_app()
+    app.config['AUTHOR_CARDS_PATH'] = cards_path
+    app.config['AUTHOR_CARDS_SLOTS'] = SLOTS
+    from author_cards import author_cards
+    author_cards.init_app(app)
+    return app.app_context()
+
+
+def user_ids(n):
+    from models import User, db
+    return [user_id for user_id, in
+            db.session.query(User.id).order_by(User.id).limit(n)]
+
+
+def populate(n):
+    from models import User, db
+
+    db.create_all()
+    if db.session.query(User.id).count() >= n:
+        return
+    db.session.bulk_insert_mappings(User, [
+        {'id': i, 'username': f"user{i}", 'email': f"{i}@test.com",
+         'password': 'x', 'image_url': f"https://img.example.com/{i}.jpg"}
+        for i in range(1, n + 1)])
+    db.session.commit()
+
+
+class DictCards:
+    """What each worker would do on its own."""
+
+    def __init__(self):
+        self.cards = {}
+        self.fetched = 0
+
+    def get_many(self, ids):
+        from author_cards import AuthorCard
+        from queries import author_card_rows
+
+        missing = {i for i in ids if i not in self.cards}
+        if missing:
+            for row in author_card_rows(missing):
+                self.cards[row[0]] = AuthorCard(*row)
+            self.fetched += len(missing)
+        return {i: self.cards[i] for i in ids if i in self.cards}
+
+
+def _worker(args):
+    kind, cards_path, n_users, pages, seed = args
+    with app_context(cards_path):
+        import author_cards as module
+        from author_cards import author_cards
+
+        ids = user_ids(n_users)
+        rng = random.Random(seed)
+        if kind == 'dict':
+            tracemalloc.start()
+            cache = DictCards()
+            for _ in range(pages):
+                cache.get_many(page_authors(rng, ids))
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            return cache.fetched, memory
+
+        fetched = 0
+        fetch = module.author_card_rows
+
+        def counting(missing):
+            nonlocal fetched
+            fetched += len(missing)
+            return fetch(missing)
+
+        module.author_card_rows = counting
+        for _ in range(pages):
+            author_cards.get_many(page_authors(rng, ids))
+        return fetched, 0
+
+
+def per_page(get_many, pages, n=500):
+    for page in pages:
+        get_many(page)
+    start = time.perf_counter()
+    for i in range(n):
+        get_many(pages[i % len(pages)])
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--pages', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if 'DATABASE_URL' not in os.environ:
+            os.environ['DATABASE_URL'] = ('sqlite:///' +
+                                          os.path.join(tmp, 'bench.db'))
+        cards_path = os.path.join(tmp, 'cards')
+
+        with app_context(cards_path):
+            from author_cards import author_cards
+            from queries import author_card_rows
+
+            populate(args.users)
+            ids = user_ids(args.users)
+            if len(ids) < args.users:
+                sys.exit(f"need {args.users} users, found {len(ids)}")
+            rng = random.Random(0)
+            pages = [page_authors(rng, ids) for _ in range(20)]
+
+            print(f"one page ({PAGE} authors), warm:")
+            print(f"  database     {per_page(author_card_rows, pages):8.0f} us")
+            print(f"  dict         {per_page(DictCards().get_many, pages):8.0f} us")
+            print(f"  mmap         {per_page(author_cards.get_many, pages):8.0f} us")
+            author_cards.clear()
+
+        ctx = multiprocessing.get_context('fork')
+        print(f"\n{WORKERS} workers x {args.pages} pages:")
+        for kind in ('dict', 'mmap'):
+            with ctx.Pool(WORKERS) as pool:
+                results = pool.map(_worker, [
+                    (kind, cards_path, args.users, args.pages, seed)
+                    for seed in range(WORKERS)])
+            fetched = sum(r[0] for r in results)
+            if kind == 'dict':
+                memory = sum(r[1] for r in results)
+            else:
+                memory = os.path.getsize(cards_path)
+            print(f"  {kind:<6}cards fetched {fetched:8d}    "
+                  f"memory, all workers {memory / 1024:6.0f} KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""False-positive rate, memory and lookup cost of the taken-names filter.
+
+Fills one BloomFilter (taken_names.py; the app keeps two, usernames and
+emails) with USERS usernames and reports:
+
+- its memory and number of hash functions;
+- the measured false-positive rate over names not in it, against the
+  configured one: the share of free names that still cost an indexed
+  query;
+- the cost of one lookup, next to the bcrypt hash a duplicate signup
+  used to pay for before failing.
+
+Filling 10M names takes a few minutes.
+
+run it from the project root like:
+
+    python -m benchmarks.bench_bloom [--users 10000000] [--error-rate 0.01]
+"""
+
+import argparse
+import time
+
+from flask_bcrypt import Bcrypt
+
+from taken_names import BloomFilter
+
+PROBES = 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10_000_000)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    args = parser.parse_args()
+
+    bloom = BloomFilter(args.users, args.error_rate)
+    start = time.perf_counter()
+    for i in range(args.users):
+        bloom.add(f"user{i}")
+    filled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    false_positives = sum(f"free{i}" in bloom for i in range(PROBES))
+    lookup = (time.perf_counter() - start) / PROBES * 1e6
+
+    hash_start = time.perf_counter()
+    Bcrypt().generate_password_hash("password")
+    bcrypt = (time.perf_counter() - hash_start) * 1e6
+
+    print(f"{args.users:,} usernames, {bloom.hashes} hashes, "
+          f"filled in {filled:.0f} s")
+    print(f"  memory            {len(bloom.bits) / 2 ** 20:10.1f} MB "
+          f"({bloom.size / args.users:.1f} bits per name)")
+    print(f"  false positives   {false_positives / PROBES:10.3%} "
+          f"(configured {args.error_rate:.3%}, {PROBES:,} free names)")
+    print(f"  lookup            {lookup:10.1f} us")
+    print(f"  bcrypt hash       {bcrypt:10.0f} us (default rounds)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""CPU cost vs. bytes saved of response compression.
+
+Compresses a 100-message timeline and a 300-user directory page, both
+built from the sample data in generator/, at several gzip levels and
+brotli qualities.
+
+run it from the project root like:
+
+    python -m benchmarks.bench_compression
+"""
+
+import timeit
+from csv import DictReader
+
+from compression import Compressor, brotli
+
+MESSAGE = """
+<li class="list-group-item">
+  <a href="/messages/{id}" class="message-link"/>
+  <a href="/users/{user_id}">
+    <img src="/img/timeline/{digest}" alt="" class="timeline-image">
+  </a>
+  <div class="message-area">
+    <a href="/users/{user_id}">@{username}</a>
+    <span class="text-muted">21 January 2017</span>
+    <p>{text}</p>
+  </div>
+  <form method="POST" action='/users/add_like/{id}' id="messages-form">
+    <button class="btn btn-sm btn-secondary">
+      <i class="fa fa-thumbs-up"></i>
+    </button>
+  </form>
+</li>"""
+
+USER = """
+<div class="col-lg-4 col-md-6 col-12">
+  <div class="card user-card">
+    <div class="card-inner">
+      <div class="image-wrapper">
+        <img src="/img/card-hero/{digest}" alt="" class="card-hero">
+      </div>
+      <div class="card-contents">
+        <a href="/users/{id}" class="card-link">
+          <img src="/img/card/{digest}" alt="Image for {username}"
+               class="card-image">
+          <p>@{username}</p>
+        </a>
+        <form method="POST" action="/users/follow/{id}">
+          <button class="btn btn-outline-primary btn-sm">Follow</button>
+        </form>
+      </div>
+      <p class="card-bio">{bio}</p>
+    </div>
+  </div>
+</div>"""
+
+
+def sample_pages():
+    with open('generator/users.csv') as f:
+        users = list(DictReader(f))
+    with open('generator/messages.csv') as f:
+        messages = list(DictReader(f))
+
+    timeline = ''.join(
+        MESSAGE.format(id=7000000000000 + i, user_id=msg['user_id'],
+                       digest=f"{int(msg['user_id']):032x}",
+                       username=users[int(msg['user_id']) - 1]['username'],
+                       text=msg['text'])
+        for i, msg in enumerate(messages[:100]))
+    directory = ''.join(
+        USER.format(id=i + 1, digest=f"{i:032x}", **user)
+        for i, user in enumerate(users))
+
+    return {'timeline (100 messages)': timeline.encode('utf-8'),
+            'user directory (300 users)': directory.encode('utf-8')}
+
+
+def compress(encoding, level, body):
+    compressor = Compressor(encoding, level, level)
+    return compressor.compress(body) + compressor.finish()
+
+
+def main():
+    settings = [('gzip', level) for level in (1, 6, 9)]
+    if brotli is not None:
+        settings += [('br', quality) for quality in (1, 4, 11)]
+
+    for name, body in sample_pages().items():
+        print(f"{name}: {len(body):,} bytes")
+        print(f"  {'encoding':<10}{'size':>10}{'ratio':>8}"
+              f"{'us/response':>14}{'MB/s':>9}")
+        for encoding, level in settings:
+            size = len(compress(encoding, level, body))
+            runs = 50
+            seconds = timeit.timeit(lambda: compress(encoding, level, body),
+                                    number=runs) / runs
+            print(f"  {encoding + '-' + str(level):<10}{size:>10,}"
+                  f"{len(body) / size:>7.1f}x{seconds * 1e6:>14,.0f}"
+                  f"{len(body) / seconds / 1e6:>9.1f}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
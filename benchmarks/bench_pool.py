@@ -0,0 +1,134 @@
+"""The hot queries under concurrent load: pool settings and prepared
+statements.
+
+--threads threads (default 8) each make "requests" for --seconds: look
+up a user by id and by username, read 20 messages of their profile and
+the newest 100 ids of a 50-author feed, then hand the connection back.
+Compared:
+
+- default: Flask-SQLAlchemy's pool (5 connections, 10 more on overflow),
+  every statement parsed and planned each time;
+- pooled: engines.py's pool of --pool-size connections (default: one
+  per thread, as a gthread worker's is), pinged on checkout, no
+  overflow. A smaller pool shows requests waiting for connections;
+- prepared: the same, with the hot statements prepared.
+
+Each runs in its own process against DATABASE_URL, a Postgres database
+with users and messages (e.g. seeded by benchmarks/bench_analytics.py).
+Reports requests per second, latency percentiles, requests that found
+no connection in time, and the time spent waiting for one.
+
+run it from the project root like:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.bench_pool [--threads 8] [--pool-size 4]
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import threading
+import time
+
+os.environ.setdefault('FLASK_ENV', 'production')
+
+USERS = 100_000
+FEED_AUTHORS = 50
+
+
+def run(variant, threads, seconds, pool_size, out):
+    import engines
+    from app import create_app
+    from config import ProductionConfig
+    from sqlalchemy.exc import TimeoutError
+    from models import db, User
+    from queries import (user_by_id, user_by_username, user_messages_before,
+                         feed_ids, NEWEST)
+
+    if variant == 'default':
+        engines.engine_options = lambda config: {}
+
+    class Bench(ProductionConfig):
+        DB_POOL_SIZE = pool_size
+        DB_PREPARED_STATEMENTS = variant == 'prepared'
+        PRECOMPILE_TEMPLATES = False
+
+    app = create_app(Bench)
+    with app.app_context():
+        names = dict(User.query.with_entities(User.id, User.username)
+                     .filter(User.id <= USERS))
+    user_ids = list(names)
+
+    latencies = []
+    timeouts = []
+    deadline = time.perf_counter() + seconds
+
+    def client(seed):
+        rng = random.Random(seed)
+        done = []
+        while time.perf_counter() < deadline:
+            user_id = rng.choice(user_ids)
+            start = time.perf_counter()
+            with app.app_context():
+                try:
+                    user_by_id(user_id)
+                    user_by_username(names[user_id])
+                    user_messages_before(user_id, NEWEST, 20)
+                    feed_ids(rng.sample(user_ids, FEED_AUTHORS), 100)
+                except TimeoutError:
+                    # no connection within DB_POOL_TIMEOUT
+                    timeouts.append(user_id)
+                    continue
+                finally:
+                    db.session.remove()
+            done.append(time.perf_counter() - start)
+        latencies.extend(done)
+
+    running = [threading.Thread(target=client, args=(i,))
+               for i in range(threads)]
+    for thread in running:
+        thread.start()
+    for thread in running:
+        thread.join()
+
+    with app.app_context():
+        pool = db.get_engine().pool
+        waits = (pool.status_summary()
+                 if isinstance(pool, engines.TimedQueuePool) else None)
+    out.put((sorted(latencies), len(timeouts), waits))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--pool-size', type=int)
+    parser.add_argument('--variant', action='append',
+                        choices=['default', 'pooled', 'prepared'])
+    args = parser.parse_args()
+    pool_size = args.pool_size or args.threads
+
+    for variant in args.variant or ['default', 'pooled', 'prepared']:
+        out = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=run, args=(
+            variant, args.threads, args.seconds, pool_size, out))
+        proc.start()
+        latencies, timeouts, waits = out.get()
+        proc.join()
+
+        print(f"{variant}, {args.threads} threads:")
+        print(f"  throughput  {len(latencies) / args.seconds:8.0f} "
+              f"requests/s")
+        print(f"  p50         {statistics.median(latencies) * 1000:8.2f} ms")
+        print(f"  p99         "
+              f"{latencies[int(len(latencies) * 0.99)] * 1000:8.2f} ms")
+        print(f"  timed out   {timeouts:8d}")
+        if waits:
+            print(f"  pool wait   {waits['mean_ms']:8.2f} ms mean, "
+                  f"{waits['max_ms']:.1f} ms max")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Posts per second for authors with 10, 10k and 1M existing messages.
+
+Compares, one request's database work each:
+
+- append: the old messages_add, `user.messages.append(msg)`, which
+  loads every message the author has before inserting;
+- insert: queries.post_message, one INSERT;
+- bulk: queries.post_messages with 100 messages per INSERT.
+
+Needs a Postgres DATABASE_URL whose database it may write to (e.g. a
+scratch `warbler-bench`). The first run creates users bench10, bench10k
+and bench1m and fills in their messages, which takes a few minutes; the
+messages posted while measuring are deleted afterwards.
+
+run it from the project root like:
+
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.bench_post_messages
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault('FLASK_ENV', 'production')
+# the only process making ids for the scratch database
+os.environ.setdefault('WARBLER_WORKER_ID', '0')
+
+from app import create_app  # noqa: E402
+from models import db, User, Message  # noqa: E402
+from queries import post_message, post_messages  # noqa: E402
+from snowflake import next_id  # noqa: E402
+
+AUTHORS = {'bench10': 10, 'bench10k': 10_000, 'bench1m': 1_000_000}
+SEED_BATCH = 5000
+BULK = 100
+SECONDS = 3
+
+
+def author(username, count):
+    """Id of `username`, with at least `count` messages."""
+
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        user = User(username=username, email=f"{username}@bench.test",
+                    password='x')
+        db.session.add(user)
+        db.session.commit()
+
+    have = Message.query.filter_by(user_id=user.id).count()
+    for start in range(have, count, SEED_BATCH):
+        post_messages(user.id, ["seed"] * min(SEED_BATCH, count - start))
+    user_id = user.id
+    db.session.remove()
+    return user_id
+
+
+def append(user_id):
+    user = User.query.get(user_id)
+    user.messages.append(Message(text="benchmark"))
+    db.session.commit()
+
+
+def insert(user_id):
+    User.query.get(user_id)             # g.user, as in a request
+    post_message(user_id, "benchmark")
+
+
+def bulk(user_id):
+    User.query.get(user_id)
+    post_messages(user_id, ["benchmark"] * BULK)
+
+
+def posts_per_second(fn, user_id, per_call):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn(user_id)
+        db.session.remove()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > SECONDS:
+            return calls * per_call / elapsed, calls
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            sys.exit("set DATABASE_URL to a scratch Postgres database")
+        db.create_all()
+
+        print(f"{'existing':>10}{'append':>14}{'insert':>14}{'bulk x100':>14}"
+              "   posts/sec (calls)")
+        for username, count in AUTHORS.items():
+            user_id = author(username, count)
+            watermark = next_id()
+
+            results = [posts_per_second(append, user_id, 1),
+                       posts_per_second(insert, user_id, 1),
+                       posts_per_second(bulk, user_id, BULK)]
+            print(f"{count:>10}" + ''.join(f"{rate:>9.2f} ({calls:>3})"
+                                           for rate, calls in results))
+
+            Message.query.filter(Message.user_id == user_id,
+                                 Message.id >= watermark).delete()
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""ORM overhead per request: queries built on every call vs. baked.
+
+Runs against an in-memory SQLite database with a few rows, so the time
+is almost all SQLAlchemy building, compiling and loading, not the
+database. Times each hot-path query built the old way and through
+queries.py, then a homepage request's queries (current user, who they
+follow, their likes, the page of messages) in a fresh session, like one
+request.
+
+run it from the project root like:
+
+    python -m benchmarks.bench_queries [-n 2000]
+"""
+
+import argparse
+import os
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+from app import create_app  # noqa: E402
+from models import db, User, Message, Likes, Follows  # noqa: E402
+import queries  # noqa: E402
+
+AUTHORS = 50
+PER_AUTHOR = 10
+
+
+def populate():
+    db.create_all()
+    for user_id in range(1, AUTHORS + 1):
+        db.session.add(User(id=user_id, username=f"user{user_id}",
+                            email=f"{user_id}@test.com", password="x"))
+    db.session.flush()
+    for msg_id in range(1, AUTHORS * PER_AUTHOR + 1):
+        db.session.add(Message(id=msg_id, text=f"warble {msg_id}",
+                               user_id=msg_id % AUTHORS + 1))
+    db.session.flush()
+    for user_id in range(2, AUTHORS + 1):
+        db.session.add(Follows(user_following_id=1,
+                               user_being_followed_id=user_id))
+    for msg_id in range(1, 101, 3):
+        db.session.add(Likes(user_id=1, message_id=msg_id))
+    db.session.commit()
+
+
+PAGE = list(range(AUTHORS * PER_AUTHOR, AUTHORS * PER_AUTHOR - 100, -1))
+AUTHOR_IDS = list(range(1, AUTHORS + 1))
+
+
+def old_messages_by_ids(ids):
+    by_id = {msg.id: msg for msg in Message.query.filter(Message.id.in_(ids))}
+    return [by_id[msg_id] for msg_id in ids if msg_id in by_id]
+
+
+OLD = {
+    'user by id': lambda: User.query.get(1),
+    'user by username': lambda: User.query.filter_by(username='user7').first(),
+    'like lookup': lambda: Likes.query.filter_by(user_id=1,
+                                                 message_id=4).first(),
+    'profile page': lambda: (Message.query
+                             .filter(Message.user_id == 2,
+                                     Message.id < 400)
+                             .order_by(Message.id.desc())
+                             .limit(100).all()),
+    'feed ids': lambda: [msg_id for msg_id, in
+                         db.session.query(Message.id)
+                         .filter(Message.user_id.in_(AUTHOR_IDS))
+                         .order_by(Message.id.desc()).limit(100)],
+}
+
+BAKED = {
+    'user by id': lambda: queries.user_by_id(1),
+    'user by username': lambda: queries.user_by_username('user7'),
+    'like lookup': lambda: queries.like(1, 4),
+    'profile page': lambda: queries.user_messages_before(2, 400, 100),
+    'feed ids': lambda: queries.feed_ids(AUTHOR_IDS, 100),
+}
+
+
+def old_homepage():
+    user = User.query.get(1)
+    author_ids = [f.id for f in user.following] + [user.id]
+    likes = [msg.id for msg in user.likes]
+    messages = old_messages_by_ids(PAGE)
+    # the template reads each message's author
+    return author_ids, likes, [msg.user.username for msg in messages]
+
+
+def baked_homepage():
+    user = queries.user_by_id(1)
+    author_ids = queries.followed_ids(user.id) + [user.id]
+    likes = queries.liked_message_ids(user.id)
+    messages = queries.messages_by_ids(PAGE)
+    return author_ids, likes, [msg.user.username for msg in messages]
+
+
+def per_call(fn, n):
+    """Mean microseconds per call in a fresh session, after a warm-up."""
+
+    fn()
+    db.session.remove()
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+        db.session.remove()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        populate()
+
+        print(f"{'':<20}{'built':>10}{'baked':>10}")
+        for name in OLD:
+            old = per_call(OLD[name], args.n)
+            baked = per_call(BAKED[name], args.n)
+            print(f"{name:<20}{old:>8.0f}us{baked:>8.0f}us")
+
+        n = max(1, args.n // 10)
+        old = per_call(old_homepage, n)
+        baked = per_call(baked_homepage, n)
+        print(f"{'homepage request':<20}{old:>8.0f}us{baked:>8.0f}us")
+
+
+if __name__ == '__main__':
+    main()
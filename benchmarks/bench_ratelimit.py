@@ -0,0 +1,66 @@
+"""Per-request overhead of the rate limiter.
+
+Times RateLimiter.hit for a limited endpoint with each storage:
+
+- one client hitting the same buckets;
+- 100,000 distinct clients;
+- for SQLite, also with 4 processes hitting the same file at once, like
+  workers on one host.
+
+run it from the project root like:
+
+    python -m benchmarks.bench_ratelimit
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+from ratelimit import RateLimiter, parse_limit, storage_for
+
+N = 20000
+
+
+def limiter(storage_url):
+    limiter = RateLimiter()
+    limiter.storage = storage_for(storage_url)
+    limiter.limits = {
+        'warbler.messages_add': [('user',) + parse_limit('1000000/second'),
+                                 ('ip',) + parse_limit('1000000/second')],
+    }
+    return limiter
+
+
+def per_hit(storage_url, clients, n=N):
+    """Mean microseconds per hit."""
+
+    rl = limiter(storage_url)
+    start = time.perf_counter()
+    for i in range(n):
+        client = i % clients
+        rl.hit('warbler.messages_add', 'POST', f"10.0.{client >> 8}."
+               f"{client & 255}", client)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def _worker(storage_url):
+    return per_hit(storage_url, 100000, N // 4)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_url = 'sqlite:///' + os.path.join(tmp, 'rl.db')
+
+        print("mean per request (two buckets):")
+        for name, url in (('memory', 'memory'), ('sqlite', sqlite_url)):
+            print(f"  {name:<8}one client     {per_hit(url, 1):7.1f} us")
+            print(f"  {name:<8}100k clients   {per_hit(url, 100000):7.1f} us")
+
+        with multiprocessing.Pool(4) as pool:
+            results = pool.map(_worker, [sqlite_url] * 4)
+        print(f"  sqlite  4 processes    {max(results):7.1f} us (slowest)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Throughput of `flask run` against the production entrypoint.
+
+Starts each server in a subprocess, then --clients keep-alive clients
+(spread over client processes) request profile pages of the first
+--users users, and the logged-out home page, for --seconds; or, given
+--path, just those paths (e.g. `--path / --path /login` for the server's
+own overhead, with little database work). Reports
+requests per second, latency percentiles and errors (anything but a
+200).
+
+Servers compared:
+
+- flask: `flask run`, werkzeug's development server, one thread per
+  request in one process;
+- gunicorn: `gunicorn -c gunicorn.conf.py wsgi:app`, preloaded and
+  prefork, WEB_CONCURRENCY workers of WARBLER_THREADS threads;
+- gunicorn-gevent: the same on gevent workers.
+
+Needs a database with users and messages (e.g. seeded as in
+benchmarks/bench_analytics.py).
+
+run it from the project root like:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.bench_server [--clients 32] [--seconds 10]
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+SERVERS = {
+    'flask': ['flask', 'run', '--port', '{port}'],
+    'gunicorn': ['gunicorn', '-c', 'gunicorn.conf.py', '-b',
+                 '127.0.0.1:{port}', 'wsgi:app'],
+    'gunicorn-gevent': ['gunicorn', '-c', 'gunicorn.conf.py', '-b',
+                        '127.0.0.1:{port}', '-k', 'gevent', 'wsgi:app'],
+}
+CLIENT_PROCESSES = 4
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start(server, port):
+    env = dict(os.environ, FLASK_APP='app.py', FLASK_ENV='production',
+               WARBLER_WORKER_CLASS='gevent' if server.endswith('gevent')
+               else 'gthread')
+    command = [arg.format(port=port) for arg in SERVERS[server]]
+    command[0] = os.path.join(os.path.dirname(sys.executable), command[0])
+    proc = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            return proc
+        except (ConnectionError, http.client.HTTPException):
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"{server} did not start")
+
+
+def client(port, paths, start_at, seconds, out):
+    """Request `paths` round-robin, from the `start_at`th, over one
+    connection for `seconds`."""
+
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    i = start_at
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.request('GET', paths[i % len(paths)])
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (ConnectionError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+        latencies.append(time.perf_counter() - start)
+        i += 1
+    out.append((latencies, errors))
+
+
+def client_process(port, paths, first, seconds, threads):
+    out = []
+    running = [threading.Thread(target=client,
+                                args=(port, paths, first + i, seconds, out))
+               for i in range(threads)]
+    for thread in running:
+        thread.start()
+    for thread in running:
+        thread.join()
+    return ([latency for latencies, _ in out for latency in latencies],
+            sum(errors for _, errors in out))
+
+
+def run(server, clients, seconds, paths):
+    port = free_port()
+    proc = start(server, port)
+    try:
+        with multiprocessing.Pool(CLIENT_PROCESSES) as pool:
+            threads = clients // CLIENT_PROCESSES
+            results = pool.starmap(client_process, [
+                (port, paths, i * threads, seconds, threads)
+                for i in range(CLIENT_PROCESSES)])
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    latencies = sorted(latency for done, _ in results for latency in done)
+    errors = sum(errors for _, errors in results)
+    print(f"{server}, {clients} clients:")
+    print(f"  throughput  {len(latencies) / seconds:8.0f} requests/s")
+    print(f"  p50         {statistics.median(latencies) * 1000:8.1f} ms")
+    print(f"  p99         "
+          f"{latencies[int(len(latencies) * 0.99)] * 1000:8.1f} ms")
+    print(f"  errors      {errors:8d}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--path', action='append')
+    parser.add_argument('--server', choices=sorted(SERVERS), action='append')
+    args = parser.parse_args()
+
+    paths = args.path
+    if not paths:
+        from app import create_app
+        from models import User
+        with create_app('production').app_context():
+            user_ids = [id for id, in User.query.with_entities(User.id)
+                        .order_by(User.id).limit(args.users)]
+        paths = ['/'] + [f"/users/{user_id}" for user_id in user_ids]
+
+    for server in args.server or ['flask', 'gunicorn']:
+        run(server, args.clients, args.seconds, paths)
+
+
+if __name__ == '__main__':
+    main()
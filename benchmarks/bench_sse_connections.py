@@ -0,0 +1,186 @@
+"""Cost of idle /stream/timeline connections, and fan-out latency.
+
+Starts the app in a server subprocess. It opens --connections timeline
+streams logged in as one user, and records the server's memory and thread
+count while they sit idle. Then it posts a warble as that user and times
+how long it takes to reach every stream.
+
+Servers compared:
+
+- gevent: gevent's WSGI server, monkey-patched (what `gunicorn -k gevent`
+  runs), one greenlet per connection;
+- threaded: werkzeug's threaded server, one OS thread per connection.
+
+Needs a database with at least one user (`python seed.py`). The posted
+warble stays in the database.
+
+run it from the project root like:
+
+    DATABASE_URL=postgresql:///warbler \\
+        python -m benchmarks.bench_sse_connections [--connections 1000]
+"""
+
+import argparse
+import http.client
+import resource
+import selectors
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.parse
+
+SERVERS = {
+    'gevent': """
+from gevent import monkey; monkey.patch_all()
+import sys
+from gevent.pywsgi import WSGIServer
+from app import create_app
+WSGIServer(('127.0.0.1', int(sys.argv[1])), create_app('testing'),
+           log=None).serve_forever()
+""",
+    'threaded': """
+import sys
+from werkzeug.serving import make_server
+from app import create_app
+make_server('127.0.0.1', int(sys.argv[1]), create_app('testing'),
+            threaded=True).serve_forever()
+""",
+}
+
+
+def session_cookie(user_id):
+    from app import create_app, CURR_USER_KEY
+
+    app = create_app('testing')
+    serializer = app.session_interface.get_signing_serializer(app)
+    return f"session={serializer.dumps({CURR_USER_KEY: user_id})}"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def proc_status(pid):
+    """(resident MB, thread count) of process `pid`."""
+
+    fields = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            fields[key] = value.split()
+    return int(fields['VmRSS'][0]) / 1024, int(fields['Threads'][0])
+
+
+def open_streams(port, cookie, count):
+    """Open `count` streams; return them once each has its first event."""
+
+    request = (f"GET /stream/timeline HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+               f"Cookie: {cookie}\r\nAccept: text/event-stream\r\n\r\n"
+               ).encode()
+    selector = selectors.DefaultSelector()
+    streams = []
+    for _ in range(count):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(request)
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        streams.append(sock)
+
+    waiting = set(streams)
+    while waiting:
+        for key, _ in selector.select(timeout=30):
+            if key.fileobj in waiting and b'retry:' in key.fileobj.recv(65536):
+                waiting.discard(key.fileobj)
+    return selector, streams
+
+
+def fan_out(port, cookie, selector, streams):
+    """Seconds from posting a warble until each stream has received it."""
+
+    body = urllib.parse.urlencode({'text': 'fan-out benchmark'})
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+
+    start = time.perf_counter()
+    # the redirect that follows isn't part of the fan-out
+    conn.request('POST', '/messages/new', body, headers={
+        'Cookie': cookie,
+        'Content-Type': 'application/x-www-form-urlencoded'})
+    conn.getresponse().read()
+    conn.close()
+
+    latencies = []
+    waiting = set(streams)
+    while waiting:
+        for key, _ in selector.select(timeout=30):
+            if key.fileobj in waiting and b'event: warble' in \
+                    key.fileobj.recv(65536):
+                waiting.discard(key.fileobj)
+                latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run(server, connections, user_id):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, '-c', SERVERS[server],
+                             str(port)])
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.1)
+        idle_rss, idle_threads = proc_status(proc.pid)
+
+        cookie = session_cookie(user_id)
+        start = time.perf_counter()
+        selector, streams = open_streams(port, cookie, connections)
+        connect_time = time.perf_counter() - start
+        time.sleep(1)
+        rss, threads = proc_status(proc.pid)
+
+        latencies = sorted(fan_out(port, cookie, selector, streams))
+
+        for sock in streams:
+            sock.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    print(f"{server}, {connections} idle streams:")
+    print(f"  connect all      {connect_time:8.2f} s")
+    print(f"  resident memory  {idle_rss:8.1f} MB -> {rss:.1f} MB "
+          f"({(rss - idle_rss) * 1024 / connections:.1f} KB per stream)")
+    print(f"  threads          {idle_threads:8d}    -> {threads}")
+    print(f"  fan-out p50      {statistics.median(latencies) * 1000:8.1f} ms")
+    print(f"  fan-out max      {latencies[-1] * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--user-id', type=int)
+    parser.add_argument('--server', choices=sorted(SERVERS), action='append')
+    args = parser.parse_args()
+
+    # each stream is a socket on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    user_id = args.user_id
+    if user_id is None:
+        from app import create_app
+        from models import User
+        with create_app('testing').app_context():
+            user_id = User.query.order_by(User.id).first().id
+
+    for server in args.server or ['gevent', 'threaded']:
+        run(server, args.connections, user_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Worker cold start: import time, app creation and first-request latency.
+
+Each run happens in a fresh interpreter, like a newly forked worker. It
+doesn't touch the database (GET /login as an anonymous user).
+
+run it from the project root like:
+
+    python -m benchmarks.bench_startup [--runs 10] [--tree PATH]
+
+--tree points at another checkout (e.g. an older commit in a git
+worktree) to compare against.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app as module
+t1 = time.perf_counter()
+app = module.app
+t2 = time.perf_counter()
+client = app.test_client()
+assert client.get('/login').status_code == 200
+t3 = time.perf_counter()
+client.get('/login')
+t4 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'create app': t2 - t1,
+                  'first request': t3 - t2, 'warm request': t4 - t3,
+                  'total to first response': t3 - t0}))
+"""
+
+
+def run(tree, runs):
+    env = dict(os.environ, FLASK_ENV='production')
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE], cwd=tree, env=env,
+                             check=True, capture_output=True, text=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {key: statistics.median(r[key] for r in results)
+            for key in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--tree', default='.')
+    args = parser.parse_args()
+
+    timings = run(args.tree, args.runs)
+    print(f"median of {args.runs} cold starts in {args.tree}:")
+    for key, seconds in timings.items():
+        print(f"  {key:<25}{seconds * 1000:>8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
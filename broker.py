@@ -0,0 +1,211 @@
+"""Publish/subscribe for new warbles, feeding /stream/timeline.
+
+`timeline_broker.publish(author_id, message_id)` is called once a message
+is committed. Every open timeline stream that follows the author gets the
+message id.
+
+Two transports, picked with the TIMELINE_BROKER setting:
+
+- "memory" (default): delivered within this process only. Enough for one
+  worker process.
+- "postgres": published with NOTIFY on a Postgres channel. Each process
+  runs one LISTEN connection, in a background thread started on first
+  subscribe (so after the fork), and hands notifications to its local
+  subscribers.
+
+Streams are long-lived and mostly idle. Run the app on a cooperative
+worker, e.g. `gunicorn -k gevent --worker-connections 2000`, so idle
+streams cost a greenlet each instead of a thread. Blocking here uses
+threading/queue/select, which gevent's monkey-patching makes cooperative.
+"""
+
+import os
+import queue
+import select
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import text
+
+from models import db
+
+CHANNEL = 'warbler_timeline'
+
+
+class Overflow(Exception):
+    """A subscriber fell too far behind and missed messages."""
+
+
+class Subscription:
+    """Messages published by a set of authors, in arrival order.
+
+    Use as a context manager; leaving it unsubscribes.
+    """
+
+    def __init__(self, broker, author_ids, max_pending):
+        self.broker = broker
+        self.author_ids = frozenset(author_ids)
+        self._queue = queue.Queue(max_pending)
+        self._overflowed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.broker.unsubscribe(self)
+
+    def put(self, author_id, message_id):
+        try:
+            self._queue.put_nowait((author_id, message_id))
+        except queue.Full:
+            self._overflowed = True
+
+    def get(self, timeout=None):
+        """(author id, message id) pairs published since the last call,
+        waiting up to `timeout` seconds for the first; [] on timeout.
+
+        Raises Overflow if messages were dropped because nobody was reading.
+        """
+
+        if self._overflowed:
+            raise Overflow()
+
+        try:
+            published = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+        while True:
+            try:
+                published.append(self._queue.get_nowait())
+            except queue.Empty:
+                return published
+
+
+class TimelineBroker:
+    """Routes published message ids to subscriptions, by author."""
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self.transport = None
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure from the app's TIMELINE_BROKER setting."""
+
+        kind = app.config.setdefault('TIMELINE_BROKER', 'memory')
+        self.max_pending = app.config.setdefault('TIMELINE_BROKER_MAX_PENDING',
+                                                 self.max_pending)
+        if kind == 'postgres':
+            self.transport = PostgresTransport(app, self.deliver)
+        elif kind == 'memory':
+            self.transport = None
+        else:
+            raise ValueError(f"unknown TIMELINE_BROKER {kind!r}")
+
+    def subscribe(self, author_ids):
+        """New Subscription to messages by any of `author_ids`."""
+
+        if self.transport:
+            self.transport.start()
+
+        sub = Subscription(self, author_ids, self.max_pending)
+        with self._lock:
+            for author_id in sub.author_ids:
+                self._subscribers[author_id].add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            for author_id in sub.author_ids:
+                subs = self._subscribers.get(author_id)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subscribers[author_id]
+
+    def publish(self, author_id, message_id):
+        """Announce a committed message to subscribers everywhere."""
+
+        if self.transport:
+            self.transport.notify(author_id, message_id)
+        else:
+            self.deliver(author_id, message_id)
+
+    def deliver(self, author_id, message_id):
+        """Hand a message to this process's subscribers."""
+
+        with self._lock:
+            subs = list(self._subscribers.get(author_id, ()))
+        for sub in subs:
+            sub.put(author_id, message_id)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(set().union(*self._subscribers.values()))
+
+
+class PostgresTransport:
+    """Carry published ids between processes with LISTEN/NOTIFY."""
+
+    def __init__(self, app, deliver, channel=CHANNEL, reconnect_delay=1):
+        self.app = app
+        self.deliver = deliver
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def notify(self, author_id, message_id):
+        engine = db.get_engine(self.app)
+        with engine.connect() as conn:
+            conn.execution_options(autocommit=True).execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                channel=self.channel, payload=f"{author_id}:{message_id}")
+
+    def start(self):
+        """Start this process's listener, unless it is running."""
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        thread = threading.Thread(target=self._listen, daemon=True,
+                                  name='timeline-listener')
+        thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                self._listen_once()
+            except Exception:
+                self.app.logger.exception("timeline listener failed")
+            time.sleep(self.reconnect_delay)
+
+    def _listen_once(self):
+        # a dedicated connection, kept out of the pool
+        raw = db.get_engine(self.app).raw_connection()
+        raw.detach()
+        conn = raw.connection
+        try:
+            # the pool's ping on checkout left a transaction open
+            conn.rollback()
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+
+            while True:
+                select.select([conn], [], [], 60)
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    author_id, _, message_id = notify.payload.partition(':')
+                    self.deliver(int(author_id), int(message_id))
+        finally:
+            raw.close()
+
+
+timeline_broker = TimelineBroker()
@@ -0,0 +1,253 @@
+"""WSGI middleware compressing responses with brotli or gzip.
+
+Responses are compressed when the client accepts brotli ("br") or gzip,
+the content type is textual (see COMPRESSIBLE_TYPES), the response isn't
+already encoded or a byte range (206, Content-Range), and the body is at
+least `min_size` bytes. Every response of a compressible type carries
+`Vary: Accept-Encoding`, compressed or not, so shared caches keep the
+encodings apart.
+
+Responses with a Content-Length are compressed in one go. Streamed
+responses (no Content-Length) are compressed chunk by chunk from the
+first, whatever their size, and each chunk is flushed, so the client
+gets data as soon as it is produced. Event streams (text/event-stream)
+are left alone: their events are small and must arrive at once, and
+proxies tend to buffer compressed ones. Brotli is used only if the
+brotli package is installed.
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/xml',
+    'text/csv',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/x-ndjson',
+    'application/xml',
+    'image/svg+xml',
+}
+
+
+def parse_accept_encoding(header):
+    """Set of encodings the client accepts with a non-zero quality."""
+
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class Compressor:
+    """Incremental gzip or brotli compressor with a common interface."""
+
+    def __init__(self, encoding, level, brotli_quality):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._obj = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 31: zlib stream with a gzip header and trailer
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def flush(self):
+        """Emit everything compressed so far, keeping the stream open."""
+
+        if self.encoding == 'br':
+            return self._obj.flush()
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._obj.finish()
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class CompressMiddleware:
+    """Compress responses of the wrapped WSGI application."""
+
+    def __init__(self, app, min_size=500, level=6, brotli_quality=4,
+                 mimetypes=COMPRESSIBLE_TYPES):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.mimetypes = mimetypes
+
+    def choose_encoding(self, environ):
+        accepted = parse_accept_encoding(
+            environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+        return None
+
+    def __call__(self, environ, start_response):
+        encoding = self.choose_encoding(environ)
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            def vary(status, headers, exc_info=None):
+                return start_response(status, self._varied(headers),
+                                      exc_info)
+
+            return self.app(environ, vary)
+
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            response['exc_info'] = exc_info
+            return _unsupported_write
+
+        app_iter = self.app(environ, capture)
+        return self._respond(app_iter, response, encoding, start_response)
+
+    def _compressible_type(self, headers):
+        for name, value in headers:
+            if name.lower() == 'content-type':
+                return value.split(';')[0].strip().lower() in self.mimetypes
+        return False
+
+    def _varied(self, headers):
+        """`headers`, with Vary: Accept-Encoding if of a compressible
+        type."""
+
+        if self._compressible_type(headers):
+            return _vary(headers)
+        return headers
+
+    def _compressible(self, status, headers):
+        # a compressed byte range would no longer match its Content-Range
+        if not status.startswith('2') or status.startswith(('204', '206')):
+            return False
+
+        names = {name.lower(): value for name, value in headers}
+        if 'content-encoding' in names or 'content-range' in names:
+            return False
+
+        if not self._compressible_type(headers):
+            return False
+
+        length = names.get('content-length')
+        return length is None or int(length) >= self.min_size
+
+    def _respond(self, app_iter, response, encoding, start_response):
+        """Generator yielding the (possibly compressed) response body."""
+
+        try:
+            chunks = iter(app_iter)
+            # the app calls start_response no later than its first chunk
+            first = next(chunks, None)
+            status, headers = response['status'], response['headers']
+
+            if not self._compressible(status, headers):
+                start_response(status, self._varied(headers),
+                               response['exc_info'])
+                if first is not None:
+                    yield first
+                yield from chunks
+                return
+
+            streamed = not any(name.lower() == 'content-length'
+                               for name, _ in headers)
+            pending = [first] if first is not None else []
+
+            compressor = Compressor(encoding, self.level,
+                                    self.brotli_quality)
+            headers = _encoded_headers(headers, encoding)
+
+            if not streamed:
+                body = compressor.compress(b''.join(pending + list(chunks)))
+                body += compressor.finish()
+                headers = _set_header(headers, 'Content-Length',
+                                      str(len(body)))
+                start_response(status, headers, response['exc_info'])
+                yield body
+                return
+
+            # never held back: the rest may be a long time coming
+            start_response(status, headers, response['exc_info'])
+            for chunk in pending:
+                yield compressor.compress(chunk) + compressor.flush()
+            for chunk in chunks:
+                data = compressor.compress(chunk) + compressor.flush()
+                if data:
+                    yield data
+            yield compressor.finish()
+
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+def _unsupported_write(data):
+    raise RuntimeError("CompressMiddleware does not support the WSGI "
+                       "write() callable; return an iterable instead.")
+
+
+def _set_header(headers, name, value):
+    return ([(key, val) for key, val in headers
+             if key.lower() != name.lower()]
+            + [(name, value)])
+
+
+def _encoded_headers(headers, encoding):
+    """Response headers for a body compressed with `encoding`."""
+
+    updated = []
+
+    for name, value in headers:
+        lower = name.lower()
+        if lower == 'content-length':
+            continue
+        if lower == 'etag' and not value.startswith('W/'):
+            # the compressed body is a different representation
+            value = 'W/' + value
+        updated.append((name, value))
+
+    updated = _vary(updated)
+    updated.append(('Content-Encoding', encoding))
+    return updated
+
+
+def _vary(headers):
+    """`headers` with Accept-Encoding added to Vary."""
+
+    vary = None
+    updated = []
+    for name, value in headers:
+        if name.lower() == 'vary':
+            vary = value
+        else:
+            updated.append((name, value))
+
+    if vary is None:
+        vary = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        vary += ', Accept-Encoding'
+
+    updated.append(('Vary', vary))
+    return updated
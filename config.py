@@ -0,0 +1,201 @@
+"""Configuration profiles for create_app."""
+
+import os
+import tempfile
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
+                                             'postgres:///warbler')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    # Messages older than the retention window move out of the
+    # (partitioned) messages table into compressed files here; unset to
+    # disable the archive.
+    MESSAGE_ARCHIVE_DIR = os.environ.get('MESSAGE_ARCHIVE_DIR')
+    MESSAGE_RETENTION_MONTHS = 12
+    MESSAGE_PARTITIONS_AHEAD = 3
+
+    # Response compression: bodies under COMPRESS_MIN_SIZE bytes aren't
+    # worth the CPU; see benchmarks/bench_compression.py for the level
+    # tradeoff.
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+
+    # Live timeline transport: "memory" for a single worker process,
+    # "postgres" (LISTEN/NOTIFY) when there are several.
+    TIMELINE_BROKER = os.environ.get('TIMELINE_BROKER', 'memory')
+
+    # Token buckets per endpoint; see ratelimit.py. The SQLite table is
+    # shared by all workers on this host.
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_STORAGE = os.environ.get(
+        'RATE_LIMIT_STORAGE',
+        'sqlite:///' + os.path.join(tempfile.gettempdir(),
+                                    'warbler-ratelimit.db'))
+    RATE_LIMITS = {
+        'warbler.login': {'ip': '10/minute'},
+        'warbler.signup': {'ip': '10/hour'},
+        'warbler.username_available': {'ip': '120/minute'},
+        'warbler.messages_add': {'user': '30/minute', 'ip': '60/minute'},
+        'warbler.messages_add_bulk': {'user': '5/minute', 'ip': '10/minute'},
+        'warbler.like_message': {'user': '60/minute', 'ip': '120/minute'},
+        'warbler.add_follow': {'user': '30/minute', 'ip': '60/minute'},
+    }
+    # limited on GET too: these do their work on GET
+    RATE_LIMIT_ALL_METHODS = {'warbler.username_available'}
+
+    # Reverse proxies in front of the app (e.g. 1 for nginx, 2 for a load
+    # balancer and nginx). The X-Forwarded-For entry they add gives the
+    # client's address, which rate limits go by; with 0 the header is
+    # ignored, as any client could send it.
+    PROXY_HOPS = int(os.environ.get('WARBLER_PROXY_HOPS', 0))
+
+    # The server: WORKERS processes of WORKER_THREADS threads, or of
+    # greenlets with WORKER_CLASS "gevent"; see gunicorn.conf.py.
+    WORKERS = int(os.environ.get('WEB_CONCURRENCY',
+                                 (os.cpu_count() or 1) * 2 + 1))
+    WORKER_CLASS = os.environ.get('WARBLER_WORKER_CLASS', 'gthread')
+    WORKER_THREADS = int(os.environ.get('WARBLER_THREADS', 4))
+
+    # Database connections: each worker pools DB_POOL_SIZE per database
+    # (None: its share of DB_MAX_CONNECTIONS, and no more than it serves
+    # requests at once). DB_POOL_MODE "transaction" when connecting
+    # through pgbouncer's transaction pooling, which rules out prepared
+    # statements. See engines.py.
+    DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 90))
+    DB_POOL_SIZE = None
+    DB_POOL_TIMEOUT = 5
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_PRE_PING = True
+    DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'session')
+    DB_PREPARED_STATEMENTS = True
+    DB_PREPARED_PER_CONNECTION = 100
+
+    # Messages and likes split over several databases by user id; each
+    # name must be a key of SQLALCHEMY_BINDS. Empty: no sharding. See
+    # shards.py.
+    MESSAGE_SHARDS = []
+    SHARD_PIN_TTL = 5
+
+    # Authors' usernames and pictures for rendering messages, in a file
+    # mapped into every worker on this host; see author_cards.py.
+    AUTHOR_CARDS_PATH = os.path.join(tempfile.gettempdir(),
+                                     'warbler-author-cards')
+    AUTHOR_CARDS_SLOTS = 65536
+    AUTHOR_CARDS_TTL = 300
+
+    # Seconds each endpoint may take, its database work cut off past that
+    # (None: no limit, for long-lived responses); see deadlines.py.
+    ROUTE_BUDGETS = {
+        'warbler.homepage': 2.0,
+        'warbler.users_show': 2.0,
+        'warbler.stream_timeline': None,
+        'warbler.export_user': None,
+    }
+    DEFAULT_ROUTE_BUDGET = 10.0
+    # Parts of pages that are dropped, rather than waited for, when the
+    # database is slow: refreshing the home timeline and the stats bars.
+    TIMELINE_BUDGET = 0.5
+    STATS_BUDGET = 0.25
+    # Requests each worker handles at once; more wait up to
+    # CONCURRENCY_WAIT seconds for a slot, then get a 503. 0: no limit.
+    MAX_CONCURRENT_REQUESTS = 32
+    CONCURRENCY_WAIT = 0.1
+
+    # Users who may see the /admin pages.
+    ADMIN_USERNAMES = [name for name in
+                       os.environ.get('ADMIN_USERNAMES', '').split(',')
+                       if name]
+
+    # Profiling requests: a sampled fraction, or admins' requests that ask
+    # for it. Captures go to PROFILE_DIR; see profiler.py.
+    PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'warbler-profiles')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_INTERVAL = 0.005
+    PROFILE_TOP_ALLOCATIONS = 20
+    PROFILE_KEEP = 20
+
+    # Engagement stats for /admin/stats, recomputed by `flask analytics`
+    # from a snapshot of the tables kept here; see analytics.py.
+    ANALYTICS_DIR = os.path.join(tempfile.gettempdir(), 'warbler-analytics')
+    ANALYTICS_BATCH = 100_000
+    ANALYTICS_DAYS = 90
+    ANALYTICS_TOP = 20
+
+    # Warming a worker up before it takes traffic, for the users whose
+    # home pages and profiles are requested most, as recorded in
+    # WARMUP_KEYS_PATH; see warmup.py.
+    WARMUP_KEYS_PATH = os.path.join(tempfile.gettempdir(),
+                                    'warbler-hot-keys.json')
+    WARMUP_RECORD_INTERVAL = 60
+    WARMUP_TOP = 200
+    WARMUP_BUDGET = 10.0
+
+    # Notifications of follows and likes, written in batches: every
+    # NOTIFY_FLUSH_INTERVAL seconds (0: as they happen), or once
+    # NOTIFY_BATCH are waiting. Unread counts are cached per worker for
+    # NOTIFY_UNREAD_TTL seconds. See notifications.py.
+    NOTIFY_BATCH = 500
+    NOTIFY_FLUSH_INTERVAL = 2.0
+    NOTIFY_UNREAD_TTL = 30
+
+    # Bloom filters over taken usernames and emails, checked before the
+    # password is hashed at signup; see taken_names.py. Capacity grows
+    # with the users table at each rebuild, which a background thread
+    # does while requests use the old filters.
+    USERNAME_FILTER_CAPACITY = 1_000_000
+    USERNAME_FILTER_ERROR_RATE = 0.01
+    USERNAME_FILTER_REFRESH = 5
+    USERNAME_FILTER_REBUILD = 3600
+    USERNAME_FILTER_BACKGROUND = True
+
+    # Compiled templates are cached on disk and shared by all workers.
+    JINJA_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'warbler-jinja')
+    PRECOMPILE_TEMPLATES = False
+
+    DEBUG_TOOLBAR = False
+
+
+class ProductionConfig(Config):
+    PRECOMPILE_TEMPLATES = True
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    # cheap password hashes; most test setUps sign users up
+    BCRYPT_LOG_ROUNDS = 4
+    RATE_LIMIT_ENABLED = False
+    RATE_LIMIT_STORAGE = 'memory'
+    # private to each test process, which has its own database
+    AUTHOR_CARDS_PATH = None
+    AUTHOR_CARDS_SLOTS = 1024
+    USERNAME_FILTER_CAPACITY = 1000
+    USERNAME_FILTER_BACKGROUND = False
+    PROFILE_DIR = None
+    PROFILE_SAMPLE_RATE = 0
+    ANALYTICS_DIR = None
+    WARMUP_KEYS_PATH = None
+    # written in the test's own transaction
+    NOTIFY_FLUSH_INTERVAL = 0
+
+
+PROFILES = {
+    'production': ProductionConfig,
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+}
@@ -0,0 +1,204 @@
+"""Latency budgets per route, and shedding load before it reaches the DB.
+
+When the database slows down, requests used to wait on it for as long as
+it took; workers piled up behind them until the whole site stalled.
+Now:
+
+- Each endpoint has a budget in seconds (ROUTE_BUDGETS, or else
+  DEFAULT_ROUTE_BUDGET; None means no limit, for long-lived responses).
+  Every transaction a request begins sets Postgres' statement_timeout
+  to what is left of it, so the server cancels a statement that would
+  run over. On any database, a statement issued, or finishing, past the
+  deadline raises DeadlineExceeded. Unhandled, that is a 503.
+- Parts of a page that it can do without run in `deadlines.within(s)`,
+  a SAVEPOINT with a tighter budget. If they run over, the savepoint is
+  rolled back and the view degrades: the home page shows the timeline
+  buffers as they were, and stats bars are hidden (see views.py).
+- Each worker handles at most MAX_CONCURRENT_REQUESTS budgeted requests
+  at a time. A request that can't get a slot within CONCURRENCY_WAIT
+  seconds gets a 503 straight away, without touching the database.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models import db
+from shards import shard_router
+
+# Postgres' SQLSTATE for a statement cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+RETRY_AFTER = 1
+
+
+class DeadlineExceeded(Exception):
+    """The request, or the part of it in `within`, ran out of time."""
+
+
+class Deadlines:
+    """Per-route budgets and a per-worker concurrency limit."""
+
+    def __init__(self):
+        self.budgets = {}
+        self.default_budget = None
+        self.max_concurrent = 0
+        self.wait = 0
+        self._slots = None
+
+    def init_app(self, app):
+        """Configure from ROUTE_BUDGETS, DEFAULT_ROUTE_BUDGET,
+        MAX_CONCURRENT_REQUESTS and CONCURRENCY_WAIT."""
+
+        self.budgets = app.config.setdefault('ROUTE_BUDGETS', {})
+        self.default_budget = app.config.setdefault('DEFAULT_ROUTE_BUDGET',
+                                                    None)
+        self.max_concurrent = app.config.setdefault(
+            'MAX_CONCURRENT_REQUESTS', 0)
+        self.wait = app.config.setdefault('CONCURRENCY_WAIT', 0)
+        self._slots = (threading.BoundedSemaphore(self.max_concurrent)
+                       if self.max_concurrent else None)
+
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+        app.register_error_handler(DeadlineExceeded, self._busy)
+        _listen()
+
+    def budget(self, endpoint):
+        """Seconds `endpoint` may take; None for no limit."""
+
+        return self.budgets.get(endpoint, self.default_budget)
+
+    def _start(self):
+        budget = self.budget(request.endpoint)
+        if budget is None or request.endpoint == 'static':
+            return None
+
+        if self._slots is not None:
+            if not self._slots.acquire(timeout=self.wait):
+                return self._busy()
+            g._deadline_slot = True
+        g._deadline = time.monotonic() + budget
+        return None
+
+    def _finish(self, exc=None):
+        # rolling back on teardown mustn't be refused
+        g.pop('_deadline', None)
+        if g.pop('_deadline_slot', False):
+            self._slots.release()
+
+    def _busy(self, exc=None):
+        g.pop('_deadline', None)
+        if exc is not None:
+            _rollback()
+        resp = Response("Warbler is busy. Please try again shortly.", 503,
+                        mimetype='text/plain')
+        resp.headers['Retry-After'] = str(RETRY_AFTER)
+        return resp
+
+    @contextmanager
+    def within(self, seconds):
+        """Run the block in a SAVEPOINT, with at most `seconds` (or what
+        the request has left, if less) for its statements. If it runs
+        over, roll it back and raise DeadlineExceeded.
+
+        statement_timeout is set on the main database's connection;
+        shard connections keep the request's own timeout.
+        """
+
+        outer = _deadline()
+        deadline = time.monotonic() + seconds
+        if outer is not None:
+            deadline = min(deadline, outer)
+
+        session = db.session()
+        savepoint = session.begin_nested()
+        g._deadline = deadline
+        try:
+            _set_statement_timeout(session.connection(), deadline)
+            yield
+        except BaseException as exc:
+            # the rollback itself must go through
+            g._deadline = None
+            savepoint.rollback()
+            if isinstance(exc, DeadlineExceeded):
+                # shard transactions may be unusable too
+                shard_router.remove()
+            raise
+        finally:
+            g._deadline = outer
+
+        savepoint.commit()
+        # the SET LOCAL above outlives the released savepoint
+        _set_statement_timeout(session.connection(), outer)
+
+
+deadlines = Deadlines()
+
+
+##############################################################################
+# Enforcement, on every session and engine
+
+
+def _deadline():
+    """This request's deadline (time.monotonic()), if it has one."""
+
+    return g.get('_deadline') if has_app_context() else None
+
+
+def _set_statement_timeout(connection, deadline):
+    """Time out this transaction's statements at `deadline` (None: the
+    server's setting)."""
+
+    if connection.dialect.name != 'postgresql':
+        return
+    if deadline is None:
+        connection.execute("SET LOCAL statement_timeout TO DEFAULT")
+    else:
+        # 0 would mean no timeout at all
+        remaining = max(1, int((deadline - time.monotonic()) * 1000))
+        connection.execute(f"SET LOCAL statement_timeout = {remaining}")
+
+
+def _rollback():
+    # a cancelled statement leaves its transaction unusable
+    db.session.rollback()
+    shard_router.remove()
+
+
+def _after_begin(session, transaction, connection):
+    deadline = _deadline()
+    if deadline is not None:
+        _set_statement_timeout(connection, deadline)
+
+
+def _check(*args):
+    deadline = _deadline()
+    if deadline is not None and time.monotonic() > deadline:
+        raise DeadlineExceeded()
+
+
+def _handle_error(context):
+    if (_deadline() is not None and
+            getattr(context.original_exception, 'pgcode', None)
+            == QUERY_CANCELED):
+        return DeadlineExceeded()
+    return None
+
+
+_listening = False
+
+
+def _listen():
+    global _listening
+
+    if not _listening:
+        event.listen(Session, 'after_begin', _after_begin)
+        event.listen(Engine, 'before_cursor_execute', _check)
+        event.listen(Engine, 'after_cursor_execute', _check)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _listening = True
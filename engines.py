@@ -0,0 +1,217 @@
+"""Postgres engines: pool sizing, pgbouncer, prepared statements and the
+time requests wait for a connection.
+
+Every engine `db` creates for Postgres (the main database and each
+shard's) gets:
+
+- a pool of DB_POOL_SIZE connections per worker process and no
+  overflow, so WORKERS workers never open more than DB_MAX_CONNECTIONS to
+  a database. Left None, the size is that share, capped at the requests a
+  worker serves at once (its threads, or MAX_CONCURRENT_REQUESTS on
+  gevent). Connections are replaced after DB_POOL_RECYCLE seconds and,
+  with DB_POOL_PRE_PING, pinged when checked out (a round trip per
+  checkout, against errors from connections the server or a proxy
+  dropped). A request waits DB_POOL_TIMEOUT seconds at most for one.
+- server-side prepared statements for the queries run with the
+  `prepare=True` execution option (the hot ones in queries.py). psycopg2
+  sends every statement as text, which Postgres parses and plans again
+  each time. Here a connection's first run of such a statement PREPAREs
+  it, and later runs only EXECUTE it with their parameters. Each
+  connection keeps its DB_PREPARED_PER_CONNECTION most recently used
+  statements.
+- the time each checkout waited for a connection: per request in a
+  `Server-Timing: db-pool` header, and per worker at /admin/pool.
+
+DB_POOL_MODE "transaction" is for connecting through pgbouncer in
+transaction pooling mode. Consecutive transactions may then run on
+different server connections, which would not have the statements
+prepared on another one, so none are prepared.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+# upper bounds (seconds) of the wait histogram's buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, float('inf'))
+
+_PARAM = re.compile(r'%\((\w+)\)s')
+
+
+class WarblerSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with the Postgres engine options above."""
+
+    def apply_driver_hacks(self, app, info, options):
+        super().apply_driver_hacks(app, info, options)
+        if info.drivername.startswith('postgres'):
+            options.update(engine_options(app.config))
+
+
+def engine_options(config):
+    """create_engine() options for a Postgres engine under `config`."""
+
+    transaction_mode = config['DB_POOL_MODE'] == 'transaction'
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': pool_size(config),
+        'max_overflow': 0,
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'execution_options': {
+            'prepared_statements': (0 if transaction_mode else
+                                    config['DB_PREPARED_STATEMENTS'] and
+                                    config['DB_PREPARED_PER_CONNECTION']),
+        },
+    }
+
+
+def pool_size(config):
+    """Connections per worker for each database."""
+
+    if config['DB_POOL_SIZE']:
+        return config['DB_POOL_SIZE']
+    at_once = (config['WORKER_THREADS'] if config['WORKER_CLASS'] == 'gthread'
+               else config['MAX_CONCURRENT_REQUESTS'])
+    share = max(1, config['DB_MAX_CONNECTIONS'] // config['WORKERS'])
+    return min(share, at_once) if at_once else share
+
+
+##############################################################################
+# Waiting for connections
+
+
+class PoolWaits:
+    """How long checkouts from one pool waited."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.buckets = [0] * len(WAIT_BUCKETS)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.total += seconds
+            self.longest = max(self.longest, seconds)
+            self.buckets[next(i for i, bound in enumerate(WAIT_BUCKETS)
+                              if seconds <= bound)] += 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'mean_ms': round(1000 * self.total / self.checkouts, 3)
+                if self.checkouts else 0,
+                'max_ms': round(1000 * self.longest, 3),
+                'histogram_ms': {f"<={bound * 1000:g}": count for bound, count
+                                 in zip(WAIT_BUCKETS, self.buckets)},
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waited."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = PoolWaits()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = True
+        try:
+            connection = super()._do_get()
+            timed_out = False
+            return connection
+        finally:
+            waited = time.perf_counter() - start
+            self.waits.record(waited, timed_out)
+            if has_request_context():
+                g.db_pool_wait = g.get('db_pool_wait', 0) + waited
+
+    def status_summary(self):
+        """This pool's size, connections in use and waits."""
+
+        return dict(size=self.size(), checked_out=self.checkedout(),
+                    idle=self.checkedin(), **self.waits.summary())
+
+
+def pool_status(engines):
+    """{name: pool summary} of the `engines` ({name: Engine}) that have a
+    TimedQueuePool."""
+
+    return {name: engine.pool.status_summary()
+            for name, engine in engines.items()
+            if isinstance(engine.pool, TimedQueuePool)}
+
+
+def server_timing(response):
+    """after_request: report this request's pool wait."""
+
+    if 'db_pool_wait' in g:
+        response.headers.add('Server-Timing',
+                             f"db-pool;dur={g.db_pool_wait * 1000:.2f}")
+    return response
+
+
+##############################################################################
+# Prepared statements
+
+
+def _prepare(conn, cursor, statement, parameters, context, executemany):
+    if (executemany or context is None or
+            not context.execution_options.get('prepare')):
+        return statement, parameters
+    keep = context.execution_options.get('prepared_statements')
+    if not keep:
+        return statement, parameters
+
+    # {statement: (name, its parameters in order)} prepared on this DBAPI
+    # connection, least recently used first; it goes when the connection
+    # does
+    info = conn.connection.info
+    prepared = info.setdefault('prepared', OrderedDict())
+    if statement in prepared:
+        prepared.move_to_end(statement)
+        name, params = prepared[statement]
+    else:
+        params = list(dict.fromkeys(_PARAM.findall(statement)))
+        numbers = {param: i for i, param in enumerate(params, 1)}
+        body = _PARAM.sub(lambda m: f"${numbers[m.group(1)]}", statement)
+        name = f"warbler_{info.setdefault('prepare_seq', 0)}"
+        info['prepare_seq'] += 1
+        cursor.execute(f"PREPARE {name} AS {body.replace('%%', '%')}")
+        prepared[statement] = name, params
+        if len(prepared) > keep:
+            _, (evicted, _) = prepared.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {evicted}")
+
+    if not params:
+        return f"EXECUTE {name}", parameters
+    return (f"EXECUTE {name} ({', '.join(f'%({p})s' for p in params)})",
+            parameters)
+
+
+_listening = False
+
+
+def listen():
+    """Prepare statements on every engine that allows it."""
+
+    global _listening
+
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _prepare, retval=True)
+        _listening = True
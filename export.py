@@ -0,0 +1,246 @@
+"""Streaming export of everything we store about a user.
+
+An export has five sections, in this order:
+
+- profile: one row;
+- messages: newest first, continuing into the cold archive;
+- likes: in the order they were made;
+- following, followers: by user id.
+
+Rows are read with server-side cursors (`yield_per`) or in keyset
+batches, and written out in chunks of about CHUNK_SIZE bytes, so memory
+stays flat however many rows an account has.
+
+Every row carries a cursor, `<section>:<key>`. Passing the cursor of the
+last row received restarts the export just after that row:
+
+- NDJSON: every line is `{"type": ..., "cursor": ..., "data": {...}}`;
+- zip: one CSV per section, with the cursor in the first column.
+"""
+
+import csv
+import io
+import json
+import zipfile
+
+from models import db, Message, Likes, Follows, User
+from archive import message_archive
+from queries import messages_by_ids
+from shards import shard_router
+
+SECTIONS = ('profile', 'messages', 'likes', 'following', 'followers')
+
+COLUMNS = {
+    'profile': ('id', 'username', 'email', 'image_url', 'header_image_url',
+                'bio', 'location'),
+    'messages': ('id', 'timestamp', 'text'),
+    'likes': ('id', 'message_id', 'author_id', 'timestamp', 'text'),
+    'following': ('id', 'username'),
+    'followers': ('id', 'username'),
+}
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'zip': ('application/zip', 'zip'),
+}
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_cursor(cursor):
+    """(section, key) from a cursor; raises ValueError if malformed."""
+
+    section, _, key = cursor.partition(':')
+    if section not in SECTIONS:
+        raise ValueError(f"unknown export section {section!r}")
+    return section, int(key)
+
+
+def sections(user, cursor=None):
+    """(section, rows) for each section still to export after `cursor`.
+
+    rows yields (key, data) pairs, data being a dict keyed by COLUMNS.
+    """
+
+    start, after = (parse_cursor(cursor) if cursor
+                    else (SECTIONS[0], None))
+
+    for name in SECTIONS[SECTIONS.index(start):]:
+        yield name, _ROWS[name](user, after if name == start else None)
+
+
+def ndjson(user, cursor=None):
+    """Export as newline-delimited JSON, in byte chunks."""
+
+    def lines():
+        for section, rows in sections(user, cursor):
+            for key, data in rows:
+                yield json.dumps({'type': section,
+                                  'cursor': f"{section}:{key}",
+                                  'data': data}) + '\n'
+
+    buffered = []
+    size = 0
+    for line in lines():
+        buffered.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffered).encode('utf-8')
+            buffered = []
+            size = 0
+
+    if buffered:
+        yield ''.join(buffered).encode('utf-8')
+
+
+def zip_csv(user, cursor=None):
+    """Export as a zip of one CSV per section, in byte chunks.
+
+    The archive is written to the response as it is produced. Entry sizes
+    go in data descriptors after each entry, so nothing is seeked or
+    buffered whole.
+    """
+
+    sink = _Sink()
+
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for section, rows in sections(user, cursor):
+            entry = zf.open(f"{section}.csv", 'w', force_zip64=True)
+            with io.TextIOWrapper(entry, encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(('cursor',) + COLUMNS[section])
+
+                for key, data in rows:
+                    writer.writerow((f"{section}:{key}",) +
+                                    tuple(data[c] for c in COLUMNS[section]))
+                    if sink.size >= CHUNK_SIZE:
+                        yield sink.drain()
+
+    yield sink.drain()
+
+
+def export_data(user, fmt='ndjson', cursor=None):
+    """Byte chunks of `user`'s export in format `fmt` (see FORMATS)."""
+
+    return {'ndjson': ndjson, 'zip': zip_csv}[fmt](user, cursor)
+
+
+class _Sink(io.RawIOBase):
+    """Write-only stream collecting bytes until drained."""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+##############################################################################
+# Section readers: each yields (key, data) for rows after key `after`.
+
+
+def _profile(user, after):
+    if after is None:
+        yield user.id, {c: getattr(user, c) for c in COLUMNS['profile']}
+
+
+def _messages(user, after):
+    query = (shard_router.session_for(user.id)
+             .query(Message.id, Message.timestamp, Message.text)
+             .filter(Message.user_id == user.id)
+             .order_by(Message.id.desc()))
+    if after is not None:
+        query = query.filter(Message.id < after)
+
+    oldest = after
+    for msg in query.yield_per(BATCH_SIZE):
+        oldest = msg.id
+        yield msg.id, _message_data(msg)
+
+    # older months only exist in the archive
+    while True:
+        batch = message_archive.user_messages(user.id, before=oldest,
+                                              limit=BATCH_SIZE)
+        for msg in batch:
+            yield msg.id, _message_data(msg)
+        if len(batch) < BATCH_SIZE:
+            return
+        oldest = batch[-1].id
+
+
+def _message_data(msg):
+    return {'id': msg.id,
+            'timestamp': msg.timestamp.isoformat(),
+            'text': msg.text}
+
+
+def _likes(user, after):
+    # liked messages may be on other shards: read a batch of likes, then
+    # its messages
+    session = shard_router.session_for(user.id)
+    while True:
+        query = (session
+                 .query(Likes.id, Likes.message_id)
+                 .filter(Likes.user_id == user.id))
+        if after is not None:
+            query = query.filter(Likes.id > after)
+        likes = query.order_by(Likes.id).limit(BATCH_SIZE).all()
+
+        messages = {msg.id: msg for msg in
+                    messages_by_ids([like.message_id for like in likes])}
+        for like in likes:
+            msg = messages.get(like.message_id)
+            if msg is not None:
+                yield like.id, {'id': like.id,
+                                'message_id': like.message_id,
+                                'author_id': msg.user_id,
+                                'timestamp': msg.timestamp.isoformat(),
+                                'text': msg.text}
+        if len(likes) < BATCH_SIZE:
+            return
+        after = likes[-1].id
+
+
+def _follows(user, after, mine, theirs):
+    query = (db.session
+             .query(User.id, User.username)
+             .join(Follows, theirs == User.id)
+             .filter(mine == user.id)
+             .order_by(User.id))
+    if after is not None:
+        query = query.filter(User.id > after)
+
+    for other in query.yield_per(BATCH_SIZE):
+        yield other.id, {'id': other.id, 'username': other.username}
+
+
+def _following(user, after):
+    return _follows(user, after, Follows.user_following_id,
+                    Follows.user_being_followed_id)
+
+
+def _followers(user, after):
+    return _follows(user, after, Follows.user_being_followed_id,
+                    Follows.user_following_id)
+
+
+_ROWS = {
+    'profile': _profile,
+    'messages': _messages,
+    'likes': _likes,
+    'following': _following,
+    'followers': _followers,
+}
@@ -0,0 +1,93 @@
+"""gunicorn settings for serving Warbler in production.
+
+run it from the project root like:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The master imports, creates and warms up the app once (`preload_app`),
+then forks the workers, which share those pages copy-on-write. Each
+worker serves WARBLER_THREADS requests at once on threads ("gthread"),
+or up to WARBLER_WORKER_CONNECTIONS on greenlets with
+WARBLER_WORKER_CLASS=gevent (for many /stream/timeline clients).
+
+Workers are replaced after about WARBLER_MAX_REQUESTS requests, or once
+their resident memory passes WARBLER_MAX_WORKER_MEMORY MB, finishing
+their requests in flight first.
+
+`kill -HUP <master pid>` reloads with no downtime: a new master starts
+from the code and settings on disk, sharing the listening socket, and
+once it has warmed up it tells the old master to finish its requests in
+flight and exit. (gunicorn's own HUP would fork the new workers from the
+old, preloaded master: new settings, but the old code.)
+
+Every worker leases its own snowflake worker id (see snowflake.py), from
+WARBLER_WORKER_ID on (0 by default; give each host its own range)
+through WARBLER_WORKER_IDS more: twice the workers, as old and new
+workers overlap during a reload.
+"""
+
+import gc
+import os
+import signal
+
+from config import Config
+
+bind = os.environ.get('WARBLER_BIND', '0.0.0.0:8000')
+# the app sizes its database pools from these too
+workers = Config.WORKERS
+worker_class = Config.WORKER_CLASS
+threads = Config.WORKER_THREADS
+worker_connections = int(os.environ.get('WARBLER_WORKER_CONNECTIONS', 1000))
+preload_app = True
+
+max_requests = int(os.environ.get('WARBLER_MAX_REQUESTS', 10000))
+# workers started together shouldn't all restart together
+max_requests_jitter = max_requests // 10
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+MAX_WORKER_MEMORY = int(os.environ.get('WARBLER_MAX_WORKER_MEMORY', 512))
+FIRST_WORKER_ID = int(os.environ.get('WARBLER_WORKER_ID', 0))
+WORKER_IDS = int(os.environ.get('WARBLER_WORKER_IDS', workers * 2))
+
+if worker_class == 'gevent':
+    # patch before the app is preloaded, or its sockets and locks would
+    # block the workers' event loops
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    # what the master loaded stays shared with its workers only as long
+    # as nothing writes to it, and the collector writes to every object
+    # it tracks
+    gc.freeze()
+
+    server.handle_hup = server.handle_usr2
+    if server.master_pid and server.master_pid == os.getppid():
+        # a master started by HUP: retire the one that started it
+        server.log.info("Stopping old master %s", server.master_pid)
+        os.kill(server.master_pid, signal.SIGTERM)
+
+
+def post_fork(server, worker):
+    from snowflake import lease_worker_id
+
+    worker_id = lease_worker_id(FIRST_WORKER_ID, WORKER_IDS)
+    os.environ['WARBLER_WORKER_ID'] = str(worker_id)
+    worker.log.info("Worker %s has snowflake worker id %s",
+                    worker.pid, worker_id)
+
+
+def post_request(worker, req, environ, resp):
+    if worker.alive and _resident_mb() > MAX_WORKER_MEMORY:
+        worker.log.info("Worker %s is using more than %s MB: restarting",
+                        worker.pid, MAX_WORKER_MEMORY)
+        worker.alive = False
+
+
+def _resident_mb():
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
@@ -0,0 +1,141 @@
+"""#hashtags and @mentions in warbles.
+
+They are parsed once, when a message is posted, into two tables:
+
+- message_tags (tag, message_id): tags are lowercased, so #Flask and
+  #flask are the same tag;
+- message_mentions (user_id, message_id): only @usernames of existing
+  users count. Storing the id keeps mentions when a user is renamed.
+
+Both are indexed by (tag or user_id, message_id DESC), so a tag timeline
+or a mentions inbox page is one index range scan per shard, paged by
+message id. The rows live with their message, on the author's shard (see
+shards.py), and are written in the same transaction.
+
+Messages posted before this existed are indexed by `backfill`:
+
+    FLASK_APP=app.py flask backfill-tags --workers 4
+"""
+
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from flask import current_app
+from markupsafe import Markup, escape
+from sqlalchemy import func
+
+from models import db, Message, MessageTag, MessageMention
+from shards import shard_router
+
+TAG_RE = re.compile(r'(?<![\w#&])#(\w{1,50})\b')
+MENTION_RE = re.compile(r'(?<![\w@])@(\w+)')
+BACKFILL_CHUNK = 10000
+
+
+def hashtags(text):
+    """The distinct tags in `text`, lowercased."""
+
+    return {tag.lower() for tag in TAG_RE.findall(text)}
+
+
+def mentions(text):
+    """The distinct @usernames in `text`."""
+
+    return set(MENTION_RE.findall(text))
+
+
+def link_tags(text):
+    """`text` as HTML, with each #tag linking to its timeline."""
+
+    return Markup(TAG_RE.sub(
+        lambda m: Markup('<a href="/tags/{}">#{}</a>').format(
+            m.group(1).lower(), m.group(1)),
+        str(escape(text))))
+
+
+##############################################################################
+# Backfill
+
+
+def backfill(workers=4, chunk_size=BACKFILL_CHUNK, log=print):
+    """Index every existing message's tags and mentions, `workers`
+    chunks of `chunk_size` messages at a time.
+
+    Chunks end at the newest message when the backfill starts; newer ones
+    were indexed when posted. A chunk's old rows are replaced, so running
+    it again is safe. Returns the number of messages indexed.
+    """
+
+    chunks = [chunk for shard in shard_router.shard_names()
+              for chunk in _chunks(shard, chunk_size)]
+    log(f"{len(chunks)} chunks")
+
+    if workers <= 1:
+        done = map(_index_chunk, chunks)
+        return sum(_logged(done, log))
+
+    # each process must open its own connections
+    db.session.remove()
+    shard_router.remove()
+    for bind in shard_router.shard_names():
+        db.get_engine(bind=bind).dispose()
+    db.get_engine().dispose()
+
+    app = current_app._get_current_object()
+    with ProcessPoolExecutor(workers, mp_context=get_context('fork'),
+                             initializer=_worker_init,
+                             initargs=(app,)) as pool:
+        return sum(_logged(pool.map(_index_chunk, chunks), log))
+
+
+def _logged(done, log):
+    total = 0
+    for count in done:
+        total += count
+        log(f"{total} messages")
+        yield count
+
+
+def _chunks(shard, size):
+    """(shard, low, high) id ranges of about `size` messages each."""
+
+    session = shard_router.session(shard)
+    newest = session.query(func.max(Message.id)).scalar()
+    if newest is None:
+        return []
+
+    # every `size`-th id, in one pass over the primary key
+    numbered = session.query(
+        Message.id, func.row_number().over(order_by=Message.id)
+        .label('n')).subquery()
+    starts = [low for low, in session.query(numbered.c.id)
+              .filter((numbered.c.n - 1) % size == 0)
+              .order_by(numbered.c.id)]
+    ends = starts[1:] + [newest + 1]
+    return [(shard, low, high) for low, high in zip(starts, ends)]
+
+
+def _worker_init(app):
+    app.app_context().push()
+
+
+def _index_chunk(chunk):
+    """(Re)index the messages with ids in [low, high) on `shard`."""
+
+    # queries imports this module
+    from queries import index_messages
+
+    shard, low, high = chunk
+    session = shard_router.session(shard)
+    rows = [{'id': msg_id, 'text': text} for msg_id, text in
+            session.query(Message.id, Message.text)
+            .filter(Message.id >= low, Message.id < high)]
+
+    for model in (MessageTag, MessageMention):
+        (session.query(model)
+         .filter(model.message_id >= low, model.message_id < high)
+         .delete(synchronize_session=False))
+    index_messages(session, rows)
+    session.commit()
+    return len(rows)
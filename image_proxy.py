@@ -0,0 +1,374 @@
+"""Resized, locally cached copies of user avatars and header images.
+
+`User.image_url` and `header_image_url` can point anywhere. Templates run
+them through the `thumb` filter, which maps an image URL and a named size
+to `/img/<size>/<hash>`. The first request for a variant fetches the
+source once (from `static/` or over HTTP), resizes it to the size the
+templates display, and stores it as WebP or JPEG in a disk cache. The
+cache is capped in bytes, and the least recently used files are evicted
+first. Variants never change, so they are served with long-lived cache
+headers. A source's registry entry goes with its last variant, once no
+worker has handed out its URL for a day.
+
+Only `/static/` paths and http(s) URLs are proxied. Remote images are
+fetched from public addresses only: every connection, including each
+redirect, resolves the host and refuses private, loopback, link-local,
+reserved and multicast addresses, then connects to the address it
+checked. Sources over MAX_SOURCE_PIXELS are refused before decoding.
+
+Pillow is needed to resize. Without it the filter leaves URLs as they are.
+"""
+
+import hashlib
+import http.client
+import importlib.util
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+# Pillow is imported on first resize, keeping it out of worker start-up.
+HAVE_PILLOW = importlib.util.find_spec('PIL') is not None
+
+# Display sizes used by the templates, at 2x for high-density screens.
+# A height of None keeps the aspect ratio instead of cropping.
+SIZES = {
+    'nav': (64, 64),
+    'timeline': (96, 96),
+    'card': (140, 140),
+    'profile': (400, 400),
+    'card-hero': (700, None),
+    'hero': (1920, None),
+}
+
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+MAX_SOURCE_PIXELS = 40_000_000
+MAX_REDIRECTS = 5
+
+# Each worker counts the bytes it writes to the cache, and rescans it
+# when that passes max_bytes or every SWEEP_INTERVAL seconds (catching
+# up with the other workers' writes). A sweep evicts down to
+# SWEEP_TARGET of max_bytes, so the next doesn't come on the next write.
+SWEEP_INTERVAL = 60
+SWEEP_TARGET = 0.9
+
+# A worker checks (and touches) a source's registry entry again once its
+# registration is REGISTRATION_TTL seconds old. A sweep deletes entries
+# without variants that nobody touched for SOURCE_TTL seconds, so a URL
+# handed out in the meantime still resolves.
+REGISTRATION_TTL = 3600
+SOURCE_TTL = 24 * 3600
+
+
+def source_hash(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+
+class ImageProxy:
+    """Registry of proxied source URLs and the disk cache of variants."""
+
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.static_folder = None
+        # source hash -> time.monotonic() of its last registration
+        self._registered = {}
+        self._lock = threading.Lock()
+        # bytes in the cache as of the last sweep plus what we wrote since
+        self._cached_bytes = None
+        self._swept_at = 0
+
+    def init_app(self, app):
+        """Configure from the app and register the `thumb` filter."""
+
+        self.cache_dir = app.config.setdefault(
+            'IMAGE_CACHE_DIR',
+            self.cache_dir or os.path.join(tempfile.gettempdir(),
+                                           'warbler-images'))
+        self.max_bytes = app.config.setdefault('IMAGE_CACHE_MAX_BYTES',
+                                               self.max_bytes)
+        self.static_folder = app.static_folder
+        app.add_template_filter(self.thumb, 'thumb')
+
+    def thumb(self, url, size):
+        """URL of the `size` variant of image `url`."""
+
+        if not url or not HAVE_PILLOW or not _proxied(url):
+            return url
+
+        digest = source_hash(url)
+        now = time.monotonic()
+        registered = self._registered.get(digest)
+        if registered is None or now - registered > REGISTRATION_TTL:
+            # remember the source on disk so every worker can resolve it
+            path = self._path('sources', digest)
+            try:
+                # keeps it from being pruned
+                os.utime(path)
+            except FileNotFoundError:
+                self._write(path, url.encode('utf-8'))
+            self._registered[digest] = now
+
+        return f"/img/{size}/{digest}"
+
+    def variant(self, size, digest, webp=False):
+        """Path and mimetype of a cached variant, creating it if needed.
+
+        Raises NotFound for unknown sizes, unregistered hashes and sources
+        that cannot be loaded.
+        """
+
+        if size not in SIZES or not HAVE_PILLOW:
+            raise NotFound()
+
+        ext, mimetype = ('webp', 'image/webp') if webp else ('jpg',
+                                                             'image/jpeg')
+        path = self._path('variants', f"{digest}-{size}.{ext}")
+
+        if os.path.exists(path):
+            # bump mtime, which is what eviction goes by
+            os.utime(path)
+            return path, mimetype
+
+        try:
+            with open(self._path('sources', digest), encoding='utf-8') as f:
+                url = f.read()
+        except (OSError, ValueError):
+            raise NotFound()
+
+        image = self._resize(self._fetch(url), SIZES[size])
+        out = BytesIO()
+        if webp:
+            image.save(out, 'WEBP', quality=80, method=4)
+        else:
+            image.save(out, 'JPEG', quality=82, optimize=True,
+                       progressive=True)
+
+        data = out.getvalue()
+        self._write(path, data)
+        self._evict(len(data))
+        return path, mimetype
+
+    def _fetch(self, url):
+        """Load the source image from static files or over HTTP."""
+
+        from PIL import Image
+
+        try:
+            if url.startswith('/static/'):
+                path = safe_join(self.static_folder, url[len('/static/'):])
+                if path is None:
+                    raise NotFound()
+                with open(path, 'rb') as f:
+                    data = f.read(MAX_SOURCE_BYTES)
+            elif _proxied(url):
+                with open_public(url, timeout=5) as resp:
+                    data = resp.read(MAX_SOURCE_BYTES)
+            else:
+                raise NotFound()
+
+            # the header is read first: refuse huge images before decoding
+            Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+            image = Image.open(BytesIO(data))
+            if image.width * image.height > MAX_SOURCE_PIXELS:
+                raise NotFound()
+            image.load()
+            return image
+
+        except (OSError, ValueError, http.client.HTTPException,
+                Image.DecompressionBombError):
+            raise NotFound()
+
+    @staticmethod
+    def _resize(image, box):
+        from PIL import Image, ImageOps
+
+        width, height = box
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+        if height is None:
+            if image.width > width:
+                height = round(image.height * width / image.width)
+                image = image.resize((width, height), Image.LANCZOS)
+            return image
+
+        return ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+    def _path(self, kind, name):
+        return os.path.join(self.cache_dir, kind, name)
+
+    def _write(self, path, data):
+        """Write atomically, so readers never see a partial file."""
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict(self, added):
+        """Count `added` bytes, and delete least recently used variants
+        (and unused sources) if the cache may be over max_bytes or is due
+        a sweep."""
+
+        with self._lock:
+            now = time.monotonic()
+            if self._cached_bytes is not None:
+                self._cached_bytes += added
+                if (self._cached_bytes <= self.max_bytes
+                        and now - self._swept_at < SWEEP_INTERVAL):
+                    return
+            self._swept_at = now
+
+            directory = os.path.join(self.cache_dir, 'variants')
+            entries = []
+            for entry in os.scandir(directory):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            target = (self.max_bytes * SWEEP_TARGET
+                      if total > self.max_bytes else total)
+            in_use = set()
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    # named <digest>-<size>.<ext>
+                    in_use.add(os.path.basename(path).split('-')[0])
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._cached_bytes = total
+
+            self._prune_sources(in_use)
+
+    def _prune_sources(self, in_use):
+        """Delete registry entries of sources without variants that
+        haven't been touched for SOURCE_TTL seconds."""
+
+        expired = time.time() - SOURCE_TTL
+        for entry in os.scandir(os.path.join(self.cache_dir, 'sources')):
+            if entry.name in in_use or entry.stat().st_mtime >= expired:
+                continue
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+image_proxy = ImageProxy()
+
+
+##############################################################################
+# Fetching from public addresses only
+
+
+class UnsafeAddress(OSError):
+    """A source URL resolved to an address we won't connect to."""
+
+
+def _proxied(url):
+    return url.startswith('/static/') or urlsplit(url).scheme in ('http',
+                                                                  'https')
+
+
+def public_address(ip):
+    """Is `ip` (an ipaddress address) on the public internet?"""
+
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _public_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                       source_address=None):
+    """socket.create_connection, to public addresses only.
+
+    The host is resolved once, every address it resolves to is checked,
+    and the connection goes to a checked address, so a second lookup
+    can't send it somewhere else.
+    """
+
+    host, port = address
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for *_, sockaddr in infos:
+        if not public_address(ipaddress.ip_address(sockaddr[0])):
+            raise UnsafeAddress(f"{host} resolves to {sockaddr[0]}")
+
+    error = None
+    for family, type_, proto, _, sockaddr in infos:
+        sock = socket.socket(family, type_, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as exc:
+            sock.close()
+            error = exc
+    raise error or OSError(f"{host} didn't resolve")
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _public_connection
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _public_connection
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req,
+                            context=self._context)
+
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    # each hop connects through the handlers above, and so is checked too
+    max_redirections = MAX_REDIRECTS
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urlsplit(newurl).scheme not in ('http', 'https'):
+            raise urllib.error.HTTPError(newurl, code,
+                                         "redirect to a non-http(s) URL",
+                                         headers, fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+# no proxies: they would connect on our behalf, unchecked
+_opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), _PublicHTTPHandler, _PublicHTTPSHandler,
+    _RedirectHandler)
+
+
+def open_public(url, timeout):
+    """urlopen `url`, connecting to public addresses only.
+
+    Raises URLError (its reason an UnsafeAddress) for any other.
+    """
+
+    if urlsplit(url).scheme not in ('http', 'https'):
+        raise urllib.error.URLError(f"not an http(s) URL: {url}")
+    return _opener.open(url, timeout=timeout)
@@ -0,0 +1,27 @@
+"""Add the hashtag and mention tables.
+
+Creates message_tags and message_mentions, with their indexes, on the
+main database and on every shard, then indexes the messages that are
+already there. New databases get both tables from db.create_all().
+
+run it like:
+
+    python migrate_message_tags.py
+"""
+
+from app import create_app
+from hashtags import backfill
+from models import db, MessageTag, MessageMention
+from shards import shard_router, create_shard_tables
+
+app = create_app()
+
+with app.app_context():
+    db.metadata.create_all(db.engine, tables=[MessageTag.__table__,
+                                              MessageMention.__table__])
+    for name in shard_router.shard_names():
+        if name is not None:
+            create_shard_tables(name)
+    print("Created message_tags and message_mentions.")
+
+    backfill()
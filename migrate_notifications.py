@@ -0,0 +1,23 @@
+"""Add notifications (Postgres).
+
+Creates the notifications table, with its index, and the
+users.notifications_seen_id column every user's unread count starts
+from. Existing users start with nothing unread. New databases get both
+from db.create_all().
+
+run it like:
+
+    python migrate_notifications.py
+"""
+
+from app import create_app
+from models import db, Notification
+
+app = create_app()
+
+with app.app_context():
+    db.metadata.create_all(db.engine, tables=[Notification.__table__])
+    # a constant default: no table rewrite
+    db.engine.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS "
+                      "notifications_seen_id bigint NOT NULL DEFAULT 0")
+    print("Created notifications.")
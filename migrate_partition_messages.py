@@ -0,0 +1,48 @@
+"""Turn the messages table into a table partitioned by month (Postgres).
+
+Needs snowflake message ids (see migrate_snowflake_ids.py): partitions
+are id ranges, one per month, from the oldest message up to a few months
+ahead. Rows are copied into the new table inside a single transaction.
+Afterwards keep future partitions coming with:
+
+    FLASK_APP=app.py flask maintain-partitions
+
+run it like:
+
+    python migrate_partition_messages.py
+"""
+
+from app import create_app
+from models import db
+from archive import create_partitions
+from snowflake import timestamp_of
+
+app = create_app()
+
+with db.engine.begin() as conn:
+    oldest = conn.execute("SELECT min(id) FROM messages").scalar()
+
+    conn.execute("ALTER TABLE likes DROP CONSTRAINT likes_message_id_fkey")
+    conn.execute("ALTER TABLE messages RENAME TO messages_unpartitioned")
+    conn.execute("""ALTER TABLE messages_unpartitioned
+                    RENAME CONSTRAINT messages_pkey
+                    TO messages_unpartitioned_pkey""")
+    conn.execute("""CREATE TABLE messages
+                    (LIKE messages_unpartitioned INCLUDING DEFAULTS)
+                    PARTITION BY RANGE (id)""")
+    conn.execute("ALTER TABLE messages ADD PRIMARY KEY (id)")
+    conn.execute("""ALTER TABLE messages ADD FOREIGN KEY (user_id)
+                    REFERENCES users (id) ON DELETE CASCADE""")
+
+    created = create_partitions(
+        conn, app.config['MESSAGE_PARTITIONS_AHEAD'],
+        since=timestamp_of(oldest) if oldest is not None else None)
+
+    conn.execute("INSERT INTO messages SELECT * FROM messages_unpartitioned")
+    conn.execute("""ALTER TABLE likes
+                    ADD CONSTRAINT likes_message_id_fkey
+                    FOREIGN KEY (message_id) REFERENCES messages (id)
+                    ON DELETE CASCADE ON UPDATE CASCADE""")
+    conn.execute("DROP TABLE messages_unpartitioned")
+
+    print(f"Created {len(created)} partitions.")
@@ -0,0 +1,42 @@
+"""Move existing messages over to snowflake ids (Postgres).
+
+Widens messages.id and likes.message_id to BIGINT and re-keys every
+message with a snowflake built from its timestamp, so old and new
+messages sort together by id. Likes follow their messages through an
+ON UPDATE CASCADE foreign key. Runs in a single transaction.
+
+run it like:
+
+    python migrate_snowflake_ids.py
+"""
+
+from app import create_app
+from models import db
+from snowflake import backfill_ids
+
+create_app()
+
+with db.engine.begin() as conn:
+    conn.execute("ALTER TABLE messages ALTER COLUMN id DROP DEFAULT")
+    conn.execute("DROP SEQUENCE IF EXISTS messages_id_seq")
+    conn.execute("ALTER TABLE messages ALTER COLUMN id TYPE BIGINT")
+    conn.execute("ALTER TABLE likes ALTER COLUMN message_id TYPE BIGINT")
+    conn.execute("ALTER TABLE likes DROP CONSTRAINT likes_message_id_fkey")
+    conn.execute("""ALTER TABLE likes
+                    ADD CONSTRAINT likes_message_id_fkey
+                    FOREIGN KEY (message_id) REFERENCES messages (id)
+                    ON DELETE CASCADE ON UPDATE CASCADE""")
+
+    rows = conn.execute(
+        "SELECT id, timestamp FROM messages ORDER BY timestamp, id").fetchall()
+    new_ids = backfill_ids(timestamp for _, timestamp in rows)
+
+    conn.execute("CREATE TEMP TABLE id_map (old BIGINT, new BIGINT) "
+                 "ON COMMIT DROP")
+    conn.execute("INSERT INTO id_map (old, new) VALUES (%s, %s)",
+                 [(old_id, new_id)
+                  for (old_id, _), new_id in zip(rows, new_ids)])
+    conn.execute("""UPDATE messages SET id = id_map.new
+                    FROM id_map WHERE messages.id = id_map.old""")
+
+    print(f"Re-keyed {len(rows)} messages.")
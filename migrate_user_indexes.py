@@ -0,0 +1,41 @@
+"""Index follows and messages by user (Postgres).
+
+Adds the indexes behind paginated follower/following pages and per-user
+counts:
+
+- follows (user_following_id, user_being_followed_id), for "who X
+  follows";
+- messages (user_id, id), for one author's messages.
+
+New databases get both from db.create_all(). Plain tables are indexed
+CONCURRENTLY, so writes keep working meanwhile. Postgres can't do that on
+a partitioned messages table, so that index is built the normal way and
+cascades to each partition.
+
+run it like:
+
+    python migrate_user_indexes.py
+"""
+
+from app import create_app
+from models import db
+
+create_app()
+
+INDEXES = [
+    ('ix_follows_following', 'follows',
+     'user_following_id, user_being_followed_id'),
+    ('ix_messages_user_id', 'messages', 'user_id, id'),
+]
+
+with db.engine.connect() as conn:
+    conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+
+    for name, table, columns in INDEXES:
+        partitioned = conn.execute(
+            "SELECT relkind = 'p' FROM pg_class WHERE relname = %s",
+            table).scalar()
+        concurrently = '' if partitioned else 'CONCURRENTLY'
+        conn.execute(f"CREATE INDEX {concurrently} IF NOT EXISTS {name} "
+                     f"ON {table} ({columns})")
+        print(f"Created {name}.")
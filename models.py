@@ -2,11 +2,15 @@
 
 from datetime import datetime
 
+from flask import current_app
 from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
+
+from engines import WarblerSQLAlchemy, listen, server_timing
+from snowflake import next_id
 
 bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = WarblerSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -26,6 +30,13 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key (followed, following) serves "followers of X"; this
+    # serves "who X follows". Both list in user id order, for keyset pages.
+    __table_args__ = (
+        db.Index('ix_follows_following',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -43,7 +54,7 @@ class Likes(db.Model):
     )
 
     message_id = db.Column(
-        db.Integer,
+        db.BigInteger,
         db.ForeignKey('messages.id', ondelete='cascade'),
         unique=True
     )
@@ -94,6 +105,14 @@ class User(db.Model):
         nullable=False,
     )
 
+    # the newest notification this user has seen
+    notifications_seen_id = db.Column(
+        db.BigInteger,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -124,12 +143,79 @@ class User(db.Model):
         found_user_list = [user for user in self.followers if user == other_user]
         return len(found_user_list) == 1
 
+    @property
+    def is_admin(self):
+        """Listed in ADMIN_USERNAMES: may see the /admin pages."""
+
+        return self.username in current_app.config['ADMIN_USERNAMES']
+
     def is_following(self, other_user):
         """Is this user following `other_user`?"""
 
         found_user_list = [user for user in self.following if user == other_user]
         return len(found_user_list) == 1
 
+    def following_page(self, after=None, limit=60):
+        """Up to `limit` users this user follows, by id, after id `after`."""
+
+        return self._follows_page(Follows.user_following_id,
+                                  Follows.user_being_followed_id, after, limit)
+
+    def followers_page(self, after=None, limit=60):
+        """Up to `limit` followers of this user, by id, after id `after`."""
+
+        return self._follows_page(Follows.user_being_followed_id,
+                                  Follows.user_following_id, after, limit)
+
+    def _follows_page(self, mine, theirs, after, limit):
+        query = (User
+                 .query
+                 .join(Follows, theirs == User.id)
+                 .filter(mine == self.id))
+        if after is not None:
+            query = query.filter(theirs > after)
+        return query.order_by(theirs).limit(limit).all()
+
+    def following_ids(self, user_ids):
+        """Which of `user_ids` this user follows, in one query."""
+
+        if not user_ids:
+            return set()
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(user_ids)))
+        return {user_id for user_id, in rows}
+
+    def counts(self):
+        """Numbers of messages, following, followers and likes, counted in
+        the database rather than by loading the lists."""
+
+        # shards imports this module
+        from shards import shard_router
+
+        follows = {
+            'following': Follows.user_following_id,
+            'followers': Follows.user_being_followed_id,
+        }
+        own = {
+            'messages': Message.user_id,
+            'likes': Likes.user_id,
+        }
+        shard = shard_router.session_for(self.id)
+        if shard is db.session():
+            return self._count(db.session, {**own, **follows})
+        return {**self._count(shard, own),
+                **self._count(db.session, follows)}
+
+    def _count(self, session, columns):
+        # one round trip: a scalar subquery per count
+        row = session.query(*[
+            session.query(func.count()).filter(column == self.id)
+            .as_scalar() for column in columns.values()]).one()
+        return dict(zip(columns, row))
+
     @classmethod
     def signup(cls, username, email, password, image_url):
         """Sign up user.
@@ -160,7 +246,10 @@ class User(db.Model):
         If can't find matching user (or if password is wrong), returns False.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        # queries imports this module
+        from queries import user_by_username
+
+        user = user_by_username(username)
 
         if user:
             is_auth = bcrypt.check_password_hash(user.password, password)
@@ -175,9 +264,12 @@ class Message(db.Model):
 
     __tablename__ = 'messages'
 
+    # time-sortable snowflake id, see snowflake.py
     id = db.Column(
-        db.Integer,
+        db.BigInteger,
         primary_key=True,
+        autoincrement=False,
+        default=next_id,
     )
 
     text = db.Column(
@@ -188,7 +280,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -199,6 +291,117 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    # one author's messages, newest first: profile pages and counts
+    __table_args__ = (
+        db.Index('ix_messages_user_id', 'user_id', 'id'),
+    )
+
+
+class MessageTag(db.Model):
+    """A #hashtag in a message, lowercased; see hashtags.py."""
+
+    __tablename__ = 'message_tags'
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    tag = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    # one tag's messages, newest first: tag timelines
+    __table_args__ = (
+        db.Index('ix_message_tags_tag', 'tag', message_id.desc()),
+    )
+
+
+class MessageMention(db.Model):
+    """An @mention of a user in a message; see hashtags.py."""
+
+    __tablename__ = 'message_mentions'
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # messages mentioning one user, newest first: the mentions inbox
+    __table_args__ = (
+        db.Index('ix_message_mentions_user_id', 'user_id',
+                 message_id.desc()),
+    )
+
+
+class ShardPin(db.Model):
+    """A user whose messages and likes stay on `shard` rather than where
+    the hash ring puts them, until they are moved; see shards.py."""
+
+    __tablename__ = 'shard_pins'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    shard = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+
+class Notification(db.Model):
+    """An event in a user's notifications: someone followed them or liked
+    one of their messages; see notifications.py."""
+
+    __tablename__ = 'notifications'
+
+    # a snowflake, so also when it was written
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+        default=next_id,
+    )
+
+    recipient_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    kind = db.Column(
+        db.SmallInteger,
+        nullable=False,
+    )
+
+    actor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    # the liked message; not a foreign key, as it may be on a shard
+    message_id = db.Column(
+        db.BigInteger,
+    )
+
+    # one user's notifications, newest first
+    __table_args__ = (
+        db.Index('ix_notifications_recipient_id', 'recipient_id',
+                 id.desc()),
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -208,3 +411,6 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    bcrypt.init_app(app)
+    listen()
+    app.after_request(server_timing)
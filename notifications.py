@@ -0,0 +1,200 @@
+"""Notifications: who followed you, and who liked your warbles.
+
+Following someone or liking a warble doesn't write a notification in the
+request. `notifier.add` appends the event to this worker's buffer, and a
+background thread writes the buffer to the notifications table with
+multi-row INSERTs: every NOTIFY_FLUSH_INTERVAL seconds, or as soon as
+NOTIFY_BATCH events are waiting. A run of likes on one popular warble
+then costs a few inserts per worker, not one each. A worker that dies
+loses at most the events it hadn't written yet. With an interval of 0
+(testing), events are written as they happen, in the request's session.
+
+The table is a compact log: one small row per event (recipient, kind,
+actor and message; when it was written is in the snowflake id). `coalesce` folds a
+page of it into one line per warble ("ann, bob and 10 others liked your
+warble") and one for new followers.
+
+Each user's unread count is the notifications after their
+notifications_seen_id, counted up to UNREAD_CAP. It is cached in the
+worker for NOTIFY_UNREAD_TTL seconds, and dropped when the worker writes
+a notification for the user or the user reads them.
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from models import db, Notification
+from queries import unread_notifications
+from snowflake import next_id
+
+FOLLOW = 1
+LIKE = 2
+
+UNREAD_CAP = 100
+UNREAD_CACHE_SIZE = 10000
+# rows per INSERT statement
+INSERT_ROWS = 200
+
+
+class Notifier:
+    """Buffers notification events and writes them in batches."""
+
+    def __init__(self, batch=500, interval=2.0, unread_ttl=30):
+        self.batch = batch
+        self.interval = interval
+        self.unread_ttl = unread_ttl
+        self.app = None
+        self._events = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._unread = OrderedDict()
+
+    def init_app(self, app):
+        """Configure from NOTIFY_BATCH, NOTIFY_FLUSH_INTERVAL and
+        NOTIFY_UNREAD_TTL."""
+
+        self.app = app
+        self.batch = app.config.setdefault('NOTIFY_BATCH', self.batch)
+        self.interval = app.config.setdefault('NOTIFY_FLUSH_INTERVAL',
+                                              self.interval)
+        self.unread_ttl = app.config.setdefault('NOTIFY_UNREAD_TTL',
+                                                self.unread_ttl)
+        app.context_processor(
+            lambda: {'unread_notifications': self.unread})
+
+    def add(self, kind, recipient_id, actor_id, message_id=None):
+        """Tell `recipient_id` that `actor_id` followed them (FOLLOW) or
+        liked their message `message_id` (LIKE)."""
+
+        if recipient_id == actor_id:
+            return
+        event = {'recipient_id': recipient_id, 'kind': kind,
+                 'actor_id': actor_id, 'message_id': message_id}
+
+        if not self.interval:
+            self._write(db.session(), [event])
+            return
+
+        with self._lock:
+            self._events.append(event)
+            full = len(self._events) >= self.batch
+        self._start()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Write the buffered events (in an app context)."""
+
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return
+        try:
+            self._write(db.session(), events)
+        except Exception:
+            db.session.rollback()
+            # try them again with the next batch, unless that is backing up
+            with self._lock:
+                if len(self._events) < 10 * self.batch:
+                    self._events[:0] = events
+            raise
+
+    def _write(self, session, events):
+        # ids from when they're written: an event written after a user
+        # last read their notifications is always above what they saw
+        rows = [dict(event, id=next_id()) for event in events]
+        table = Notification.__table__
+        for i in range(0, len(rows), INSERT_ROWS):
+            session.execute(table.insert().values(rows[i:i + INSERT_ROWS]))
+        session.commit()
+        self.forget(*{event['recipient_id'] for event in events})
+
+    def _start(self):
+        """Start this process's flusher, unless it is running."""
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        thread = threading.Thread(target=self._run, daemon=True,
+                                  name='notification-flusher')
+        thread.start()
+        atexit.register(self._flush_in_context)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self._flush_in_context()
+            except Exception:
+                self.app.logger.exception("writing notifications failed")
+
+    def _flush_in_context(self):
+        with self.app.app_context():
+            try:
+                self.flush()
+            finally:
+                db.session.remove()
+
+    ##########################################################################
+    # Unread counts
+
+    def unread(self, user):
+        """`user`'s unread notifications, counted up to UNREAD_CAP."""
+
+        now = time.monotonic()
+        with self._lock:
+            cached = self._unread.get(user.id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        count = unread_notifications(user.id, user.notifications_seen_id,
+                                     UNREAD_CAP)
+        with self._lock:
+            self._unread[user.id] = count, now + self.unread_ttl
+            self._unread.move_to_end(user.id)
+            if len(self._unread) > UNREAD_CACHE_SIZE:
+                self._unread.popitem(last=False)
+        return count
+
+    def forget(self, *user_ids):
+        """Drop the cached unread counts of `user_ids`."""
+
+        with self._lock:
+            for user_id in user_ids:
+                self._unread.pop(user_id, None)
+
+    def clear(self):
+        """Drop buffered events and cached counts."""
+
+        with self._lock:
+            self._events = []
+            self._unread.clear()
+
+
+notifier = Notifier()
+
+
+def coalesce(events):
+    """Fold `events` (Notifications, newest first) into one entry per
+    liked message and one for follows, ordered by their newest event:
+    {'kind', 'message_id', 'actor_ids' (distinct, newest first),
+    'newest' (event id)}."""
+
+    groups = {}
+    for event in events:
+        key = (event.kind, event.message_id)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'kind': event.kind,
+                                   'message_id': event.message_id,
+                                   'actor_ids': [], 'newest': event.id}
+        if event.actor_id not in group['actor_ids']:
+            group['actor_ids'].append(event.actor_id)
+    return list(groups.values())
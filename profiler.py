@@ -0,0 +1,328 @@
+"""On-demand profiling of requests in production.
+
+A profiled request runs its view, template rendering included, under:
+
+- a stack sampler: a helper thread records the request thread's Python
+  stack every PROFILE_INTERVAL seconds. It costs the request nothing
+  but the GIL switches, so it can run on live traffic;
+- tracemalloc, for the PROFILE_TOP_ALLOCATIONS source lines that
+  allocated the most memory still held when the response was ready.
+
+Which requests are profiled:
+
+- a PROFILE_SAMPLE_RATE fraction of all of them (0 by default);
+- any request from a user listed in ADMIN_USERNAMES that carries
+  `X-Warbler-Profile: 1` or `?profile=1`.
+
+At most one request per worker is profiled at a time; tracemalloc is
+process-wide. On a gevent worker the sampler sees whichever greenlet is
+running, so stacks from other requests may show up too.
+
+Each capture is written to PROFILE_DIR/<endpoint>/ as:
+
+- <name>.folded: collapsed stacks, one `frame;frame;frame count` line
+  per stack, for flamegraph.pl, speedscope and the like;
+- <name>.svg: a flame graph of the same;
+- <name>.json: the request, its timing and the allocation top-N.
+
+Only the newest PROFILE_KEEP captures of each endpoint are kept. Admins
+can browse them at /admin/profiles.
+"""
+
+import html
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import zlib
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+try:
+    from gevent.monkey import get_original
+except ImportError:
+    def get_original(module, names):
+        module = __import__(module)
+        return [getattr(module, name) for name in names]
+
+# real threads and locks, even on a monkey-patched gevent worker: the
+# sampler must run while the request hogs the CPU
+start_new_thread, get_ident, allocate_lock = get_original(
+    '_thread', ['start_new_thread', 'get_ident', 'allocate_lock'])
+(sleep,) = get_original('time', ['sleep'])
+
+PROFILE_HEADER = 'X-Warbler-Profile'
+CAPTURE_HEADER = 'X-Warbler-Profile-Capture'
+
+
+class StackSampler:
+    """Samples one thread's Python stack from another thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._running = False
+        self._done = allocate_lock()
+
+    def start(self):
+        self._running = True
+        self._done.acquire()
+        start_new_thread(self._run, ())
+
+    def stop(self):
+        """Stop sampling; returns {collapsed stack: samples}."""
+
+        self._running = False
+        self._done.acquire()
+        self._done.release()
+        return self.stacks
+
+    def _run(self):
+        try:
+            while self._running:
+                sleep(self.interval)
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+        finally:
+            self._done.release()
+
+
+def collapse(frame):
+    """`frame`'s stack as `outermost;...;innermost`."""
+
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        path = code.co_filename.split(os.sep)
+        names.append(f"{'/'.join(path[-2:])}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class RequestProfiler:
+    """Profiles sampled or requested requests and keeps the captures."""
+
+    def __init__(self):
+        self.directory = None
+        self.sample_rate = 0
+        self.interval = 0.005
+        self.top = 20
+        self.keep = 20
+        self._busy = allocate_lock()
+
+    def init_app(self, app):
+        """Configure from the PROFILE_* settings.
+
+        Call it after registering the blueprint that sets g.user: its
+        hooks must run after that one's.
+        """
+
+        self.directory = app.config.setdefault('PROFILE_DIR', None)
+        self.sample_rate = app.config.setdefault('PROFILE_SAMPLE_RATE',
+                                                 self.sample_rate)
+        self.interval = app.config.setdefault('PROFILE_INTERVAL',
+                                              self.interval)
+        self.top = app.config.setdefault('PROFILE_TOP_ALLOCATIONS', self.top)
+        self.keep = app.config.setdefault('PROFILE_KEEP', self.keep)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._abandon)
+
+    def wanted(self):
+        """Should this request be profiled?"""
+
+        if not self.directory or request.endpoint in (None, 'static'):
+            return False
+        if random.random() < self.sample_rate:
+            return True
+        flagged = (request.headers.get(PROFILE_HEADER) == '1' or
+                   request.args.get('profile') == '1')
+        user = g.get('user')
+        return flagged and user is not None and user.is_admin
+
+    ##########################################################################
+    # capturing
+
+    def _start(self):
+        if not self.wanted() or not self._busy.acquire(False):
+            return
+
+        tracing = not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        sampler = StackSampler(get_ident(), self.interval)
+        g._profile = (sampler, tracing, time.time(), time.perf_counter())
+        sampler.start()
+
+    def _finish(self, response):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return response
+
+        sampler, tracing, started, start = profile
+        try:
+            stacks = sampler.stop()
+            duration = time.perf_counter() - start
+            allocations = []
+            if tracing:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                allocations = [
+                    {'line': str(stat.traceback[0]), 'size': stat.size,
+                     'count': stat.count}
+                    for stat in snapshot.filter_traces([
+                        tracemalloc.Filter(False, tracemalloc.__file__),
+                        tracemalloc.Filter(False, __file__)])
+                    .statistics('lineno')[:self.top]]
+
+            name = self._save(request.endpoint, stacks, {
+                'endpoint': request.endpoint,
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'status': response.status_code,
+                'started': started,
+                'duration': duration,
+                'samples': sum(stacks.values()),
+                'allocations': allocations,
+            })
+            response.headers[CAPTURE_HEADER] = name
+        finally:
+            self._busy.release()
+        return response
+
+    def _abandon(self, exc=None):
+        # the view raised, so _finish never ran
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            sampler, tracing, _, _ = profile
+            sampler.stop()
+            if tracing:
+                tracemalloc.stop()
+            self._busy.release()
+
+    ##########################################################################
+    # storage
+
+    def _save(self, endpoint, stacks, meta):
+        """Write one capture; returns its name."""
+
+        directory = os.path.join(self.directory, endpoint)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{int(meta['started'] * 1000)}-{os.getpid()}"
+        base = os.path.join(directory, name)
+
+        with open(base + '.folded', 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(base + '.svg', 'w') as f:
+            f.write(flamegraph(stacks, title=f"{meta['method']} "
+                                             f"{meta['path']}"))
+        with open(base + '.json', 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        for old in self.captures(endpoint)[self.keep:]:
+            for ext in ('.folded', '.svg', '.json'):
+                try:
+                    os.remove(os.path.join(directory, old['name'] + ext))
+                except FileNotFoundError:
+                    pass
+        return name
+
+    def endpoints(self):
+        """Endpoints with captures."""
+
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return sorted(os.listdir(self.directory))
+
+    def captures(self, endpoint):
+        """`endpoint`'s captures' metadata, newest first."""
+
+        directory = os.path.join(self.directory, endpoint)
+        captures = []
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                with open(os.path.join(directory, filename)) as f:
+                    meta = json.load(f)
+                meta['name'] = filename[:-len('.json')]
+                meta['when'] = datetime.fromtimestamp(meta['started'])
+                captures.append(meta)
+        captures.sort(key=lambda meta: meta['started'], reverse=True)
+        return captures
+
+    def path(self, endpoint, filename):
+        """Where a capture's file is, or None if it isn't one."""
+
+        if (not self.directory or endpoint not in self.endpoints() or
+                os.sep in filename or
+                not filename.endswith(('.folded', '.svg', '.json'))):
+            return None
+        path = os.path.join(self.directory, endpoint, filename)
+        return path if os.path.isfile(path) else None
+
+
+request_profiler = RequestProfiler()
+
+
+##############################################################################
+# Flame graphs
+
+FRAME_HEIGHT = 16
+WIDTH = 1200
+
+
+def flamegraph(stacks, title=''):
+    """An SVG flame graph of {collapsed stack: samples}."""
+
+    root = {}
+    for stack, count in stacks.items():
+        node = root
+        for name in stack.split(';'):
+            child = node.setdefault(name, [0, {}])
+            child[0] += count
+            node = child[1]
+
+    total = sum(stacks.values()) or 1
+    rects = []
+    depth = _layout(root, 0, 0, WIDTH / total, rects)
+    height = (depth + 2) * FRAME_HEIGHT
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" '
+             f'height="{height}" font-family="monospace" font-size="11">',
+             f'<text x="4" y="12">{html.escape(title)} '
+             f'({total} samples)</text>']
+    for x, level, width, name, count in rects:
+        y = height - (level + 1) * FRAME_HEIGHT
+        hue = 20 + zlib.crc32(name.encode()) % 40
+        label = html.escape(name)
+        parts.append(
+            f'<g><title>{label} ({count} samples, '
+            f'{count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" '
+            f'height="{FRAME_HEIGHT - 1}" fill="hsl({hue},80%,60%)"/>')
+        if width > 40:
+            parts.append(f'<text x="{x + 2:.1f}" y="{y + 11}">'
+                         f'{html.escape(name[:int(width / 7)])}</text>')
+        parts.append('</g>')
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+def _layout(nodes, x, level, scale, rects):
+    """Place `nodes` left to right from `x`; returns the deepest level."""
+
+    deepest = level
+    for name, (count, children) in sorted(nodes.items()):
+        width = count * scale
+        rects.append((x, level, width, name, count))
+        deepest = max(deepest,
+                      _layout(children, x, level + 1, scale, rects))
+        x += width
+    return deepest
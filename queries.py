@@ -0,0 +1,373 @@
+"""Baked versions of the queries run on (nearly) every request.
+
+Building a Query and compiling it to SQL costs more Python time than
+running these small statements. A baked query is built and compiled once
+per process; later calls only bind parameters. Queries that only need
+ids select those columns instead of loading full entities.
+
+Each function takes plain values. Users and follows are read through
+db.session; messages, likes, tags and mentions through the session for
+the shard that holds them (see shards.py), which is also db.session when unsharded.
+Queries over many authors run once per shard and are merged.
+"""
+
+import heapq
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import bindparam, func
+from sqlalchemy.ext import baked
+
+from models import (db, User, Message, Likes, Follows, MessageTag,
+                    MessageMention, Notification)
+from hashtags import hashtags, mentions
+from shards import shard_router, delete_tags_of
+from snowflake import next_id
+
+# above every message id: the first page of a keyset-paged list
+NEWEST = 2 ** 63 - 1
+
+bakery = baked.bakery()
+
+
+# prepare=True: run as a server-side prepared statement (see engines.py)
+_user_by_id = bakery(lambda s: s.query(User)
+                     .filter(User.id == bindparam('user_id'))
+                     .execution_options(prepare=True))
+
+_user_by_username = bakery(lambda s: s.query(User)
+                           .filter(User.username == bindparam('username'))
+                           .execution_options(prepare=True))
+
+_username_exists = bakery(lambda s: s.query(User.id)
+                          .filter(User.username == bindparam('username')))
+
+_email_exists = bakery(lambda s: s.query(User.id)
+                       .filter(User.email == bindparam('email')))
+
+_user_ids_by_username = bakery(lambda s: s.query(User.username, User.id)
+                               .filter(User.username.in_(
+                                   bindparam('usernames', expanding=True))))
+
+_author_card_rows = bakery(lambda s: s.query(User.id, User.username,
+                                             User.image_url)
+                           .filter(User.id.in_(
+                               bindparam('user_ids', expanding=True))))
+
+_followed_ids = bakery(lambda s: s.query(Follows.user_being_followed_id)
+                       .filter(Follows.user_following_id ==
+                               bindparam('user_id')))
+
+_liked_message_ids = bakery(lambda s: s.query(Likes.message_id)
+                            .filter(Likes.user_id == bindparam('user_id')))
+
+_like = bakery(lambda s: s.query(Likes)
+               .filter(Likes.user_id == bindparam('user_id'),
+                       Likes.message_id == bindparam('message_id')))
+
+_messages_by_ids = bakery(lambda s: s.query(Message)
+                          .filter(Message.id.in_(
+                              bindparam('ids', expanding=True))))
+
+_message_by_id = bakery(lambda s: s.query(Message)
+                        .filter(Message.id == bindparam('message_id')))
+
+_user_messages_before = bakery(
+    lambda s: s.query(Message)
+    .filter(Message.user_id == bindparam('user_id'),
+            Message.id < bindparam('before'))
+    .order_by(Message.id.desc())
+    .execution_options(prepare=True))
+
+_feed_ids = bakery(lambda s: s.query(Message.id)
+                   .filter(Message.user_id.in_(
+                       bindparam('user_ids', expanding=True)))
+                   .order_by(Message.id.desc())
+                   .execution_options(prepare=True))
+
+_feed_after = bakery(lambda s: s.query(Message.id, Message.user_id)
+                     .filter(Message.user_id.in_(
+                         bindparam('user_ids', expanding=True)),
+                         Message.id > bindparam('after'))
+                     .order_by(Message.id.desc())
+                     .execution_options(prepare=True))
+
+_tag_message_ids = bakery(lambda s: s.query(MessageTag.message_id)
+                          .filter(MessageTag.tag == bindparam('tag'),
+                                  MessageTag.message_id < bindparam('before'))
+                          .order_by(MessageTag.message_id.desc()))
+
+_mention_message_ids = bakery(
+    lambda s: s.query(MessageMention.message_id)
+    .filter(MessageMention.user_id == bindparam('user_id'),
+            MessageMention.message_id < bindparam('before'))
+    .order_by(MessageMention.message_id.desc()))
+
+_notifications_before = bakery(
+    lambda s: s.query(Notification)
+    .filter(Notification.recipient_id == bindparam('user_id'),
+            Notification.id < bindparam('before'))
+    .order_by(Notification.id.desc()))
+
+_notification_ids_after = bakery(
+    lambda s: s.query(Notification.id)
+    .filter(Notification.recipient_id == bindparam('user_id'),
+            Notification.id > bindparam('after')))
+
+
+def _recent_ids_per_author(s, size):
+    rank = (func.row_number()
+            .over(partition_by=Message.user_id, order_by=Message.id.desc())
+            .label('rank'))
+    ranked = (s.query(Message.user_id, Message.id, rank)
+              .filter(Message.user_id.in_(
+                  bindparam('user_ids', expanding=True)))
+              .subquery())
+    return (s.query(ranked.c.user_id, ranked.c.id)
+            .filter(ranked.c.rank <= size)
+            .order_by(ranked.c.user_id, ranked.c.id.desc()))
+
+
+def _limited(baked_query, limit):
+    # LIMIT is compiled into the SQL, so it is part of the cache key
+    return baked_query.with_criteria(lambda q: q.limit(limit), limit)
+
+
+def user_by_id(user_id):
+    """User `user_id`, or None."""
+
+    return _user_by_id(db.session()).params(user_id=user_id).one_or_none()
+
+
+def user_by_username(username):
+    """User named `username`, or None."""
+
+    return (_user_by_username(db.session())
+            .params(username=username).one_or_none())
+
+
+def username_exists(username):
+    """Is there a user named `username`? (Index-only on the unique key.)"""
+
+    return (_username_exists(db.session()).params(username=username)
+            .first() is not None)
+
+
+def email_exists(email):
+    """Is there a user with `email`?"""
+
+    return (_email_exists(db.session()).params(email=email)
+            .first() is not None)
+
+
+def author_card_rows(user_ids):
+    """(id, username, image_url) of each of `user_ids`."""
+
+    return (_author_card_rows(db.session())
+            .params(user_ids=list(user_ids)).all())
+
+
+def followed_ids(user_id):
+    """Ids of the users `user_id` follows."""
+
+    rows = _followed_ids(db.session()).params(user_id=user_id)
+    return [followed_id for followed_id, in rows]
+
+
+def liked_message_ids(user_id):
+    """Set of the ids of messages `user_id` likes."""
+
+    rows = (_liked_message_ids(shard_router.session_for(user_id))
+            .params(user_id=user_id))
+    return {message_id for message_id, in rows}
+
+
+def like(user_id, message_id):
+    """The Likes row of `user_id` liking `message_id`, or None."""
+
+    return (_like(shard_router.session_for(user_id))
+            .params(user_id=user_id, message_id=message_id).one_or_none())
+
+
+def messages_by_ids(ids):
+    """Messages for `ids`, keeping the order of `ids`; asks every shard."""
+
+    if not ids:
+        return []
+
+    by_id = {}
+    for session in shard_router.sessions():
+        rows = _messages_by_ids(session).params(ids=list(ids))
+        by_id.update((msg.id, msg) for msg in rows)
+    return [by_id[msg_id] for msg_id in ids if msg_id in by_id]
+
+
+def message_by_id(message_id):
+    """Message `message_id`, or None; asks every shard until found."""
+
+    for session in shard_router.sessions():
+        msg = (_message_by_id(session)
+               .params(message_id=message_id).one_or_none())
+        if msg is not None:
+            return msg
+    return None
+
+
+def user_messages_before(user_id, before, limit):
+    """Up to `limit` messages of `user_id` older than id `before`."""
+
+    return (_limited(_user_messages_before, limit)
+            (shard_router.session_for(user_id))
+            .params(user_id=user_id, before=before).all())
+
+
+def feed_ids(user_ids, limit):
+    """Newest `limit` message ids by any of `user_ids`."""
+
+    # the newest `limit` of each shard, merged; ids sort by time
+    per_shard = []
+    for shard, shard_user_ids in shard_router.group(user_ids).items():
+        rows = (_limited(_feed_ids, limit)(shard_router.session(shard))
+                .params(user_ids=shard_user_ids))
+        per_shard.append([msg_id for msg_id, in rows])
+    return list(islice(heapq.merge(*per_shard, reverse=True), limit))
+
+
+def feed_after(user_ids, after, limit):
+    """(message id, author id) of the newest `limit` messages by any of
+    `user_ids` with ids above `after`, newest first."""
+
+    per_shard = []
+    for shard, shard_user_ids in shard_router.group(user_ids).items():
+        rows = (_limited(_feed_after, limit)(shard_router.session(shard))
+                .params(user_ids=shard_user_ids, after=after))
+        per_shard.append([tuple(row) for row in rows])
+    return list(islice(heapq.merge(*per_shard, reverse=True), limit))
+
+
+def tag_message_ids(tag, before, limit):
+    """Ids of the newest `limit` messages tagged `tag` with ids below
+    `before` (None: the newest), newest first; asks every shard."""
+
+    return _newest_everywhere(_tag_message_ids, limit, tag=tag,
+                              before=before or NEWEST)
+
+
+def mention_message_ids(user_id, before, limit):
+    """Ids of the newest `limit` messages mentioning `user_id` with ids
+    below `before` (None: the newest), newest first; asks every shard."""
+
+    return _newest_everywhere(_mention_message_ids, limit, user_id=user_id,
+                              before=before or NEWEST)
+
+
+def notifications_before(user_id, before, limit):
+    """Up to `limit` notifications of `user_id` with ids below `before`
+    (None: the newest), newest first."""
+
+    return (_limited(_notifications_before, limit)(db.session())
+            .params(user_id=user_id, before=before or NEWEST).all())
+
+
+def unread_notifications(user_id, seen_id, cap):
+    """How many notifications `user_id` has after `seen_id`, counting no
+    further than `cap`."""
+
+    return len(_limited(_notification_ids_after, cap)(db.session())
+               .params(user_id=user_id, after=seen_id).all())
+
+def _newest_everywhere(baked_query, limit, **params):
+    per_shard = [[msg_id for msg_id, in
+                  _limited(baked_query, limit)(session).params(**params)]
+                 for session in shard_router.sessions()]
+    return list(islice(heapq.merge(*per_shard, reverse=True), limit))
+
+
+def recent_ids_per_author(user_ids, size):
+    """{user id: its newest `size` message ids, newest first}."""
+
+    recent = {}
+    for shard, shard_user_ids in shard_router.group(user_ids).items():
+        rows = (bakery(lambda s: _recent_ids_per_author(s, size), size)
+                (shard_router.session(shard)).params(user_ids=shard_user_ids))
+        for user_id, msg_id in rows:
+            recent.setdefault(user_id, []).append(msg_id)
+    return recent
+
+
+def post_messages(user_id, texts):
+    """Insert messages by `user_id` with one multi-row INSERT and commit.
+
+    Ids are snowflakes made here, so nothing is read back and the cost
+    doesn't depend on how many messages the author already has. Returns
+    the new ids, in the order of `texts`.
+    """
+
+    now = datetime.utcnow()
+    rows = [{'id': next_id(), 'text': text, 'timestamp': now,
+             'user_id': user_id} for text in texts]
+    session = shard_router.session_for(user_id)
+    session.execute(Message.__table__.insert().values(rows))
+    index_messages(session, rows)
+    session.commit()
+    return [row['id'] for row in rows]
+
+
+def index_messages(session, rows):
+    """Add the tags and mentions of messages `rows` (dicts with 'id' and
+    'text') in `session`, their shard's; see hashtags.py."""
+
+    tags = [{'message_id': row['id'], 'tag': tag}
+            for row in rows for tag in hashtags(row['text'])]
+    named = [(row['id'], mentions(row['text'])) for row in rows]
+    usernames = set().union(*(names for _, names in named))
+    user_ids = (dict(_user_ids_by_username(db.session())
+                     .params(usernames=list(usernames)))
+                if usernames else {})
+    mentioned = [{'message_id': msg_id, 'user_id': user_ids[name]}
+                 for msg_id, names in named
+                 for name in names if name in user_ids]
+
+    if tags:
+        session.execute(MessageTag.__table__.insert(), tags)
+    if mentioned:
+        session.execute(MessageMention.__table__.insert(), mentioned)
+
+
+def post_message(user_id, text):
+    """Insert one message by `user_id` and commit; returns its id."""
+
+    return post_messages(user_id, [text])[0]
+
+
+def delete_message(msg):
+    """Delete `msg`, its tags and mentions, and every like of it, on
+    whichever shards."""
+
+    for session in shard_router.sessions():
+        session.query(Likes).filter(Likes.message_id == msg.id).delete()
+        if session is not db.session():
+            session.commit()
+    session = shard_router.session_for(msg.user_id)
+    for model in (MessageTag, MessageMention):
+        session.query(model).filter(model.message_id == msg.id).delete()
+    session.delete(msg)
+    session.commit()
+
+
+def delete_user_rows(user_id):
+    """Delete `user_id`'s messages (with their tags and mentions), likes
+    and mentions of them, from every shard; a no-op without shards,
+    where deleting the user cascades."""
+
+    if not shard_router.sharded:
+        return
+    for session in shard_router.sessions():
+        session.query(MessageMention).filter(
+            MessageMention.user_id == user_id).delete()
+        session.commit()
+    session = shard_router.session_for(user_id)
+    delete_tags_of(session, user_id)
+    session.query(Likes).filter(Likes.user_id == user_id).delete()
+    session.query(Message).filter(Message.user_id == user_id).delete()
+    session.commit()
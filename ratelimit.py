@@ -0,0 +1,224 @@
+"""Token-bucket rate limiting for write and auth endpoints.
+
+RATE_LIMITS maps an endpoint to its limits. Each limit is a scope ("ip"
+or "user") and a spec like "10/minute". Each client gets its own bucket
+per endpoint and scope. A bucket holds up to N tokens and refills evenly
+over the period, so "10/minute" allows a burst of 10, then one request
+every 6 seconds. A request takes one token from each of its buckets,
+all or none: when any bucket is empty, the request is refused with the
+time until every bucket has a token, and takes nothing from the others.
+
+Only unsafe methods (POST, ...) are limited; showing a form costs nothing.
+Endpoints in RATE_LIMIT_ALL_METHODS, which do their work on GET, are
+limited whatever the method.
+
+Bucket state lives in RATE_LIMIT_STORAGE:
+
+- "memory": a dict in this process;
+- "sqlite:///path": a table in a local SQLite file, shared by every
+  worker on the host.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(spec):
+    """(capacity, refill per second) from a spec like "10/minute"."""
+
+    count, _, period = spec.partition('/')
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period.strip()]
+
+
+class MemoryStorage:
+    """Buckets in a dict; per process."""
+
+    # drop full buckets after this many calls, so the dict stays small
+    PRUNE_EVERY = 10000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def consume(self, key, capacity, rate, now):
+        """Take a token from bucket `key`.
+
+        Returns 0 if there was one, else seconds until there will be.
+        """
+
+        return self.consume_all([(key, capacity, rate)], now)
+
+    def consume_all(self, buckets, now):
+        """Take a token from each of `buckets` ((key, capacity, rate)s)
+        if every one has a token.
+
+        Returns 0 if they did, else seconds until they all will.
+        """
+
+        with self._lock:
+            levels = [(key, _refill(self._buckets.get(key), capacity, rate,
+                                    now), rate)
+                      for key, capacity, rate in buckets]
+            wait = _wait(levels)
+            # all or nothing
+            charge = 0 if wait else 1
+            for key, tokens, _ in levels:
+                self._buckets[key] = (tokens - charge, now)
+
+            self._calls += 1
+            if self._calls >= self.PRUNE_EVERY:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        self._calls = 0
+        # a bucket untouched for an hour has refilled under every limit
+        # we configure, and is equivalent to no bucket at all
+        self._buckets = {key: value for key, value in self._buckets.items()
+                         if now - value[1] < 3600}
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteStorage:
+    """Buckets in a local SQLite table; shared by processes on a host."""
+
+    PRUNE_EVERY = 10000
+
+    def __init__(self, path):
+        self.path = path
+        # a connection and a prune countdown per thread
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5,
+                                   isolation_level=None)
+            # losing bucket state in a crash is harmless
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("""CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                                key TEXT PRIMARY KEY,
+                                tokens REAL NOT NULL,
+                                updated REAL NOT NULL)""")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.calls = 0
+        return conn
+
+    def consume(self, key, capacity, rate, now):
+        return self.consume_all([(key, capacity, rate)], now)
+
+    def consume_all(self, buckets, now):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for key, capacity, rate in buckets:
+                row = conn.execute("SELECT tokens, updated"
+                                   " FROM rate_limit_buckets WHERE key = ?",
+                                   (key,)).fetchone()
+                levels.append((key, _refill(row, capacity, rate, now), rate))
+            wait = _wait(levels)
+            charge = 0 if wait else 1
+
+            conn.executemany("INSERT OR REPLACE INTO rate_limit_buckets"
+                             " VALUES (?, ?, ?)",
+                             [(key, tokens - charge, now)
+                              for key, tokens, _ in levels])
+
+            self._local.calls += 1
+            if self._local.calls >= self.PRUNE_EVERY:
+                self._local.calls = 0
+                conn.execute("DELETE FROM rate_limit_buckets"
+                             " WHERE updated < ?", (now - 3600,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return wait
+
+    def clear(self):
+        self._connection().execute("DELETE FROM rate_limit_buckets")
+
+
+def _refill(bucket, capacity, rate, now):
+    """Tokens in `bucket` ((tokens, updated) or None for full) now."""
+
+    tokens, updated = bucket or (capacity, now)
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+def _wait(levels):
+    """Seconds until every (key, tokens, rate) bucket has a token."""
+
+    return max([(1 - tokens) / rate for _, tokens, rate in levels
+                if tokens < 1], default=0)
+
+
+def storage_for(url):
+    if url == 'memory':
+        return MemoryStorage()
+    if url.startswith('sqlite:///'):
+        return SQLiteStorage(url[len('sqlite:///'):])
+    raise ValueError(f"unknown RATE_LIMIT_STORAGE {url!r}")
+
+
+class RateLimiter:
+    """Per-endpoint, per-IP and per-user token buckets."""
+
+    def __init__(self):
+        self.enabled = True
+        self.limits = {}
+        self.all_methods = set()
+        self.storage = MemoryStorage()
+
+    def init_app(self, app):
+        """Configure from the app's RATE_LIMIT_* settings and RATE_LIMITS."""
+
+        self.enabled = app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        self.storage = storage_for(
+            app.config.setdefault('RATE_LIMIT_STORAGE', 'memory'))
+        self.limits = {
+            endpoint: [(scope,) + parse_limit(spec)
+                       for scope, spec in scopes.items()]
+            for endpoint, scopes in app.config.setdefault('RATE_LIMITS',
+                                                          {}).items()}
+        self.all_methods = set(app.config.setdefault('RATE_LIMIT_ALL_METHODS',
+                                                     set()))
+
+    def hit(self, endpoint, method, ip, user_id):
+        """Count a request against its buckets.
+
+        Returns 0 if it may proceed, else seconds until it may be retried.
+        """
+
+        limits = self.limits.get(endpoint)
+        if not self.enabled or not limits:
+            return 0
+        if method in SAFE_METHODS and endpoint not in self.all_methods:
+            return 0
+
+        buckets = []
+        for scope, capacity, rate in limits:
+            ident = ip if scope == 'ip' else user_id
+            if ident is not None:
+                buckets.append((f"{endpoint}:{scope}:{ident}", capacity,
+                                rate))
+        if not buckets:
+            return 0
+        return self.storage.consume_all(buckets, time.time())
+
+
+rate_limiter = RateLimiter()
@@ -1,9 +1,12 @@
 """Seed database with sample data from CSV Files."""
 
 from csv import DictReader
-from app import db
-from models import User, Message, Follows
+from datetime import datetime
+from app import create_app
+from models import db, User, Message, Follows
+from snowflake import backfill_ids
 
+create_app()
 
 db.drop_all()
 db.create_all()
@@ -12,7 +15,12 @@ with open('generator/users.csv') as users:
     db.session.bulk_insert_mappings(User, DictReader(users))
 
 with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+    rows = list(DictReader(messages))
+    # give sample messages ids that sort by their (historic) timestamps
+    timestamps = [datetime.fromisoformat(row['timestamp']) for row in rows]
+    for row, msg_id in zip(rows, backfill_ids(timestamps)):
+        row['id'] = msg_id
+    db.session.bulk_insert_mappings(Message, rows)
 
 with open('generator/follows.csv') as follows:
     db.session.bulk_insert_mappings(Follows, DictReader(follows))
@@ -0,0 +1,335 @@
+"""Horizontal sharding of messages and likes by user id.
+
+Users and follows stay in the main database. Each user's messages (with
+their tags and mentions, see hashtags.py) and likes (the likes they
+made) live on one shard: a database named in SQLALCHEMY_BINDS and listed
+in MESSAGE_SHARDS. A consistent-hash ring
+over MESSAGE_SHARDS decides which one, so adding or removing a shard
+only moves about 1/N of the users.
+
+With MESSAGE_SHARDS empty (the default) there are no shards: everything
+uses db.session, exactly as before.
+
+Queries for one user go to that user's shard. Queries over many authors
+(the home feed) are split by shard and merged; lookups by message id
+alone ask every shard. See queries.py.
+
+Shard tables have no foreign keys: the rows they point at may be in
+another database.
+
+Moving users between shards (resharding), online:
+
+1. Add the new database to SQLALCHEMY_BINDS and run
+   `flask reshard-pin a b c`, naming the new ring. Every user the new
+   ring would place elsewhere is pinned (shard_pins) to where their data
+   is now.
+2. Deploy with MESSAGE_SHARDS = [a, b, c]. New users follow the new
+   ring; pinned users keep reading and writing their old shard.
+3. Run `flask reshard-move`. For each batch of BATCH_SIZE pinned users
+   it copies their rows to the ring's shard, unpins them (switching
+   reads and writes over), waits once for every worker to notice,
+   copies anything written to the old shards meanwhile, then deletes
+   the old copies.
+
+Workers reload pins every SHARD_PIN_TTL seconds. While a user is being
+moved, messages they post through a worker that hasn't noticed yet show
+up once the catch-up copy runs.
+"""
+
+import bisect
+import hashlib
+import threading
+import time
+
+from flask import _app_ctx_stack
+from sqlalchemy import Column, Index, MetaData, Table
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.sql.visitors import replacement_traverse
+
+from models import (db, Likes, Message, MessageMention, MessageTag, ShardPin,
+                    User)
+
+VNODES = 128
+BATCH_SIZE = 1000
+
+SHARDED_TABLES = (Message.__table__, Likes.__table__, MessageTag.__table__,
+                  MessageMention.__table__)
+
+
+class HashRing:
+    """Consistent hashing of user ids onto shard names."""
+
+    def __init__(self, names, vnodes=VNODES):
+        points = sorted((_hash(f"{name}#{i}"), name)
+                        for name in names for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def __getitem__(self, user_id):
+        i = bisect.bisect(self._hashes, _hash(str(user_id)))
+        return self._names[i % len(self._names)]
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class ShardRouter:
+    """Where a user's messages and likes live, and sessions for there."""
+
+    def __init__(self):
+        self.names = []
+        self.ring = None
+        self.pin_ttl = 5
+        self._pins = {}
+        self._pins_loaded = None
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure from MESSAGE_SHARDS and SHARD_PIN_TTL."""
+
+        self.pin_ttl = app.config.setdefault('SHARD_PIN_TTL', self.pin_ttl)
+        self.configure(app.config.setdefault('MESSAGE_SHARDS', []))
+        app.teardown_appcontext(self.remove)
+
+    def configure(self, names):
+        """Use the ring over `names` (no sharding if empty)."""
+
+        self.names = list(names)
+        self.ring = HashRing(self.names) if self.names else None
+        self._pins_loaded = None
+
+    @property
+    def sharded(self):
+        return self.ring is not None
+
+    def pins(self):
+        """{user id: shard} of pinned users, reloaded every pin_ttl s."""
+
+        now = time.monotonic()
+        if self._pins_loaded is None or now - self._pins_loaded > self.pin_ttl:
+            self._pins = dict(db.session.query(ShardPin.user_id,
+                                               ShardPin.shard))
+            self._pins_loaded = now
+        return self._pins
+
+    def shard_for(self, user_id):
+        """Shard name holding `user_id`'s rows; None when not sharded."""
+
+        if not self.sharded:
+            return None
+        return self.pins().get(user_id) or self.ring[user_id]
+
+    def group(self, user_ids):
+        """{shard: [user ids on it]}."""
+
+        groups = {}
+        for user_id in user_ids:
+            groups.setdefault(self.shard_for(user_id), []).append(user_id)
+        return groups
+
+    def shard_names(self):
+        """Every shard that may hold rows: the ring's and pinned ones."""
+
+        if not self.sharded:
+            return [None]
+        return sorted(set(self.names) | set(self.pins().values()))
+
+    def session(self, name):
+        """This app context's session for shard `name` (None: the main
+        database's db.session)."""
+
+        if name is None:
+            return db.session()
+
+        scoped = self._sessions.get(name)
+        if scoped is None:
+            with self._lock:
+                scoped = self._sessions.setdefault(name, scoped_session(
+                    lambda: sessionmaker(bind=db.get_engine(bind=name))(),
+                    scopefunc=_app_ctx_stack.__ident_func__))
+        return scoped()
+
+    def session_for(self, user_id):
+        return self.session(self.shard_for(user_id))
+
+    def sessions(self):
+        """A session for every shard, for scatter-gather queries."""
+
+        return [self.session(name) for name in self.shard_names()]
+
+    def remove(self, exc=None):
+        """End this app context's shard sessions."""
+
+        for scoped in self._sessions.values():
+            scoped.remove()
+
+
+shard_router = ShardRouter()
+
+
+##############################################################################
+# Resharding
+
+
+def shard_metadata():
+    """The sharded tables, without foreign keys to other databases."""
+
+    metadata = MetaData()
+    for table in SHARDED_TABLES:
+        columns = [Column(column.name, column.type,
+                          primary_key=column.primary_key,
+                          nullable=column.nullable,
+                          unique=column.unique,
+                          autoincrement=column.autoincrement)
+                   for column in table.columns]
+        shard_table = Table(table.name, metadata, *columns)
+        for index in table.indexes:
+            # the same columns and orderings, on the shard's table
+            Index(index.name, *[replacement_traverse(
+                expression, {},
+                lambda e: shard_table.c[e.name] if isinstance(e, Column)
+                else None) for expression in index.expressions])
+    return metadata
+
+
+def create_shard_tables(name):
+    """Create the sharded tables on shard `name` unless they exist."""
+
+    shard_metadata().create_all(db.get_engine(bind=name))
+
+
+def pin_users(new_names, router=shard_router):
+    """Pin every user that the ring over `new_names` would move to where
+    their rows are now. Returns the number pinned."""
+
+    new_ring = HashRing(new_names)
+    pinned = 0
+    after = 0
+    while True:
+        user_ids = [user_id for user_id, in db.session
+                    .query(User.id).filter(User.id > after)
+                    .order_by(User.id).limit(BATCH_SIZE)]
+        if not user_ids:
+            break
+        after = user_ids[-1]
+
+        pins = router.pins()
+        for user_id in user_ids:
+            current = router.shard_for(user_id)
+            if new_ring[user_id] != current and user_id not in pins:
+                db.session.add(ShardPin(user_id=user_id, shard=current))
+                pinned += 1
+        db.session.commit()
+
+    router._pins_loaded = None
+    return pinned
+
+
+def move_pinned(grace, router=shard_router, log=print,
+                batch_size=BATCH_SIZE):
+    """Move every pinned user to the ring's shard for them, batch_size
+    users at a time."""
+
+    router._pins_loaded = None
+    pins = sorted(router.pins().items())
+    for start in range(0, len(pins), batch_size):
+        for user_id, source, target, copied in move_users(
+                pins[start:start + batch_size], grace, router):
+            log(f"user {user_id}: {source} -> {target}, "
+                f"{copied[0]} messages, {copied[1]} likes")
+
+
+def move_users(pins, grace, router=shard_router):
+    """Move the users of `pins` ((user id, shard)s) from that shard to
+    the ring's; see the module docstring. The whole batch is copied and
+    unpinned, then waits `grace` once. Returns (user id, source, target,
+    (messages, likes) copied) for each."""
+
+    moves = []
+    for user_id, source in pins:
+        target = router.ring[user_id]
+        newest, copied = None, (0, 0)
+        if source != target:
+            newest, copied = _copy(router.session(source),
+                                   router.session(target), user_id,
+                                   after=None)
+        moves.append((user_id, source, target, newest, copied))
+
+    (db.session.query(ShardPin)
+     .filter(ShardPin.user_id.in_([user_id for user_id, _ in pins]))
+     .delete(synchronize_session=False))
+    db.session.commit()
+    router._pins_loaded = None
+
+    moving = [move for move in moves if move[1] != move[2]]
+    if moving:
+        # workers may still write to the sources until they reload pins
+        time.sleep(grace)
+
+    done = []
+    for user_id, source, target, newest, copied in moves:
+        if source != target:
+            src = router.session(source)
+            _, caught_up = _copy(src, router.session(target), user_id,
+                                 after=newest)
+            copied = tuple(a + b for a, b in zip(copied, caught_up))
+
+            delete_tags_of(src, user_id)
+            src.query(Likes).filter(Likes.user_id == user_id).delete()
+            src.query(Message).filter(Message.user_id == user_id).delete()
+            src.commit()
+        done.append((user_id, source, target, copied))
+    return done
+
+
+def delete_tags_of(session, user_id):
+    """Delete the tags and mentions in `user_id`'s messages, which are
+    in `session`; the messages themselves stay."""
+
+    own = session.query(Message.id).filter(Message.user_id == user_id)
+    for model in (MessageTag, MessageMention):
+        (session.query(model).filter(model.message_id.in_(own.subquery()))
+         .delete(synchronize_session=False))
+
+
+def _copy(src, dst, user_id, after):
+    """Copy `user_id`'s messages newer than id `after`, with their tags
+    and mentions, and likes not on `dst` yet. Returns (newest message id
+    copied, (messages, likes))."""
+
+    messages = Message.__table__
+    columns = [column.name for column in messages.columns]
+    count = 0
+    while True:
+        query = (src.query(*messages.columns)
+                 .filter(messages.c.user_id == user_id))
+        if after is not None:
+            query = query.filter(messages.c.id > after)
+        rows = [dict(zip(columns, row)) for row in
+                query.order_by(messages.c.id).limit(BATCH_SIZE)]
+        if not rows:
+            break
+        dst.execute(messages.insert(), rows)
+        ids = [row['id'] for row in rows]
+        for table in (MessageTag.__table__, MessageMention.__table__):
+            indexed = [dict(zip(table.columns.keys(), row)) for row in
+                       src.query(*table.columns)
+                       .filter(table.c.message_id.in_(ids))]
+            if indexed:
+                dst.execute(table.insert(), indexed)
+        dst.commit()
+        after = rows[-1]['id']
+        count += len(rows)
+
+    present = {message_id for message_id, in
+               dst.query(Likes.message_id).filter(Likes.user_id == user_id)}
+    likes = [{'user_id': user_id, 'message_id': message_id}
+             for message_id, in src.query(Likes.message_id)
+             .filter(Likes.user_id == user_id)
+             if message_id not in present]
+    if likes:
+        dst.execute(Likes.__table__.insert(), likes)
+        dst.commit()
+    return after, (count, len(likes))
@@ -0,0 +1,176 @@
+"""Time-sortable 64-bit message ids.
+
+Ids are "snowflakes", laid out from the most significant bit down as:
+
+    41 bits  milliseconds since EPOCH
+    10 bits  worker id
+    12 bits  sequence number within the millisecond
+
+so sorting by id sorts by creation time. Ids are generated in-process with
+no database round trip. Each worker process needs its own worker id, taken
+from the WARBLER_WORKER_ID environment variable when it makes its first
+id. Servers that fork several workers lease each one a distinct id with
+`lease_worker_id` and set it there (see gunicorn.conf.py). Without it, a
+development or testing process (FLASK_ENV) leases the lowest id free on
+this host; anywhere else making an id is an error, as two hosts can't
+tell which ids the other has taken.
+"""
+
+import fcntl
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+EPOCH = datetime(2010, 1, 1)
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Worker id reserved for ids assigned to pre-existing rows (seeding and
+# migrations), so they can never collide with ids generated live.
+BACKFILL_WORKER_ID = MAX_WORKER_ID
+
+
+def to_millis(dt):
+    """Milliseconds between EPOCH and naive UTC datetime `dt`."""
+
+    return int((dt - EPOCH).total_seconds() * 1000)
+
+
+def make_id(millis, worker_id, sequence):
+    """Pack the three snowflake fields into one integer."""
+
+    return ((millis << (WORKER_BITS + SEQUENCE_BITS))
+            | (worker_id << SEQUENCE_BITS)
+            | sequence)
+
+
+def timestamp_of(snowflake):
+    """Creation time (naive UTC datetime) embedded in `snowflake`."""
+
+    millis = snowflake >> (WORKER_BITS + SEQUENCE_BITS)
+    return EPOCH + timedelta(milliseconds=millis)
+
+
+# FLASK_ENVs that may lease a worker id when WARBLER_WORKER_ID is unset
+LEASING_ENVS = {'development', 'testing'}
+
+
+def default_worker_id():
+    """Worker id from WARBLER_WORKER_ID, or leased in development and
+    testing.
+
+    Raises RuntimeError if unset anywhere else, and ValueError if out of
+    range.
+    """
+
+    worker_id = os.environ.get('WARBLER_WORKER_ID')
+    if worker_id is not None:
+        worker_id = int(worker_id)
+        if not 0 <= worker_id < BACKFILL_WORKER_ID:
+            raise ValueError(f"WARBLER_WORKER_ID must be from 0 to "
+                             f"{BACKFILL_WORKER_ID - 1}, not {worker_id}")
+        return worker_id
+
+    if os.environ.get('FLASK_ENV', 'production') in LEASING_ENVS:
+        return lease_worker_id(0, BACKFILL_WORKER_ID)
+    raise RuntimeError("set WARBLER_WORKER_ID to a worker id no other "
+                       "process generating ids holds")
+
+
+_leases = []
+
+
+def lease_worker_id(first, count, directory=None):
+    """Take the lowest worker id in [first, first + count) that no other
+    process on this host holds, and hold it until this process exits.
+
+    A lease is an exclusive lock on a file named after the id, in
+    `directory` (default the temp dir), so the ids of dead processes are
+    free again at once. Raises RuntimeError if every id is taken.
+    """
+
+    directory = directory or tempfile.gettempdir()
+    for worker_id in range(first, first + count):
+        path = os.path.join(directory, f"warbler-worker-{worker_id}.lock")
+        lock = open(path, 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            continue
+        _leases.append(lock)
+        return worker_id
+    raise RuntimeError(f"worker ids {first}-{first + count - 1} are all "
+                       f"taken")
+
+
+class SnowflakeGenerator:
+    """Thread-safe generator of unique, increasing snowflake ids."""
+
+    def __init__(self, worker_id=None):
+        self._fixed_worker_id = worker_id
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # the default is looked up with the first id: importing this
+        # module needs no worker id, and a forked worker finds its own
+        self.worker_id = self._fixed_worker_id
+        self._last = -1
+        self._sequence = 0
+
+    def __call__(self):
+        with self._lock:
+            # a forked worker must not keep generating its parent's ids
+            if os.getpid() != self._pid:
+                self._reset()
+            if self.worker_id is None:
+                self.worker_id = default_worker_id()
+
+            now = to_millis(datetime.utcnow())
+            if now < self._last:
+                # clock went backwards: keep counting from the last tick
+                now = self._last
+
+            if now == self._last:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # sequence exhausted for this millisecond
+                    while now <= self._last:
+                        now = to_millis(datetime.utcnow())
+            else:
+                self._sequence = 0
+
+            self._last = now
+            return make_id(now, self.worker_id, self._sequence)
+
+
+def backfill_ids(timestamps):
+    """Snowflake ids for rows that already have timestamps.
+
+    Returns one id per timestamp, in the same order. Rows sharing a
+    millisecond get consecutive sequence numbers; past 4096 of them the
+    id spills into the following millisecond.
+    """
+
+    used = {}
+    ids = []
+
+    for dt in timestamps:
+        millis = to_millis(dt)
+        while used.get(millis, 0) > MAX_SEQUENCE:
+            millis += 1
+        sequence = used.get(millis, 0)
+        used[millis] = sequence + 1
+        ids.append(make_id(millis, BACKFILL_WORKER_ID, sequence))
+
+    return ids
+
+
+next_id = SnowflakeGenerator()
@@ -0,0 +1,33 @@
+// Say whether the username typed into the signup form is free, once the
+// user pauses typing.
+(function () {
+  var input = document.getElementById('username');
+  if (!input || !window.fetch) {
+    return;
+  }
+
+  var note = document.createElement('small');
+  input.insertAdjacentElement('afterend', note);
+
+  var timer = null;
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    var username = input.value.trim();
+    if (!username) {
+      note.textContent = '';
+      return;
+    }
+    timer = setTimeout(function () {
+      fetch('/api/username-available?username=' +
+            encodeURIComponent(username))
+        .then(function (resp) { return resp.json(); })
+        .then(function (data) {
+          if (data.username !== input.value.trim()) {
+            return;
+          }
+          note.className = data.available ? 'text-success' : 'text-danger';
+          note.textContent = data.available ? 'Available' : 'Already taken';
+        });
+    }, 250);
+  });
+})();
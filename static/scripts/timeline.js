@@ -0,0 +1,14 @@
+// Prepend warbles from followed users to the home timeline as they are
+// posted. The server sends each one as a rendered <li>; EventSource
+// reconnects by itself, resuming after the last event id it saw.
+(function () {
+  var list = document.getElementById('messages');
+  if (!list || !window.EventSource) {
+    return;
+  }
+
+  var source = new EventSource(list.dataset.stream);
+  source.addEventListener('warble', function (event) {
+    list.insertAdjacentHTML('afterbegin', event.data);
+  });
+})();
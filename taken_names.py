@@ -0,0 +1,214 @@
+"""Which usernames and emails are taken, answered mostly from memory.
+
+Signing up hashes the password with bcrypt, which is slow on purpose; a
+duplicate username or email used to surface only afterwards, as an
+IntegrityError at commit. Each worker keeps two Bloom filters, over
+users.username and users.email:
+
+- not in the filter: not taken (as of the filter's last update);
+- in the filter: maybe taken; confirmed with an indexed query.
+
+The filters are built from the users table, then:
+
+- signups and profile edits in this worker add to them directly;
+- every USERNAME_FILTER_REFRESH seconds, users created since the last
+  update (by any worker) are added;
+- every USERNAME_FILTER_REBUILD seconds, they are rebuilt from scratch,
+  dropping old names and growing past their capacity.
+
+With USERNAME_FILTER_BACKGROUND (the default outside tests), a thread
+in each worker, started on first use, does all of this and swaps each
+rebuilt pair of filters in whole. Requests never wait for it: they use
+the filters they find, and until the first build is done they ask the
+database. Otherwise the request that finds the filters due builds or
+refreshes them itself.
+
+A name taken through another worker in the last few seconds, or by a
+rename, may read as free until then. The unique constraints still
+reject it at commit, so the filter only decides how early a duplicate
+is caught.
+"""
+
+import math
+import os
+import threading
+import time
+from hashlib import blake2b
+
+from models import db, User
+from queries import username_exists, email_exists
+
+BATCH_SIZE = 10000
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # the optimal number of bits and of hash functions for `capacity`
+        # entries at `error_rate`
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate)
+                                      / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # double hashing: k positions from two 64-bit halves of one digest
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+class TakenNames:
+    """Bloom filters over taken usernames and emails, with exact confirm."""
+
+    def __init__(self, capacity=1_000_000, error_rate=0.01, refresh=5,
+                 rebuild=3600, background=False):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh = refresh
+        self.rebuild_every = rebuild
+        self.background = background
+        self.app = None
+        self._filters = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def init_app(self, app):
+        """Configure from USERNAME_FILTER_* settings."""
+
+        self.capacity = app.config.setdefault('USERNAME_FILTER_CAPACITY',
+                                              self.capacity)
+        self.error_rate = app.config.setdefault(
+            'USERNAME_FILTER_ERROR_RATE', self.error_rate)
+        self.refresh = app.config.setdefault('USERNAME_FILTER_REFRESH',
+                                             self.refresh)
+        self.rebuild_every = app.config.setdefault('USERNAME_FILTER_REBUILD',
+                                                   self.rebuild_every)
+        self.background = app.config.setdefault(
+            'USERNAME_FILTER_BACKGROUND', self.background)
+        self.app = app
+        self.clear()
+
+    def clear(self):
+        """Forget the filters; the next check rebuilds them."""
+
+        self._filters = None
+
+    ##########################################################################
+    # filters
+
+    def filters(self):
+        """(usernames, emails) filters, or None before the first build."""
+
+        if self.background:
+            self._start()
+        else:
+            with self._lock:
+                self._update(time.monotonic())
+        state = self._filters
+        return state and (state['usernames'], state['emails'])
+
+    def _update(self, now):
+        """Build the filters if they are missing or due a rebuild, else
+        add new users if they are due a refresh."""
+
+        state = self._filters
+        if state is None or now - state['built'] > self.rebuild_every:
+            # swapped in whole: readers see the old filters or the new
+            self._filters = self._build(now)
+        elif now - state['refreshed'] > self.refresh:
+            self._add_new_users(state)
+            state['refreshed'] = now
+
+    def _start(self):
+        """Start this process's updater, unless it is running."""
+
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        threading.Thread(target=self._run, daemon=True,
+                         name='taken-names-updater').start()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self._update(time.monotonic())
+                except Exception:
+                    self.app.logger.exception("updating the taken names "
+                                              "filters failed")
+                finally:
+                    db.session.remove()
+            time.sleep(self.refresh)
+
+    def _build(self, now):
+        count = db.session.query(User.id).count()
+        capacity = max(self.capacity, 2 * count)
+        state = {'usernames': BloomFilter(capacity, self.error_rate),
+                 'emails': BloomFilter(capacity, self.error_rate),
+                 'last_id': 0, 'built': now, 'refreshed': now}
+        self._add_new_users(state)
+        return state
+
+    def _add_new_users(self, state):
+        """Add users with ids above the last one seen, in batches."""
+
+        while True:
+            rows = (db.session
+                    .query(User.id, User.username, User.email)
+                    .filter(User.id > state['last_id'])
+                    .order_by(User.id)
+                    .limit(BATCH_SIZE)
+                    .all())
+            for _, username, email in rows:
+                state['usernames'].add(username)
+                state['emails'].add(email)
+            if rows:
+                state['last_id'] = rows[-1].id
+            if len(rows) < BATCH_SIZE:
+                return
+
+    def add(self, username, email):
+        """Record a username and email just taken in this worker."""
+
+        filters = self.filters()
+        if filters is not None:
+            # else the build finds them in the table
+            usernames, emails = filters
+            usernames.add(username)
+            emails.add(email)
+
+    ##########################################################################
+    # checks
+
+    def username_taken(self, username):
+        filters = self.filters()
+        return ((filters is None or username in filters[0])
+                and username_exists(username))
+
+    def email_taken(self, email):
+        filters = self.filters()
+        return ((filters is None or email in filters[1])
+                and email_exists(email))
+
+
+taken_names = TakenNames()
@@ -0,0 +1,131 @@
+"""Engagement analytics tests."""
+
+# run these tests like:
+#
+# python -m unittest test_analytics.py
+
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from analytics import run
+from app import CURR_USER_KEY
+from archive import month_start
+from models import db, User, Message, Likes, Follows
+from snowflake import make_id, to_millis
+from testcase import DBTestCase, app
+
+
+def quiet(line):
+    pass
+
+
+class AnalyticsTestCase(DBTestCase):
+    """Test snapshots, aggregates and the dashboard."""
+
+    def setUp(self):
+        super().setUp()
+
+        users = [User.signup(name, f"{name}@test.com", "password", None)
+                 for name in ('ann', 'bob', 'cat')]
+        db.session.commit()
+        self.ann, self.bob, self.cat = [user.id for user in users]
+
+        now = datetime.utcnow()
+        two_months_ago = month_start(now.year, now.month - 2) + \
+            timedelta(days=1)
+        posts = [(self.ann, two_months_ago), (self.ann, now),
+                 (self.bob, now), (self.bob, now)]
+        for seq, (user_id, when) in enumerate(posts):
+            db.session.add(Message(id=make_id(to_millis(when), 1, seq),
+                                   text="warble", timestamp=when,
+                                   user_id=user_id))
+        # likes reference the messages
+        db.session.flush()
+        self.liked = make_id(to_millis(now), 1, 1)
+        db.session.add(Likes(user_id=self.bob, message_id=self.liked))
+        db.session.add_all([
+            Follows(user_following_id=self.ann, user_being_followed_id=self.bob),
+            Follows(user_following_id=self.cat, user_being_followed_id=self.bob),
+            Follows(user_following_id=self.bob, user_being_followed_id=self.ann),
+        ])
+        db.session.commit()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        config = patch.dict(app.config, ANALYTICS_DIR=self.tmp.name,
+                            ADMIN_USERNAMES=['cat'])
+        config.start()
+        self.addCleanup(config.stop)
+
+    def run_job(self, from_snapshot=False):
+        # small batches: every table takes several keyset pages
+        return run(self.tmp.name, batch_size=2, days=7, top=5,
+                   from_snapshot=from_snapshot, log=quiet)
+
+    def test_aggregates(self):
+        stats = self.run_job()
+
+        self.assertEqual(stats['totals'],
+                         {'users': 3, 'authors': 2, 'messages': 4,
+                          'likes': 1, 'follows': 3})
+        self.assertEqual(len(stats['daily']), 7)
+        self.assertEqual(stats['daily'][-1]['posts'], 3)
+        self.assertEqual(stats['daily'][-1]['authors'], 2)
+        self.assertEqual(stats['daily'][-1]['likes'], 1)
+
+        self.assertEqual(stats['active_users'], [
+            {'id': self.bob, 'username': 'bob', 'posts': 2, 'likes': 0,
+             'like_rate': 0.0},
+            {'id': self.ann, 'username': 'ann', 'posts': 1, 'likes': 1,
+             'like_rate': 1.0},
+        ])
+
+        # ann first posted two months ago, and again this month
+        first, this = stats['cohorts'][-3], stats['cohorts'][-1]
+        self.assertEqual(first['size'], 1)
+        self.assertEqual(first['retention'], [1.0, 0.0, 1.0])
+        self.assertEqual(this['size'], 1)
+
+        self.assertEqual(stats['followers']['most_followed'][0],
+                         {'id': self.bob, 'username': 'bob', 'followers': 2})
+        self.assertIsNone(stats['followers']['since'])
+
+    def test_follower_growth(self):
+        self.run_job()
+        db.session.add(Follows(user_following_id=self.cat,
+                               user_being_followed_id=self.ann))
+        db.session.commit()
+
+        stats = self.run_job()
+
+        self.assertIsNotNone(stats['followers']['since'])
+        self.assertEqual(stats['followers']['gainers'],
+                         [{'id': self.ann, 'username': 'ann',
+                           'followers': 2, 'gained': 1}])
+
+    def test_from_snapshot(self):
+        self.run_job()
+        Message.query.filter_by(user_id=self.bob).delete()
+        db.session.commit()
+
+        stats = self.run_job(from_snapshot=True)
+
+        self.assertEqual(stats['totals']['messages'], 4)
+        self.assertEqual(len(stats['history']), 1)
+
+    def test_dashboard(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.cat
+
+        html = self.client.get('/admin/stats').get_data(as_text=True)
+        self.assertIn("No stats yet", html)
+
+        self.run_job()
+        html = self.client.get('/admin/stats').get_data(as_text=True)
+        self.assertIn('@bob', html)
+        self.assertIn('Cohorts by first post', html)
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ann
+        self.assertEqual(self.client.get('/admin/stats').status_code, 302)
@@ -0,0 +1,129 @@
+"""Message archive tests."""
+
+# run these tests like:
+#
+# python -m unittest test_archive.py
+
+import glob
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from archive import (MessageArchive, message_archive, month_bounds,
+                     partition_name)
+from models import db, User, Message
+from snowflake import backfill_ids
+from testcase import DBTestCase
+
+
+class MessageArchiveTestCase(TestCase):
+    """Test writing and reading back archived months."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.archive = MessageArchive(self.tmp.name)
+
+        self.ids = {}
+        for month in (1, 2):
+            timestamps = [datetime(2019, month, day) for day in range(1, 6)]
+            ids = backfill_ids(timestamps)
+            rows = [(10 if day % 2 else 20, msg_id, ts, f"m{month} d{day}")
+                    for day, msg_id, ts in zip(range(1, 6), ids, timestamps)]
+            self.archive.write(2019, month, rows)
+            self.ids[month] = ids
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_month_bounds(self):
+        low, high = month_bounds(2019, 12)
+
+        self.assertEqual(month_bounds(2020, 1)[0], high)
+        for msg_id in self.ids[1] + self.ids[2]:
+            self.assertLess(msg_id, low)
+        self.assertEqual(partition_name(2019, 2), "messages_y2019m02")
+
+    def test_months(self):
+        self.assertEqual(self.archive.months(), [(2019, 2), (2019, 1)])
+
+    def test_user_messages_newest_first(self):
+        messages = self.archive.user_messages(10)
+
+        self.assertEqual([m.text for m in messages],
+                         ["m2 d5", "m2 d3", "m2 d1",
+                          "m1 d5", "m1 d3", "m1 d1"])
+        self.assertEqual(messages[0].timestamp, datetime(2019, 2, 5))
+
+    def test_user_messages_before_and_limit(self):
+        messages = self.archive.user_messages(20, before=self.ids[2][1],
+                                              limit=1)
+
+        self.assertEqual([m.text for m in messages], ["m1 d4"])
+
+    def test_reads_only_the_users_blocks(self):
+        with patch('archive._load', side_effect=AssertionError):
+            self.assertEqual(len(self.archive.user_messages(20)), 4)
+            self.assertEqual(self.archive.user_messages(30), [])
+
+    def test_indexes_older_archives(self):
+        for path in glob.glob(os.path.join(self.tmp.name, 'users-*')):
+            os.remove(path)
+
+        self.assertEqual(len(self.archive.user_messages(10)), 6)
+        self.assertTrue(os.path.exists(
+            self.archive.users_path(2019, 2) + '.index.json'))
+
+    def test_boundary(self):
+        self.assertEqual(self.archive.boundary(), month_bounds(2019, 3)[0])
+        self.assertIsNone(MessageArchive(None).boundary())
+
+    def test_missing_directory(self):
+        archive = MessageArchive(None)
+
+        self.assertEqual(archive.user_messages(10), [])
+
+
+class ProfileArchiveTestCase(DBTestCase):
+    """Test profile pages paging from the database into the archive."""
+
+    def setUp(self):
+        super().setUp()
+
+        user = User.signup("ann", "ann@test.com", "password", None)
+        db.session.commit()
+        self.user_id = user.id
+        db.session.add(Message(text="hot warble", user_id=user.id))
+        db.session.commit()
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        archive = MessageArchive(tmp.name)
+        timestamps = [datetime(2019, 1, day) for day in (1, 2)]
+        rows = [(user.id, msg_id, ts, f"cold {ts.day}")
+                for msg_id, ts in zip(backfill_ids(timestamps), timestamps)]
+        archive.write(2019, 1, rows)
+
+        patcher = patch.object(message_archive, 'directory', tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_through(self):
+        html = self.client.get(f"/users/{self.user_id}").get_data(
+            as_text=True)
+
+        self.assertIn("hot warble", html)
+        self.assertIn("cold 2", html)
+        self.assertLess(html.index("cold 2"), html.index("cold 1"))
+
+    def test_below_the_boundary_skips_the_database(self):
+        boundary = message_archive.boundary()
+        with patch('views.user_messages_before') as query:
+            html = self.client.get(
+                f"/users/{self.user_id}?before={boundary}").get_data(
+                    as_text=True)
+        query.assert_not_called()
+
+        self.assertNotIn("hot warble", html)
+        self.assertIn("cold 1", html)
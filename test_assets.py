@@ -0,0 +1,78 @@
+"""Static asset build tests."""
+
+# run these tests like:
+#
+# python -m unittest test_assets.py
+
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+
+from werkzeug.datastructures import Accept
+
+from assets import Assets, build, minify_css, precompressed
+
+
+class AssetBuildTestCase(TestCase):
+    """Test minifying, fingerprinting and precompressing assets."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.static = self.tmp.name
+        os.makedirs(os.path.join(self.static, 'stylesheets'))
+
+        with open(os.path.join(self.static, 'stylesheets', 'a.css'), 'w') as f:
+            f.write("/* header */\n"
+                    ".nav > li a:hover {\n  color : red;\n}\n"
+                    "body { background: url('/static/bg.txt'); }\n")
+        with open(os.path.join(self.static, 'bg.txt'), 'w') as f:
+            f.write("not really an image")
+
+        self.manifest = build(self.static)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self, name):
+        path = os.path.join(self.static, 'build', self.manifest[name])
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_minify_css(self):
+        self.assertEqual(minify_css(".a :hover , b{ color : red ; }"),
+                         ".a :hover,b{color:red}")
+
+    def test_manifest(self):
+        self.assertRegex(self.manifest['stylesheets/a.css'],
+                         r'^stylesheets/a\.[0-9a-f]{12}\.css$')
+        self.assertRegex(self.manifest['bg.txt'], r'^bg\.[0-9a-f]{12}\.txt$')
+
+    def test_css_references_built_files(self):
+        css = self.read('stylesheets/a.css').decode('utf-8')
+
+        self.assertEqual(
+            css,
+            ".nav>li a:hover{color:red}"
+            f'body{{background:url("/static/build/{self.manifest["bg.txt"]}")}}')
+
+    def test_precompressed(self):
+        path = os.path.join(self.static, 'build',
+                            self.manifest['stylesheets/a.css'])
+
+        with gzip.open(path + '.gz') as f:
+            self.assertEqual(f.read(), self.read('stylesheets/a.css'))
+
+        self.assertEqual(precompressed(path, Accept([('gzip', 1)])),
+                         (path + '.gz', 'gzip'))
+        self.assertEqual(precompressed(path, Accept([('identity', 1)])),
+                         (path, None))
+
+    def test_static_url(self):
+        assets = Assets()
+        assets.manifest = self.manifest
+
+        self.assertEqual(assets.static_url('stylesheets/a.css'),
+                         f"/static/build/{self.manifest['stylesheets/a.css']}")
+        self.assertEqual(assets.static_url('missing.png'),
+                         "/static/missing.png")
@@ -0,0 +1,149 @@
+"""Author card cache tests."""
+
+# run these tests like:
+#
+# python -m unittest test_author_cards.py
+
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from app import CURR_USER_KEY
+from author_cards import AuthorCard, AuthorCards, WAYS, author_cards
+from models import db, User
+from testcase import DBTestCase
+
+
+class AuthorCardsTestCase(DBTestCase):
+    """Test caching cards in a file shared between processes."""
+
+    def setUp(self):
+        super().setUp()
+
+        for user_id in range(1, 4):
+            user = User.signup(f"user{user_id}", f"{user_id}@test.com",
+                               "password", f"/img/{user_id}.png")
+            user.id = user_id
+        db.session.commit()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cards')
+        self.cards = AuthorCards(self.path, slots=16)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def fetches(self):
+        """Patch the database fetch, counting the ids it's asked for."""
+
+        return patch('author_cards.author_card_rows',
+                     side_effect=self._fetch)
+
+    def _fetch(self, user_ids):
+        self.fetched.extend(sorted(user_ids))
+        return [(user.id, user.username, user.image_url)
+                for user in User.query.filter(User.id.in_(user_ids))]
+
+    def test_hits_after_first_fetch(self):
+        self.fetched = []
+        with self.fetches():
+            self.assertEqual(self.cards.get_many([1, 2, 99]),
+                             {1: AuthorCard(1, 'user1', '/img/1.png'),
+                              2: AuthorCard(2, 'user2', '/img/2.png')})
+            self.assertEqual(self.cards.get(2).username, 'user2')
+
+            # another worker mapping the same file
+            other = AuthorCards(self.path, slots=16)
+            self.assertEqual(other.get(1).image_url, '/img/1.png')
+
+        # 99 doesn't exist, so it's asked for again
+        self.assertEqual(self.fetched, [1, 2, 99])
+
+    def test_invalidate(self):
+        self.cards.get(1)
+        User.query.get(1).username = 'renamed'
+        db.session.commit()
+
+        self.assertEqual(self.cards.get(1).username, 'user1')
+        self.cards.invalidate(1)
+        self.assertEqual(self.cards.get(1).username, 'renamed')
+
+    def test_stale_fetch_not_stored(self):
+        # an update lands between this worker's miss and its fetch
+        # storing: the card it fetched must not be kept
+        def fetch_then_update(user_ids):
+            rows = self._fetch(user_ids)
+            self.cards.invalidate(1)
+            return rows
+
+        self.fetched = []
+        with patch('author_cards.author_card_rows',
+                   side_effect=fetch_then_update):
+            self.cards.get(1)
+        with self.fetches():
+            self.cards.get(1)
+        self.assertEqual(self.fetched, [1, 1])
+
+    def test_bounded(self):
+        sets = 16 // WAYS
+        # every id maps to set 0; only WAYS of them fit
+        ids = [sets * i for i in range(1, 7)]
+        for n, user_id in enumerate(ids):
+            with patch('time.time', return_value=100.0 + n):
+                self.cards._store(self.cards._map(),
+                                  [AuthorCard(user_id, f"u{user_id}", None)],
+                                  {user_id: 0})
+        self.assertEqual(os.path.getsize(self.cards.file_path()),
+                         len(self.cards._map()))
+
+        # the oldest were evicted
+        mm = self.cards._map()
+        cached = [i for i in ids if self.cards._read(mm, i, 100.0)[0]]
+        self.assertEqual(cached, ids[-WAYS:])
+
+    def test_expired(self):
+        self.cards.ttl = -1
+        self.fetched = []
+        with self.fetches():
+            self.cards.get(1)
+            self.cards.get(1)
+        self.assertEqual(self.fetched, [1, 1])
+
+    def test_layout_change_wipes(self):
+        self.cards.get(1)
+        self.cards._map()[4:8] = (99).to_bytes(4, 'little')
+
+        self.fetched = []
+        with self.fetches():
+            AuthorCards(self.path, slots=16).get(1)
+        self.assertEqual(self.fetched, [1])
+
+    def test_resize_uses_a_new_file(self):
+        self.cards.get(1)
+        mm = self.cards._map()
+
+        bigger = AuthorCards(self.path, slots=32)
+        self.fetched = []
+        with self.fetches():
+            bigger.get(1)
+        self.assertEqual(self.fetched, [1])
+        self.assertNotEqual(bigger.file_path(), self.cards.file_path())
+        self.assertEqual(os.listdir(self.tmp.name),
+                         [os.path.basename(bigger.file_path())])
+
+        # the old mapping is whole, if no longer shared
+        self.assertEqual(len(mm), len(self.cards._map()))
+        self.assertEqual(self.cards._read(mm, 1, time.time())[0].id, 1)
+
+    def test_profile_edit_invalidates(self):
+        author_cards.get(1)
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+        self.client.post('/users/profile', data={
+            'username': 'renamed', 'email': '1@test.com',
+            'password': 'password'})
+
+        self.assertEqual(author_cards.get(1).username, 'renamed')
@@ -0,0 +1,129 @@
+"""Live timeline tests."""
+
+# run these tests like:
+#
+# python -m unittest test_broker.py
+
+from unittest import TestCase, skipIf
+
+from app import CURR_USER_KEY
+from models import db, User, Message, Follows
+from broker import TimelineBroker, PostgresTransport, Overflow, timeline_broker
+from testcase import DBTestCase, app
+
+
+class TimelineBrokerTestCase(TestCase):
+    """Test in-process publish/subscribe."""
+
+    def setUp(self):
+        self.broker = TimelineBroker(max_pending=3)
+
+    def test_delivers_by_author(self):
+        with self.broker.subscribe([1, 2]) as sub:
+            self.broker.publish(1, 100)
+            self.broker.publish(3, 101)
+            self.broker.publish(2, 102)
+
+            self.assertEqual(sub.get(timeout=0), [(1, 100), (2, 102)])
+            self.assertEqual(sub.get(timeout=0), [])
+
+    def test_unsubscribe(self):
+        with self.broker.subscribe([1]) as sub:
+            self.assertEqual(self.broker.subscriber_count(), 1)
+
+        self.broker.publish(1, 100)
+        self.assertEqual(self.broker.subscriber_count(), 0)
+        self.assertEqual(sub.get(timeout=0), [])
+
+    def test_overflow(self):
+        with self.broker.subscribe([1]) as sub:
+            for msg_id in range(4):
+                self.broker.publish(1, msg_id)
+
+            with self.assertRaises(Overflow):
+                sub.get(timeout=0)
+
+
+@skipIf(db.get_engine(app).dialect.name != 'postgresql',
+        "LISTEN/NOTIFY needs Postgres")
+class PostgresTransportTestCase(TestCase):
+    """Test publishing across connections with NOTIFY."""
+
+    def test_notify(self):
+        broker = TimelineBroker()
+        broker.transport = PostgresTransport(app, broker.deliver,
+                                             channel='warbler_test')
+
+        with broker.subscribe([1]) as sub:
+            # publish until the listener thread has started listening
+            for attempt in range(50):
+                broker.publish(1, attempt)
+                ids = sub.get(timeout=0.1)
+                if ids:
+                    break
+
+        self.assertTrue(ids)
+
+
+class StreamTimelineViewTestCase(DBTestCase):
+    """Test the /stream/timeline endpoint."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.signup("reader", "reader@test.com", "password", None)
+        self.user.id = 1
+        author = User.signup("author", "author@test.com", "password", None)
+        author.id = 2
+        db.session.commit()
+
+        db.session.add(Follows(user_following_id=1, user_being_followed_id=2))
+        db.session.add(Message(id=10, text="seen", user_id=2))
+        db.session.add(Message(id=11, text="missed", user_id=2))
+        db.session.commit()
+
+    def test_requires_login(self):
+        self.assertEqual(self.client.get("/stream/timeline").status_code, 401)
+
+    def test_stream(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.get("/stream/timeline?after=10", buffered=False)
+            self.assertEqual(resp.mimetype, 'text/event-stream')
+            events = (chunk.decode("utf-8") for chunk in resp.response)
+
+            self.assertTrue(next(events).startswith("retry:"))
+
+            caught_up = next(events)
+            self.assertIn("id: 11\n", caught_up)
+            self.assertIn("missed", caught_up)
+
+            db.session.add(Message(id=12, text="live", user_id=2))
+            db.session.commit()
+            timeline_broker.publish(2, 12)
+
+            live = next(events)
+            self.assertTrue(live.startswith("event: warble\nid: 12\n"))
+            self.assertIn("data: <li", live)
+            self.assertIn("live", live)
+
+            resp.close()
+            self.assertEqual(timeline_broker.subscriber_count(), 0)
+
+    def test_stream_not_compressed(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.get("/stream/timeline?after=10", buffered=False,
+                         headers={'Accept-Encoding': 'gzip'})
+            self.assertNotIn('Content-Encoding', resp.headers)
+            events = (chunk.decode("utf-8") for chunk in resp.response)
+
+            # each event as it is produced, not held back
+            self.assertTrue(next(events).startswith("retry:"))
+            self.assertIn("id: 11\n", next(events))
+
+            resp.close()
@@ -0,0 +1,157 @@
+"""Compression middleware tests."""
+
+# run these tests like:
+#
+# python -m unittest test_compression.py
+
+import gzip
+import zlib
+from unittest import TestCase
+
+import brotli
+
+from compression import CompressMiddleware, parse_accept_encoding
+
+BODY = b"<li>warble warble warble</li>" * 100
+
+
+def make_app(body=BODY, content_type='text/html; charset=utf-8',
+             streamed=False, extra_headers=(), status='200 OK'):
+    """WSGI app returning `body`, optionally in chunks without a length."""
+
+    def app(environ, start_response):
+        headers = [('Content-Type', content_type)] + list(extra_headers)
+        if streamed:
+            start_response(status, headers)
+            return iter([body[i:i + 100] for i in range(0, len(body), 100)])
+        headers.append(('Content-Length', str(len(body))))
+        start_response(status, headers)
+        return [body]
+
+    return app
+
+
+def call(app, accept_encoding=None, method='GET'):
+    environ = {'REQUEST_METHOD': method}
+    if accept_encoding is not None:
+        environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = status
+        started['headers'] = dict(headers)
+
+    chunks = list(app(environ, start_response))
+    return started['headers'], chunks
+
+
+class CompressMiddlewareTestCase(TestCase):
+    """Test negotiation, thresholds and streaming."""
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding("gzip, br;q=0, deflate;q=0.5"),
+                         {"gzip", "deflate"})
+
+    def test_gzip(self):
+        headers, chunks = call(CompressMiddleware(make_app()), "gzip")
+
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(headers['Content-Length']), len(b''.join(chunks)))
+        self.assertEqual(gzip.decompress(b''.join(chunks)), BODY)
+
+    def test_prefers_brotli(self):
+        headers, chunks = call(CompressMiddleware(make_app()), "gzip, br")
+
+        self.assertEqual(headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(b''.join(chunks)), BODY)
+
+    def test_not_accepted(self):
+        headers, chunks = call(CompressMiddleware(make_app()))
+
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(b''.join(chunks), BODY)
+
+    def test_below_min_size(self):
+        app = CompressMiddleware(make_app(b"tiny"), min_size=500)
+        headers, chunks = call(app, "gzip")
+
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(b''.join(chunks), b"tiny")
+
+    def test_skips_ranges(self):
+        app = CompressMiddleware(make_app(
+            status='206 Partial Content',
+            extra_headers=[('Content-Range', f'bytes 0-{len(BODY) - 1}/*')]))
+        headers, chunks = call(app, "gzip")
+
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(b''.join(chunks), BODY)
+
+        app = CompressMiddleware(make_app(
+            extra_headers=[('Content-Range', 'bytes */3000')]))
+        headers, chunks = call(app, "gzip")
+
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_skips_compressed_types(self):
+        app = CompressMiddleware(make_app(content_type='image/jpeg'))
+        headers, chunks = call(app, "gzip")
+
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertNotIn('Vary', headers)
+
+        app = CompressMiddleware(make_app(
+            extra_headers=[('Content-Encoding', 'br')]))
+        headers, chunks = call(app, "gzip")
+
+        self.assertEqual(headers['Content-Encoding'], 'br')
+        self.assertEqual(b''.join(chunks), BODY)
+
+    def test_streamed_chunk_by_chunk(self):
+        app = CompressMiddleware(make_app(streamed=True), min_size=200)
+        headers, chunks = call(app, "gzip")
+
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', headers)
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(gzip.decompress(b''.join(chunks)), BODY)
+
+    def test_stream_not_held_back(self):
+        produced = []
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            for chunk in (b"first", b"second"):
+                produced.append(chunk)
+                yield chunk
+
+        started = {}
+        chunks = CompressMiddleware(app, min_size=500)(
+            {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'},
+            lambda status, headers, exc_info=None: started.update(headers))
+
+        # the first chunk arrives, decodable, before the app makes another
+        first = next(chunks)
+        self.assertEqual(started['Content-Encoding'], 'gzip')
+        self.assertEqual(produced, [b"first"])
+        self.assertEqual(zlib.decompressobj(31).decompress(first), b"first")
+        self.assertEqual(gzip.decompress(first + b''.join(chunks)),
+                         b"firstsecond")
+
+    def test_skips_event_streams(self):
+        app = CompressMiddleware(make_app(content_type='text/event-stream',
+                                          streamed=True))
+        headers, chunks = call(app, "gzip")
+
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(b''.join(chunks), BODY)
+
+    def test_head(self):
+        headers, chunks = call(CompressMiddleware(make_app()), "gzip",
+                               method='HEAD')
+
+        self.assertNotIn('Content-Encoding', headers)
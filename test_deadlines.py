@@ -0,0 +1,147 @@
+"""Route budget, degraded mode and load shedding tests, with a slow DB
+simulated by fault injection."""
+
+# run these tests like:
+#
+# python -m unittest test_deadlines.py
+
+import threading
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import CURR_USER_KEY
+from deadlines import deadlines
+from models import db, User, Message, Follows
+from timeline_cache import timeline_cache
+from testcase import DBTestCase, app
+
+BUDGET = 0.1
+SLOW = 0.3
+
+
+@contextmanager
+def slow_statements(match, seconds=SLOW):
+    """Make statements containing `match` take `seconds` longer: in the
+    server on Postgres (so statement_timeout cancels them), in the client
+    otherwise."""
+
+    def delay(conn, cursor, statement, parameters, context, executemany):
+        if match in statement:
+            if conn.dialect.name == 'postgresql':
+                statement = f"SELECT pg_sleep({seconds}); {statement}"
+            else:
+                time.sleep(seconds)
+        return statement, parameters
+
+    event.listen(Engine, 'before_cursor_execute', delay, retval=True)
+    try:
+        yield
+    finally:
+        event.remove(Engine, 'before_cursor_execute', delay)
+
+
+class DeadlinesTestCase(DBTestCase):
+    """Test pages against a database that has become slow."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.reader = User.signup("reader", "reader@test.com", "password",
+                                  None)
+        self.author = User.signup("author", "author@test.com", "password",
+                                  None)
+        db.session.flush()
+        db.session.add(Follows(user_following_id=self.reader.id,
+                               user_being_followed_id=self.author.id))
+        db.session.add(Message(text="old warble", user_id=self.author.id))
+        db.session.commit()
+        self.reader_id = self.reader.id
+        self.author_id = self.author.id
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.reader_id
+
+        self.budgets = patch.dict(app.config, TIMELINE_BUDGET=BUDGET,
+                                  STATS_BUDGET=BUDGET)
+        self.budgets.start()
+
+    def tearDown(self):
+        self.budgets.stop()
+        super().tearDown()
+
+    def test_stale_timeline(self):
+        self.assertIn("old warble", self.client.get('/').get_data(as_text=True))
+
+        # posted through another worker, after this one's buffers expired
+        db.session.add(Message(text="new warble", user_id=self.author_id))
+        db.session.commit()
+        with patch.object(timeline_cache, 'ttl', 0), \
+                slow_statements('row_number()'):
+            resp = self.client.get('/')
+
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("old warble", html)
+        self.assertNotIn("new warble", html)
+        self.assertIn("Warbler is busy", html)
+
+        # and once the database recovers
+        with patch.object(timeline_cache, 'ttl', 0):
+            html = self.client.get('/').get_data(as_text=True)
+        self.assertIn("new warble", html)
+        self.assertNotIn("Warbler is busy", html)
+
+    def test_stats_bar_hidden(self):
+        with slow_statements('count('):
+            resp = self.client.get(f'/users/{self.author_id}')
+
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("old warble", html)
+        self.assertNotIn('class="stat"', html)
+
+        html = self.client.get(f'/users/{self.author_id}').get_data(
+            as_text=True)
+        self.assertIn('class="stat"', html)
+
+    def test_route_over_budget(self):
+        with patch.dict(app.config['ROUTE_BUDGETS'],
+                        {'warbler.users_show': BUDGET}), \
+                slow_statements('FROM messages'):
+            start = time.monotonic()
+            resp = self.client.get(f'/users/{self.author_id}')
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '1')
+        if db.engine.dialect.name == 'postgresql':
+            # cancelled by the server, not waited out
+            self.assertLess(elapsed, SLOW)
+
+        self.assertEqual(self.client.get(f'/users/{self.author_id}')
+                         .status_code, 200)
+
+    def test_shedding(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        with patch.object(deadlines, '_slots', threading.BoundedSemaphore(1)):
+            deadlines._slots.acquire()
+            event.listen(Engine, 'before_cursor_execute', count)
+            try:
+                resp = self.client.get('/')
+            finally:
+                event.remove(Engine, 'before_cursor_execute', count)
+                deadlines._slots.release()
+
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(statements, [])
+            # the slot is handed back after each request
+            self.assertEqual(self.client.get('/').status_code, 200)
+            self.assertEqual(self.client.get('/').status_code, 200)
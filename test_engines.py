@@ -0,0 +1,127 @@
+"""Engine tuning tests."""
+
+# run these tests like:
+#
+# python -m unittest test_engines.py
+
+import sqlite3
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+
+from sqlalchemy import exc
+
+from app import CURR_USER_KEY
+from config import Config
+from engines import TimedQueuePool, engine_options, pool_size
+from models import db, User
+from queries import user_by_username, user_messages_before, NEWEST
+from testcase import DBTestCase, app
+
+POSTGRES = db.get_engine(app).dialect.name == 'postgresql'
+
+
+def config(**settings):
+    return dict({key: getattr(Config, key) for key in dir(Config)
+                 if key.isupper()}, **settings)
+
+
+class EngineOptionsTestCase(TestCase):
+    """Test pool sizing and the pgbouncer mode."""
+
+    def test_pool_size(self):
+        # a share of the connections, no more than the worker's threads
+        self.assertEqual(pool_size(config(WORKERS=4, DB_MAX_CONNECTIONS=100,
+                                          WORKER_THREADS=8)), 8)
+        self.assertEqual(pool_size(config(WORKERS=40, DB_MAX_CONNECTIONS=100,
+                                          WORKER_THREADS=8)), 2)
+        self.assertEqual(pool_size(config(WORKERS=400,
+                                          DB_MAX_CONNECTIONS=100)), 1)
+        # gevent serves up to MAX_CONCURRENT_REQUESTS at once
+        self.assertEqual(pool_size(config(
+            WORKERS=2, DB_MAX_CONNECTIONS=100, WORKER_CLASS='gevent',
+            MAX_CONCURRENT_REQUESTS=32)), 32)
+        self.assertEqual(pool_size(config(DB_POOL_SIZE=3)), 3)
+
+    def test_options(self):
+        options = engine_options(config(DB_POOL_SIZE=3))
+
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['max_overflow'], 0)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(
+            options['execution_options']['prepared_statements'],
+            Config.DB_PREPARED_PER_CONNECTION)
+
+    def test_transaction_mode(self):
+        options = engine_options(config(DB_POOL_MODE='transaction'))
+
+        self.assertFalse(options['execution_options']['prepared_statements'])
+
+    def test_pool_waits(self):
+        pool = TimedQueuePool(lambda: sqlite3.connect(':memory:'),
+                              pool_size=1, max_overflow=0, timeout=0.05)
+
+        held = pool.connect()
+        with self.assertRaises(exc.TimeoutError):
+            pool.connect()
+        held.close()
+        pool.connect().close()
+
+        status = pool.status_summary()
+        self.assertEqual(status['checkouts'], 3)
+        self.assertEqual(status['timeouts'], 1)
+        self.assertGreaterEqual(status['max_ms'], 50)
+        self.assertEqual(sum(status['histogram_ms'].values()), 3)
+
+
+class EngineTestCase(DBTestCase):
+    """Test prepared statements and /admin/pool."""
+
+    def setUp(self):
+        super().setUp()
+        user = User.signup("ann", "ann@test.com", "password", None)
+        db.session.commit()
+        self.user_id = user.id
+        if POSTGRES:
+            # start from none prepared on this (pooled) connection
+            self.connection.execute("DEALLOCATE ALL")
+            self.connection.connection.info.pop('prepared', None)
+
+    def prepared(self):
+        return [statement for statement, in db.session.execute(
+            "SELECT statement FROM pg_prepared_statements")]
+
+    @skipIf(not POSTGRES, "prepared statements need Postgres")
+    def test_prepared_statements(self):
+        self.assertEqual(user_by_username('ann').id, self.user_id)
+        self.assertEqual(len(self.prepared()), 1)
+        self.assertIn('$1', self.prepared()[0])
+
+        # prepared once, executed again with other parameters
+        self.assertIsNone(user_by_username('bob'))
+        self.assertEqual(user_messages_before(self.user_id, NEWEST, 10), [])
+        self.assertEqual(user_messages_before(self.user_id, 5, 20), [])
+        self.assertEqual(len(self.prepared()), 2)
+
+    @skipIf(not POSTGRES, "prepared statements need Postgres")
+    def test_keeps_recent_statements(self):
+        options = self.connection._execution_options.union(
+            {'prepared_statements': 1})
+        with patch.object(self.connection, '_execution_options', options):
+            user_by_username('ann')
+            user_messages_before(self.user_id, NEWEST, 10)
+            user_by_username('ann')
+
+        self.assertEqual(len(self.prepared()), 1)
+        self.assertIn('users', self.prepared()[0])
+
+    def test_admin_pool(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+        self.assertEqual(self.client.get('/admin/pool').status_code, 302)
+
+        with patch.dict(app.config, ADMIN_USERNAMES=['ann']):
+            resp = self.client.get('/admin/pool')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsInstance(resp.get_json(), dict)
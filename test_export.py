@@ -0,0 +1,100 @@
+"""Account export tests."""
+
+# run these tests like:
+#
+# python -m unittest test_export.py
+
+import csv
+import io
+import json
+import zipfile
+
+from app import CURR_USER_KEY
+from models import db, User, Message, Likes, Follows
+from export import ndjson, zip_csv
+from testcase import DBTestCase
+
+
+def records(user, cursor=None):
+    body = b''.join(ndjson(user, cursor)).decode('utf-8')
+    return [json.loads(line) for line in body.splitlines()]
+
+
+class ExportTestCase(DBTestCase):
+    """Test streaming and resuming exports."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.signup("exporter", "exporter@test.com", "password",
+                                None)
+        self.user.id = 100
+        other = User.signup("other", "other@test.com", "password", None)
+        other.id = 200
+        db.session.commit()
+
+        for msg_id in (1, 2, 3):
+            db.session.add(Message(id=msg_id, text=f"mine {msg_id}",
+                                   user_id=100))
+        db.session.add(Message(id=4, text="theirs", user_id=200))
+        db.session.commit()
+
+        db.session.add(Likes(user_id=100, message_id=4))
+        db.session.add(Follows(user_following_id=100,
+                               user_being_followed_id=200))
+        db.session.add(Follows(user_following_id=200,
+                               user_being_followed_id=100))
+        db.session.commit()
+
+    def test_ndjson(self):
+        rows = records(self.user)
+
+        self.assertEqual([r['type'] for r in rows],
+                         ['profile', 'messages', 'messages', 'messages',
+                          'likes', 'following', 'followers'])
+        self.assertEqual(rows[0]['data']['username'], "exporter")
+        self.assertNotIn('password', rows[0]['data'])
+        self.assertEqual([r['data']['id'] for r in rows[1:4]], [3, 2, 1])
+        self.assertEqual(rows[4]['data']['text'], "theirs")
+        self.assertEqual(rows[5]['data']['username'], "other")
+
+    def test_resume(self):
+        rows = records(self.user)
+
+        for i, row in enumerate(rows):
+            self.assertEqual(records(self.user, row['cursor']), rows[i + 1:])
+
+    def test_zip(self):
+        data = b''.join(zip_csv(self.user))
+
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertEqual(zf.namelist(),
+                             ['profile.csv', 'messages.csv', 'likes.csv',
+                              'following.csv', 'followers.csv'])
+            with zf.open('messages.csv') as f:
+                rows = list(csv.reader(io.TextIOWrapper(f, 'utf-8')))
+
+        self.assertEqual(rows[0], ['cursor', 'id', 'timestamp', 'text'])
+        self.assertEqual([r[0] for r in rows[1:]],
+                         ['messages:3', 'messages:2', 'messages:1'])
+
+    def test_endpoint(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 100
+
+            resp = c.get("/users/export?cursor=likes:0")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, 'application/x-ndjson')
+            lines = resp.get_data(as_text=True).splitlines()
+            self.assertEqual([json.loads(l)['type'] for l in lines],
+                             ['likes', 'following', 'followers'])
+
+            self.assertEqual(c.get("/users/export?cursor=bogus").status_code,
+                             400)
+            self.assertEqual(c.get("/users/export?format=xml").status_code,
+                             400)
+
+    def test_endpoint_unauthorized(self):
+        resp = self.client.get("/users/export")
+        self.assertEqual(resp.status_code, 302)
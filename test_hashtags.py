@@ -0,0 +1,148 @@
+"""Hashtag and mention tests."""
+
+# run these tests like:
+#
+# python -m unittest test_hashtags.py
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import CURR_USER_KEY, create_app
+from hashtags import hashtags, mentions, link_tags, backfill
+from models import db, User, Message, MessageTag, MessageMention
+from queries import (tag_message_ids, mention_message_ids, post_message,
+                     delete_message, message_by_id)
+from testcase import DBTestCase
+
+
+def quiet(line):
+    pass
+
+
+class ParseTestCase(TestCase):
+    """Test finding tags and mentions in text."""
+
+    def test_hashtags(self):
+        self.assertEqual(hashtags("#Flask and #flask, #sql_alchemy!"),
+                         {'flask', 'sql_alchemy'})
+        self.assertEqual(hashtags("issue#4, ##, &#39; " + "#" + "x" * 51),
+                         set())
+
+    def test_mentions(self):
+        self.assertEqual(mentions("@ann and @bob: cc ann@example.com @ann"),
+                         {'ann', 'bob'})
+
+    def test_link_tags(self):
+        self.assertEqual(link_tags("<b>#Flask</b> & #x"),
+                         '&lt;b&gt;<a href="/tags/flask">#Flask</a>&lt;/b&gt; '
+                         '&amp; <a href="/tags/x">#x</a>')
+
+
+class HashtagsTestCase(DBTestCase):
+    """Test indexing at write time, tag timelines and mentions."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.ann = User.signup("ann", "ann@test.com", "password", None)
+        self.bob = User.signup("bob", "bob@test.com", "password", None)
+        db.session.commit()
+        self.ann_id = self.ann.id
+        self.bob_id = self.bob.id
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.bob_id
+
+    def test_indexed_when_posted(self):
+        self.client.post('/messages/new',
+                         data={'text': "#Python with @ann and @nobody"})
+        msg = Message.query.one()
+
+        self.assertEqual(tag_message_ids('python', None, 10), [msg.id])
+        self.assertEqual(mention_message_ids(self.ann_id, None, 10), [msg.id])
+        self.assertEqual(MessageMention.query.count(), 1)
+
+        delete_message(message_by_id(msg.id))
+        self.assertEqual(MessageTag.query.count(), 0)
+        self.assertEqual(MessageMention.query.count(), 0)
+
+    def test_tag_timeline(self):
+        ids = [post_message(self.ann_id, f"#warbler number {n}")
+               for n in range(5)]
+        post_message(self.ann_id, "#other")
+
+        with patch('views.TAG_PAGE_SIZE', 2):
+            html = self.client.get('/tags/Warbler').get_data(as_text=True)
+            self.assertIn("number 4", html)
+            self.assertIn("number 3", html)
+            self.assertNotIn("number 2", html)
+            self.assertIn(f'/tags/warbler?before={ids[3]}', html)
+
+            html = self.client.get(f'/tags/warbler?before={ids[1]}') \
+                .get_data(as_text=True)
+            self.assertIn("number 0", html)
+            self.assertNotIn("Older warbles", html)
+
+        # public, and links back to the tag
+        with self.client.session_transaction() as sess:
+            del sess[CURR_USER_KEY]
+        html = self.client.get('/tags/other').get_data(as_text=True)
+        self.assertIn('<a href="/tags/other">#other</a>', html)
+
+    def test_mentions_inbox(self):
+        post_message(self.ann_id, "hi @bob")
+        post_message(self.ann_id, "just ann")
+
+        html = self.client.get('/mentions').get_data(as_text=True)
+        self.assertIn("hi @bob", html)
+        self.assertNotIn("just ann", html)
+
+        with self.client.session_transaction() as sess:
+            del sess[CURR_USER_KEY]
+        self.assertEqual(self.client.get('/mentions').status_code, 302)
+
+    def test_backfill(self):
+        # posted before tags were indexed at write time
+        for n in range(5):
+            db.session.add(Message(text=f"#old {n} for @bob",
+                                   user_id=self.ann_id))
+        db.session.commit()
+
+        self.assertEqual(backfill(workers=1, chunk_size=2, log=quiet), 5)
+        self.assertEqual(len(tag_message_ids('old', None, 10)), 5)
+        # again: replaced, not duplicated
+        self.assertEqual(backfill(workers=1, chunk_size=3, log=quiet), 5)
+        self.assertEqual(MessageTag.query.count(), 5)
+        self.assertEqual(len(mention_message_ids(self.bob_id, None, 10)), 5)
+
+
+class ParallelBackfillTestCase(TestCase):
+    """Test the backfill with worker processes, on a database of its own
+    (the other tests' rows are never committed)."""
+
+    def test_parallel(self):
+        # create_app points db at its app
+        self.addCleanup(setattr, db, 'app', db.app)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            app = create_app('testing')
+            app.config['SQLALCHEMY_DATABASE_URI'] = (
+                'sqlite:///' + os.path.join(tmp, 'backfill.db'))
+            with app.app_context():
+                db.create_all()
+                db.session.add(User(id=1, username='ann', email='a@test.com',
+                                    password='x'))
+                db.session.add_all(Message(id=100 + n, user_id=1,
+                                           text=f"#tag{n % 3} @ann")
+                                   for n in range(20))
+                db.session.commit()
+
+                self.assertEqual(backfill(workers=3, chunk_size=4, log=quiet),
+                                 20)
+                self.assertEqual(MessageTag.query.count(), 20)
+                self.assertEqual(len(tag_message_ids('tag0', None, 20)), 7)
+                self.assertEqual(MessageMention.query.count(), 20)
+                db.session.remove()
+                db.get_engine().dispose()
@@ -0,0 +1,219 @@
+"""Image proxy tests."""
+
+# run these tests like:
+#
+# python -m unittest test_image_proxy.py
+
+import http.client
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.error import URLError
+
+from PIL import Image
+from werkzeug.exceptions import NotFound
+
+import image_proxy
+from image_proxy import ImageProxy, UnsafeAddress, open_public
+
+
+class ImageProxyTestCase(TestCase):
+    """Test resizing and caching of local images."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.static = os.path.join(self.tmp.name, 'static')
+        os.makedirs(os.path.join(self.static, 'images'))
+
+        Image.new('RGB', (800, 600), 'red').save(
+            os.path.join(self.static, 'images', 'avatar.png'))
+
+        self.proxy = ImageProxy(os.path.join(self.tmp.name, 'cache'))
+        self.proxy.static_folder = self.static
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def variant_of(self, size, webp=False):
+        url = self.proxy.thumb('/static/images/avatar.png', size)
+        _, _, got_size, digest = url.split('/')
+        return self.proxy.variant(got_size, digest, webp=webp)
+
+    def test_thumb_url(self):
+        url = self.proxy.thumb('/static/images/avatar.png', 'timeline')
+
+        self.assertRegex(url, r'^/img/timeline/[0-9a-f]{32}$')
+        self.assertIsNone(self.proxy.thumb(None, 'timeline'))
+
+    def test_square_variant(self):
+        path, mimetype = self.variant_of('timeline')
+
+        self.assertEqual(mimetype, 'image/jpeg')
+        self.assertEqual(Image.open(path).size, (96, 96))
+
+    def test_keeps_aspect_ratio(self):
+        path, mimetype = self.variant_of('card-hero', webp=True)
+
+        self.assertEqual(mimetype, 'image/webp')
+        self.assertEqual(Image.open(path).size, (700, 525))
+
+    def test_cached(self):
+        path, _ = self.variant_of('card')
+        os.remove(os.path.join(self.static, 'images', 'avatar.png'))
+
+        self.assertEqual(self.variant_of('card')[0], path)
+
+    def test_unknown(self):
+        self.proxy.thumb('/static/images/avatar.png', 'card')
+
+        with self.assertRaises(NotFound):
+            self.proxy.variant('huge', 'abc')
+        with self.assertRaises(NotFound):
+            self.proxy.variant('card', 'abc')
+
+    def test_no_escape_from_static(self):
+        url = self.proxy.thumb('/static/../../etc/passwd', 'card')
+
+        with self.assertRaises(NotFound):
+            self.proxy.variant('card', url.split('/')[-1])
+
+    def test_lru_eviction(self):
+        self.proxy.max_bytes = 1
+        first, _ = self.variant_of('card')
+        second, _ = self.variant_of('profile')
+
+        self.assertFalse(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+
+    def test_prunes_unused_sources(self):
+        url = self.proxy.thumb('/static/images/avatar.png', 'card')
+        digest = url.split('/')[-1]
+        source = self.proxy._path('sources', digest)
+        long_ago = time.time() - image_proxy.SOURCE_TTL - 60
+
+        # kept while it has variants
+        self.proxy.variant('card', digest)
+        os.utime(source, (long_ago, long_ago))
+        self.proxy._cached_bytes = None
+        self.proxy.variant('profile', digest)
+        self.assertTrue(os.path.exists(source))
+
+        # and while its URL may have been handed out lately
+        self.proxy.max_bytes = 1
+        os.utime(source)
+        self.proxy.variant('timeline', digest)
+        self.assertTrue(os.path.exists(source))
+
+        # then goes with its last variant
+        os.utime(source, (long_ago, long_ago))
+        self.proxy.variant('nav', digest)
+        self.assertFalse(os.path.exists(source))
+
+    def test_registration_renewed(self):
+        url = self.proxy.thumb('/static/images/avatar.png', 'card')
+        digest = url.split('/')[-1]
+        source = self.proxy._path('sources', digest)
+        os.remove(source)
+
+        self.proxy.thumb('/static/images/avatar.png', 'card')
+        self.assertFalse(os.path.exists(source))
+
+        self.proxy._registered[digest] -= image_proxy.REGISTRATION_TTL + 1
+        self.proxy.thumb('/static/images/avatar.png', 'card')
+        self.assertTrue(os.path.exists(source))
+
+    def test_broken_download(self):
+        url = self.proxy.thumb('http://example.com/avatar.png', 'card')
+
+        with patch.object(image_proxy, 'open_public',
+                          side_effect=http.client.IncompleteRead(b'')):
+            with self.assertRaises(NotFound):
+                self.proxy.variant('card', url.split('/')[-1])
+
+    def test_pixel_limit(self):
+        with patch.object(image_proxy, 'MAX_SOURCE_PIXELS', 1000):
+            with self.assertRaises(NotFound):
+                self.variant_of('card')
+
+    def test_sweeps_only_when_due(self):
+        scans = []
+        scandir = os.scandir
+
+        def counting_scandir(path):
+            if path.endswith('variants'):
+                scans.append(path)
+            return scandir(path)
+
+        with patch.object(image_proxy.os, 'scandir', counting_scandir):
+            self.variant_of('card')
+            self.variant_of('profile')
+            self.assertEqual(len(scans), 1)
+
+            # over max_bytes by the running total
+            self.proxy.max_bytes = 1
+            self.variant_of('timeline')
+            self.assertEqual(len(scans), 2)
+
+
+class ImageSourceTestCase(TestCase):
+    """Test which remote sources are fetched."""
+
+    def test_only_static_and_http(self):
+        proxy = ImageProxy(tempfile.gettempdir())
+        for url in ['file:///etc/passwd', 'gopher://localhost/',
+                    'javascript:alert(1)']:
+            self.assertEqual(proxy.thumb(url, 'card'), url)
+            with self.assertRaises(URLError):
+                open_public(url, timeout=1)
+
+    def test_refuses_private_addresses(self):
+        for url in ['http://127.0.0.1/', 'http://localhost:8000/',
+                    'http://10.1.2.3/', 'http://192.168.0.1/',
+                    'http://169.254.169.254/latest/meta-data/',
+                    'http://[::1]/', 'http://[::ffff:127.0.0.1]/',
+                    'https://0.0.0.0/', 'http://224.0.0.1/']:
+            with self.assertRaises(URLError) as cm:
+                open_public(url, timeout=1)
+            self.assertIsInstance(cm.exception.reason, UnsafeAddress, url)
+
+    def test_checks_every_redirect(self):
+        png = os.path.join(os.path.dirname(__file__), 'static', 'images',
+                           'default-pic.png')
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/redirect':
+                    self.send_response(302)
+                    self.send_header('Location', f"http://127.0.0.2:"
+                                     f"{self.server.server_port}/image")
+                    self.end_headers()
+                    return
+                with open(png, 'rb') as f:
+                    data = f.read()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_port}"
+
+        # pretend the server's own address is public, and no other
+        with patch.object(image_proxy, 'public_address',
+                          lambda ip: str(ip) == '127.0.0.1'):
+            with open_public(f"{base}/image", timeout=5) as resp:
+                self.assertEqual(resp.status, 200)
+
+            with self.assertRaises(URLError) as cm:
+                open_public(f"{base}/redirect", timeout=5)
+            self.assertIsInstance(cm.exception.reason, UnsafeAddress)
@@ -4,28 +4,17 @@
 #
 # python -m unittest test_message_model.py
 
-import os
-
-# Set database url to the warbler-test database.
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-from app import app
-from unittest import TestCase
 from sqlalchemy import exc
 from models import db, User, Message, Follows, Likes
+from testcase import DBTestCase
 
-# Create all tables for tests.
-
-db.create_all()
 
-
-class UserModelTestCase(TestCase):
+class UserModelTestCase(DBTestCase):
     """Test views for messages."""
 
     def setUp(self):
         """Create test client, add sample data."""
-        db.drop_all()
-        db.create_all()
+        super().setUp()
 
         
         user = User.signup("Test User", "test@test.com", "password", None)
@@ -34,13 +23,6 @@ class UserModelTestCase(TestCase):
         self.user_id = user.id
         self.user = User.query.get(self.user_id)
 
-        self.client = app.test_client()
-
-    def tearDown(self):
-        res = super().tearDown()
-        db.session.rollback()
-        return res
-
     def test_message_model(self):
         """Does basic model work?"""
 
@@ -4,34 +4,18 @@
 #
 # FLASK_ENV=production python -m unittest test_message_views.py
 
-import os
-
-# Set database url to the warbler-test database.
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-from app import app, CURR_USER_KEY
-from unittest import TestCase
+from app import CURR_USER_KEY
 from models import db, connect_db, Message, User
-
-# Create all tables for tests.
-
-db.create_all()
-
-# Prevent WTForms from using CSRF and debug from intercepting redirects.
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['WTF_CSRF_ENABLED'] = False
+from testcase import DBTestCase, app
 
 
-class MessageViewTestCase(TestCase):
+class MessageViewTestCase(DBTestCase):
     """Test views for messages."""
 
     def setUp(self):
         """Create test client, add sample data."""
 
-        db.drop_all()
-        db.create_all()
-
-        self.client = app.test_client()
+        super().setUp()
 
         self.testuser = User.signup(username="testuser",
                                     email="test@test.com",
@@ -173,3 +157,47 @@ class MessageViewTestCase(TestCase):
 
             q_msg = Message.query.get(999)
             self.assertIsNotNone(q_msg)
+
+    def test_add_bulk(self):
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = client.post("/messages/bulk",
+                               json={"messages": ["one", "two", "three"]})
+            self.assertEqual(resp.status_code, 201)
+
+            ids = [int(msg_id) for msg_id in resp.get_json()["ids"]]
+            self.assertEqual(ids, sorted(ids))
+            self.assertEqual([Message.query.get(i).text for i in ids],
+                             ["one", "two", "three"])
+
+    def test_add_bulk_invalid(self):
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            for body in ({}, {"messages": []}, {"messages": ["ok", ""]},
+                         {"messages": ["x" * 141]},
+                         {"messages": ["x"] * 101}):
+                resp = client.post("/messages/bulk", json=body)
+                self.assertEqual(resp.status_code, 400)
+                self.assertIn("error", resp.get_json())
+
+            # form posts are refused too
+            resp = client.post("/messages/bulk", data={"messages": "x"})
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(Message.query.count(), 0)
+
+    def test_add_bulk_no_session(self):
+        resp = self.client.post("/messages/bulk", json={"messages": ["x"]})
+        self.assertEqual(resp.status_code, 401)
+
+    def test_post_messages_command(self):
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["post-messages", "testuser"],
+                               input="first\n\nsecond\n")
+
+        self.assertEqual(result.output, "Posted 2 messages\n")
+        self.assertEqual(sorted(m.text for m in Message.query),
+                         ["first", "second"])
@@ -0,0 +1,125 @@
+"""Notification tests."""
+
+# run these tests like:
+#
+# python -m unittest test_notifications.py
+
+from unittest.mock import patch
+
+import views
+from app import CURR_USER_KEY
+from models import db, User, Message, Notification
+from notifications import notifier, FOLLOW, LIKE
+from testcase import DBTestCase
+
+
+class NotificationTestCase(DBTestCase):
+    """Test writing, coalescing and reading notifications."""
+
+    def setUp(self):
+        super().setUp()
+
+        users = [User.signup(f"user{i}", f"user{i}@test.com", "password",
+                             None) for i in range(6)]
+        db.session.commit()
+        self.ann, *self.others = [user.id for user in users]
+
+        msg = Message(text="a warble worth liking", user_id=self.ann)
+        db.session.add(msg)
+        db.session.commit()
+        self.msg_id = msg.id
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_follow_and_like(self):
+        self.login(self.others[0])
+        self.client.post(f"/users/follow/{self.ann}")
+        self.client.post(f"/users/add_like/{self.msg_id}")
+
+        events = Notification.query.order_by(Notification.id).all()
+        self.assertEqual(
+            [(e.recipient_id, e.kind, e.actor_id, e.message_id)
+             for e in events],
+            [(self.ann, FOLLOW, self.others[0], None),
+             (self.ann, LIKE, self.others[0], self.msg_id)])
+
+    def test_not_for_yourself(self):
+        self.login(self.ann)
+        self.client.post(f"/users/add_like/{self.msg_id}")
+
+        self.assertEqual(Notification.query.count(), 0)
+
+    def test_page_coalesces(self):
+        for user_id in self.others:
+            notifier.add(LIKE, self.ann, user_id, self.msg_id)
+        notifier.add(FOLLOW, self.ann, self.others[0])
+        notifier.add(FOLLOW, self.ann, self.others[1])
+
+        self.login(self.ann)
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertIn('badge-danger">7</span>', html)
+
+        html = self.client.get('/notifications').get_data(as_text=True)
+        self.assertEqual(html.count('<li class="list-group-item">'), 2)
+        self.assertIn('and 2 others', html)
+        self.assertIn('liked your', html)
+        self.assertIn('a warble worth liking', html)
+        self.assertIn('followed you', html)
+
+        # read now
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertNotIn('badge-danger', html)
+
+    def test_pages(self):
+        for user_id in self.others:
+            notifier.add(FOLLOW, self.ann, user_id)
+        self.login(self.ann)
+
+        with patch.object(views, 'NOTIFICATION_PAGE_SIZE', 4):
+            html = self.client.get('/notifications').get_data(as_text=True)
+            self.assertRegex(html, r'and 1 other\s')
+            newest = Notification.query.order_by(
+                Notification.id.desc()).all()
+            self.assertIn(f'?before={newest[3].id}', html)
+
+            html = self.client.get(
+                f'/notifications?before={newest[3].id}').get_data(
+                    as_text=True)
+        self.assertNotRegex(html, r'and \d+ other')
+        self.assertNotIn('?before=', html)
+
+    def test_unread_cached(self):
+        ann = User.query.get(self.ann)
+        self.assertEqual(notifier.unread(ann), 0)
+
+        # written by another worker: this one's cached count stands
+        db.session.add(Notification(recipient_id=self.ann, kind=FOLLOW,
+                                    actor_id=self.others[0]))
+        db.session.commit()
+        self.assertEqual(notifier.unread(ann), 0)
+
+        # written here: the count is dropped
+        notifier.add(FOLLOW, self.ann, self.others[1])
+        self.assertEqual(notifier.unread(ann), 2)
+
+    def test_batches(self):
+        with patch.object(notifier, 'interval', 60), \
+                patch.object(notifier, 'batch', 3), \
+                patch.object(notifier, '_start') as start:
+            notifier.add(FOLLOW, self.ann, self.others[0])
+            notifier.add(LIKE, self.ann, self.others[0], self.msg_id)
+            self.assertEqual(Notification.query.count(), 0)
+            self.assertFalse(notifier._wake.is_set())
+
+            # a full batch wakes the writer up
+            notifier.add(FOLLOW, self.ann, self.others[1])
+            self.assertTrue(notifier._wake.is_set())
+            notifier._wake.clear()
+            start.assert_called()
+
+            notifier.flush()
+
+        self.assertEqual(Notification.query.count(), 3)
+        self.assertEqual(notifier._events, [])
@@ -0,0 +1,133 @@
+"""Request profiler tests."""
+
+# run these tests like:
+#
+# python -m unittest test_profiler.py
+
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import CURR_USER_KEY
+from models import db, User
+from profiler import (StackSampler, CAPTURE_HEADER, flamegraph,
+                      request_profiler)
+from testcase import DBTestCase, app
+
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class StackSamplerTestCase(TestCase):
+    """Test sampling another thread's stack."""
+
+    def test_samples(self):
+        sampler = StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        spin(0.05)
+        stacks = sampler.stop()
+
+        # a CPU-bound thread gives up the GIL every 5ms
+        total = sum(stacks.values())
+        spinning = sum(count for stack, count in stacks.items()
+                       if stack.endswith('test_profiler.py:spin'))
+        self.assertGreater(total, 4)
+        self.assertGreater(spinning, total / 2)
+
+    def test_flamegraph(self):
+        svg = flamegraph({'a;b': 3, 'a;c<d>': 1}, title='GET /')
+
+        self.assertIn('<svg', svg)
+        self.assertIn('a (4 samples, 100.0%)', svg)
+        self.assertIn('c&lt;d&gt; (1 samples, 25.0%)', svg)
+
+
+class RequestProfilerTestCase(DBTestCase):
+    """Test choosing, capturing and listing profiled requests."""
+
+    def setUp(self):
+        super().setUp()
+
+        admin = User.signup("admin", "admin@test.com", "password", None)
+        user = User.signup("user", "user@test.com", "password", None)
+        db.session.commit()
+        self.admin_id = admin.id
+        self.user_id = user.id
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patches = [
+            patch.object(request_profiler, 'directory', self.tmp.name),
+            patch.object(request_profiler, 'keep', 2),
+            patch.dict(app.config, ADMIN_USERNAMES=['admin']),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_admin_flag(self):
+        self.login(self.admin_id)
+        resp = self.client.get('/', headers={'X-Warbler-Profile': '1'})
+
+        name = resp.headers[CAPTURE_HEADER]
+        [capture] = request_profiler.captures('warbler.homepage')
+        self.assertEqual(capture['name'], name)
+        self.assertEqual(capture['path'], '/')
+        self.assertEqual(capture['status'], 200)
+        self.assertTrue(capture['allocations'])
+        for ext in ('.folded', '.svg', '.json'):
+            self.assertTrue(os.path.isfile(os.path.join(
+                self.tmp.name, 'warbler.homepage', name + ext)))
+
+        self.assertNotIn(CAPTURE_HEADER, self.client.get('/').headers)
+
+    def test_not_for_other_users(self):
+        self.login(self.user_id)
+        resp = self.client.get('/?profile=1')
+
+        self.assertNotIn(CAPTURE_HEADER, resp.headers)
+        self.assertEqual(request_profiler.endpoints(), [])
+
+    def test_sampled(self):
+        with patch.object(request_profiler, 'sample_rate', 1):
+            for _ in range(3):
+                self.client.get('/login')
+                time.sleep(0.002)
+
+        # only the newest `keep`
+        self.assertEqual(len(request_profiler.captures('warbler.login')), 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp.name,
+                                                     'warbler.login'))), 6)
+
+    def test_admin_page(self):
+        self.login(self.admin_id)
+        name = self.client.get('/?profile=1').headers[CAPTURE_HEADER]
+
+        html = self.client.get('/admin/profiles').get_data(as_text=True)
+        self.assertIn('warbler.homepage', html)
+        self.assertIn(f'/admin/profiles/warbler.homepage/{name}.svg', html)
+
+        resp = self.client.get(f'/admin/profiles/warbler.homepage/{name}.svg')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'image/svg+xml')
+        resp.close()
+        self.assertEqual(self.client.get(
+            '/admin/profiles/warbler.homepage/..%2F..%2Fetc').status_code, 404)
+
+        self.login(self.user_id)
+        resp = self.client.get('/admin/profiles')
+        self.assertEqual(resp.status_code, 302)
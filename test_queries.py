@@ -0,0 +1,67 @@
+"""Baked query tests."""
+
+# run these tests like:
+#
+# python -m unittest test_queries.py
+
+from models import db, User, Message, Likes, Follows
+from queries import (user_by_id, user_by_username, followed_ids,
+                     liked_message_ids, like, messages_by_ids,
+                     user_messages_before, feed_ids, recent_ids_per_author)
+from testcase import DBTestCase
+
+
+class QueriesTestCase(DBTestCase):
+    """Test the baked hot-path queries, run twice to hit the cache."""
+
+    def setUp(self):
+        super().setUp()
+
+        for user_id in (1, 2, 3):
+            user = User.signup(f"user{user_id}", f"{user_id}@test.com",
+                               "password", None)
+            user.id = user_id
+        db.session.commit()
+
+        for msg_id in range(10, 16):
+            db.session.add(Message(id=msg_id, text=f"warble {msg_id}",
+                                   user_id=1 if msg_id % 2 else 2))
+        db.session.flush()
+
+        db.session.add(Follows(user_following_id=3, user_being_followed_id=1))
+        db.session.add(Follows(user_following_id=3, user_being_followed_id=2))
+        db.session.add(Likes(user_id=3, message_id=11))
+        db.session.commit()
+
+    def test_users(self):
+        for _ in range(2):
+            self.assertEqual(user_by_id(2).username, "user2")
+            self.assertIsNone(user_by_id(99))
+            self.assertEqual(user_by_username("user3").id, 3)
+            self.assertIsNone(user_by_username("nobody"))
+
+    def test_projections(self):
+        for _ in range(2):
+            self.assertEqual(sorted(followed_ids(3)), [1, 2])
+            self.assertEqual(followed_ids(1), [])
+            self.assertEqual(liked_message_ids(3), {11})
+            self.assertEqual(like(3, 11).message_id, 11)
+            self.assertIsNone(like(3, 12))
+
+    def test_messages(self):
+        for _ in range(2):
+            messages = messages_by_ids([13, 10, 99])
+            self.assertEqual([m.id for m in messages], [13, 10])
+            self.assertEqual(messages[0].user.username, "user1")
+
+            self.assertEqual(
+                [m.id for m in user_messages_before(1, 15, 2)], [13, 11])
+            self.assertEqual(
+                [m.id for m in user_messages_before(1, 15, 5)], [13, 11])
+
+    def test_feeds(self):
+        for _ in range(2):
+            self.assertEqual(feed_ids([1, 2], 3), [15, 14, 13])
+            self.assertEqual(feed_ids([2], 10), [14, 12, 10])
+            self.assertEqual(recent_ids_per_author([1, 2, 3], 2),
+                             {1: [15, 13], 2: [14, 12]})
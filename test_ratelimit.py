@@ -0,0 +1,207 @@
+"""Rate limiting tests."""
+
+# run these tests like:
+#
+# python -m unittest test_ratelimit.py
+
+import os
+import sqlite3
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import create_app
+from config import TestingConfig
+from models import db
+from ratelimit import (MemoryStorage, SQLiteStorage, RateLimiter, parse_limit,
+                       rate_limiter)
+from testcase import DBTestCase
+
+
+class StorageTests:
+    """Token bucket behaviour shared by every storage."""
+
+    def test_burst_then_refill(self):
+        # 3 tokens, one more every 2 seconds
+        for _ in range(3):
+            self.assertEqual(self.storage.consume('k', 3, 0.5, 100.0), 0)
+
+        self.assertAlmostEqual(self.storage.consume('k', 3, 0.5, 100.0), 2)
+        self.assertAlmostEqual(self.storage.consume('k', 3, 0.5, 101.0), 1)
+        self.assertEqual(self.storage.consume('k', 3, 0.5, 102.0), 0)
+
+    def test_keys_are_independent(self):
+        self.assertEqual(self.storage.consume('a', 1, 1, 100.0), 0)
+        self.assertEqual(self.storage.consume('b', 1, 1, 100.0), 0)
+        self.assertGreater(self.storage.consume('a', 1, 1, 100.0), 0)
+
+    def test_all_or_nothing(self):
+        self.assertEqual(self.storage.consume('empty', 1, 1, 100.0), 0)
+
+        buckets = [('full', 2, 1), ('empty', 1, 1)]
+        self.assertAlmostEqual(self.storage.consume_all(buckets, 100.0), 1)
+        # nothing was taken from the full bucket
+        self.assertEqual(self.storage.consume_all(
+            [('full', 2, 1)] * 2, 100.0), 0)
+        self.assertEqual(self.storage.consume_all(buckets, 101.0), 0)
+
+    def test_refill_is_capped(self):
+        self.storage.consume('k', 2, 1, 100.0)
+
+        for _ in range(2):
+            self.assertEqual(self.storage.consume('k', 2, 1, 1000.0), 0)
+        self.assertGreater(self.storage.consume('k', 2, 1, 1000.0), 0)
+
+
+class MemoryStorageTestCase(StorageTests, TestCase):
+    """Test the in-process storage."""
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+
+
+class SQLiteStorageTestCase(StorageTests, TestCase):
+    """Test the SQLite storage, shared between processes."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = SQLiteStorage(os.path.join(self.tmp.name, 'rl.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_shared_between_connections(self):
+        other = SQLiteStorage(self.storage.path)
+
+        self.assertEqual(self.storage.consume('k', 1, 1, 100.0), 0)
+        self.assertGreater(other.consume('k', 1, 1, 100.0), 0)
+
+    def test_rolled_back_on_error(self):
+        conn = self.storage._connection()
+
+        class FailingPrune:
+            def __getattr__(self, name):
+                return getattr(conn, name)
+
+            def execute(self, sql, *args):
+                if sql.startswith("DELETE"):
+                    raise sqlite3.OperationalError("disk I/O error")
+                return conn.execute(sql, *args)
+
+        self.storage._local.conn = FailingPrune()
+        with patch.object(self.storage, 'PRUNE_EVERY', 1), \
+                self.assertRaises(sqlite3.OperationalError):
+            self.storage.consume('k', 1, 1, 100.0)
+        self.storage._local.conn = conn
+
+        # the token taken before the failure was put back
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(self.storage.consume('k', 1, 1, 100.0), 0)
+
+
+class RateLimiterTestCase(TestCase):
+    """Test choosing buckets for a request."""
+
+    def setUp(self):
+        self.limiter = RateLimiter()
+        self.limiter.limits = {
+            'warbler.messages_add': [('user',) + parse_limit('1/minute'),
+                                     ('ip',) + parse_limit('2/minute')],
+        }
+
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit("10/minute"), (10, 10 / 60))
+        self.assertEqual(parse_limit("2 / hour"), (2, 2 / 3600))
+
+    def test_scopes(self):
+        hit = self.limiter.hit
+        self.assertEqual(hit('warbler.messages_add', 'POST', '1.1.1.1', 1), 0)
+        self.assertAlmostEqual(
+            hit('warbler.messages_add', 'POST', '1.1.1.1', 1), 60, places=0)
+
+        # another user, same address: its own user bucket, shared ip bucket
+        self.assertEqual(hit('warbler.messages_add', 'POST', '1.1.1.1', 2), 0)
+        self.assertGreater(
+            hit('warbler.messages_add', 'POST', '1.1.1.1', 3), 0)
+        # refused, so it didn't use up user 3's bucket
+        self.assertEqual(hit('warbler.messages_add', 'POST', '2.2.2.2', 3), 0)
+
+    def test_unlimited(self):
+        for _ in range(5):
+            self.assertEqual(self.limiter.hit('warbler.messages_add', 'GET',
+                                              '1.1.1.1', 1), 0)
+            self.assertEqual(self.limiter.hit('warbler.homepage', 'POST',
+                                              '1.1.1.1', 1), 0)
+
+
+class RateLimitViewTestCase(DBTestCase):
+    """Test refusing requests with 429."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.saved = (rate_limiter.enabled, rate_limiter.limits,
+                      rate_limiter.all_methods)
+        rate_limiter.enabled = True
+        rate_limiter.limits = {'warbler.login': [('ip',) +
+                                                 parse_limit('2/minute')]}
+        rate_limiter.storage.clear()
+
+    def tearDown(self):
+        (rate_limiter.enabled, rate_limiter.limits,
+         rate_limiter.all_methods) = self.saved
+        super().tearDown()
+
+    def test_login_limited(self):
+        data = {'username': 'nobody', 'password': 'wrong-password'}
+
+        for _ in range(2):
+            self.assertEqual(self.client.post('/login', data=data).status_code,
+                             200)
+
+        resp = self.client.post('/login', data=data)
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers['Retry-After'], '30')
+
+        # forms still render
+        self.assertEqual(self.client.get('/login').status_code, 200)
+
+    def exhaust_login(self, ip):
+        rate_limiter.limits = {'warbler.login': [('ip',) +
+                                                 parse_limit('1/minute')]}
+        rate_limiter.storage.consume('warbler.login:ip:' + ip, 1, 1 / 60,
+                                     time.time())
+
+    def test_forwarded_for_ignored(self):
+        self.exhaust_login('1.1.1.1')
+        resp = self.client.post('/login', data={},
+                                headers={'X-Forwarded-For': '1.1.1.1'})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_trusted_proxy(self):
+        class Proxied(TestingConfig):
+            PROXY_HOPS = 1
+
+        # create_app points db at its app
+        self.addCleanup(setattr, db, 'app', db.app)
+        client = create_app(Proxied).test_client()
+        rate_limiter.enabled = True
+        self.exhaust_login('1.1.1.1')
+
+        resp = client.post('/login', data={},
+                           headers={'X-Forwarded-For': '1.1.1.1'})
+        self.assertEqual(resp.status_code, 429)
+        # only the nearest hop is trusted
+        resp = client.post('/login', data={},
+                           headers={'X-Forwarded-For': '1.1.1.1, 2.2.2.2'})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_username_available_limited(self):
+        rate_limiter.limits = {'warbler.username_available': [
+            ('ip',) + parse_limit('2/minute')]}
+        url = '/api/username-available?username=someone'
+
+        for _ in range(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 429)
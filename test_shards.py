@@ -0,0 +1,205 @@
+"""Message sharding tests, with SQLite files as shards."""
+
+# run these tests like:
+#
+# python -m unittest test_shards.py
+
+import os
+import tempfile
+from collections import Counter
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import CURR_USER_KEY
+from models import db, User, Message, Likes, Follows, ShardPin, MessageTag
+from queries import (feed_ids, feed_after, recent_ids_per_author,
+                     messages_by_ids, liked_message_ids, tag_message_ids,
+                     index_messages)
+from shards import (HashRing, shard_router, create_shard_tables, pin_users,
+                    move_pinned)
+from testcase import DBTestCase, app
+
+
+class HashRingTestCase(TestCase):
+    """Test placing user ids on shards."""
+
+    def test_balanced(self):
+        ring = HashRing(['a', 'b', 'c'])
+        counts = Counter(ring[user_id] for user_id in range(30000))
+
+        for name in 'abc':
+            self.assertGreater(counts[name], 7000)
+
+    def test_adding_a_shard_moves_a_share(self):
+        before = HashRing(['a', 'b'])
+        after = HashRing(['a', 'b', 'c'])
+        moved = [user_id for user_id in range(30000)
+                 if before[user_id] != after[user_id]]
+
+        # only to the new shard, and about a third of the users
+        self.assertEqual({after[user_id] for user_id in moved}, {'c'})
+        self.assertLess(abs(len(moved) - 10000), 2000)
+
+
+class ShardedTestCase(DBTestCase):
+    """Test routing, scatter-gather and resharding over three shards."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved_binds = app.config.get('SQLALCHEMY_BINDS')
+        app.config['SQLALCHEMY_BINDS'] = {
+            name: 'sqlite:///' + os.path.join(self.tmp.name, f"{name}.db")
+            for name in 'abc'}
+        for name in 'abc':
+            create_shard_tables(name)
+        shard_router.configure(['a', 'b'])
+
+        self.ring = HashRing(['a', 'b'])
+        # two users on each shard
+        ids = {}
+        user_id = 1
+        while min(len(ids.get(s, ())) for s in 'ab') < 2:
+            ids.setdefault(self.ring[user_id], []).append(user_id)
+            user_id += 1
+        self.on_a = ids['a'][:2]
+        self.on_b = ids['b'][:2]
+        self.user_ids = self.on_a + self.on_b
+
+        for user_id in self.user_ids:
+            user = User.signup(f"user{user_id}", f"{user_id}@test.com",
+                               "password", None)
+            user.id = user_id
+        db.session.commit()
+
+        reader = self.user_ids[0]
+        for user_id in self.user_ids[1:]:
+            db.session.add(Follows(user_following_id=reader,
+                                   user_being_followed_id=user_id))
+        db.session.commit()
+
+        # message ids 100, 101, ...: each user posts three, interleaved
+        self.messages = {}
+        for n in range(12):
+            author = self.user_ids[n % 4]
+            session = shard_router.session_for(author)
+            session.add(Message(id=100 + n, text=f"warble {n}",
+                                user_id=author))
+            session.commit()
+            self.messages.setdefault(author, []).append(100 + n)
+
+    def tearDown(self):
+        shard_router.remove()
+        shard_router.configure([])
+        app.config['SQLALCHEMY_BINDS'] = self.saved_binds
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def on_shard(self, name, model):
+        return {row.id for row in shard_router.session(name).query(model)}
+
+    def on_shard_tags(self, name):
+        return {(row.message_id, row.tag)
+                for row in shard_router.session(name).query(MessageTag)}
+
+    def test_placement(self):
+        self.assertEqual(self.on_shard('a', Message),
+                         {i for u in self.on_a for i in self.messages[u]})
+        self.assertEqual(self.on_shard('b', Message),
+                         {i for u in self.on_b for i in self.messages[u]})
+        # nothing in the main database
+        self.assertEqual(Message.query.count(), 0)
+
+    def test_scatter_gather(self):
+        self.assertEqual(feed_ids(self.user_ids, 5),
+                         [111, 110, 109, 108, 107])
+        self.assertEqual(feed_after(self.user_ids, 109, 10),
+                         [(111, self.user_ids[3]), (110, self.user_ids[2])])
+        self.assertEqual(recent_ids_per_author(self.user_ids, 2),
+                         {u: self.messages[u][::-1][:2]
+                          for u in self.user_ids})
+        self.assertEqual([m.id for m in messages_by_ids([111, 100, 105])],
+                         [111, 100, 105])
+
+    def test_views(self):
+        reader = self.user_ids[0]
+        liked = self.messages[self.on_b[0]][0]
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = reader
+
+        self.client.post('/messages/new', data={'text': '#sharded warble'})
+        self.client.post(f'/users/add_like/{liked}')
+
+        shard = self.ring[reader]
+        posted = (shard_router.session(shard).query(Message)
+                  .filter_by(text='#sharded warble').one())
+        self.assertEqual(posted.user_id, reader)
+        self.assertEqual(self.on_shard_tags(shard), {(posted.id, 'sharded')})
+        self.assertEqual(tag_message_ids('sharded', None, 10), [posted.id])
+        self.assertEqual(liked_message_ids(reader), {liked})
+        self.assertEqual(User.query.get(reader).counts(),
+                         {'messages': 4, 'following': 3, 'followers': 0,
+                          'likes': 1})
+
+        html = self.client.get('/').get_data(as_text=True)
+        for text in ('#sharded</a> warble', 'warble 11', 'warble 0'):
+            self.assertIn(text, html)
+
+        resp = self.client.get(f'/messages/{liked}')
+        self.assertIn(f'@user{self.on_b[0]}', resp.get_data(as_text=True))
+
+        self.client.post(f'/messages/{self.messages[reader][0]}/delete')
+        self.assertNotIn(self.messages[reader][0],
+                         self.on_shard(shard, Message))
+
+    def test_reshard(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_ids[0]
+        self.client.post(f'/users/add_like/{self.messages[self.on_b[1]][0]}')
+
+        new_ring = HashRing(['a', 'b', 'c'])
+        moving = [u for u in self.user_ids if new_ring[u] == 'c']
+        self.assertTrue(moving)
+        tagged = self.messages[moving[0]][0]
+        session = shard_router.session_for(moving[0])
+        index_messages(session, [{'id': tagged, 'text': '#moved'}])
+        session.commit()
+        pin_users(['a', 'b', 'c'])
+        self.assertEqual(sorted(p.user_id for p in ShardPin.query), moving)
+
+        # deployed with the new ring: pinned users still read their rows
+        shard_router.configure(['a', 'b', 'c'])
+        self.assertEqual(feed_ids(self.user_ids, 100),
+                         list(range(111, 99, -1)))
+
+        move_pinned(grace=0, log=lambda line: None)
+
+        self.assertEqual(ShardPin.query.count(), 0)
+        self.assertEqual(self.on_shard('c', Message),
+                         {i for u in moving for i in self.messages[u]})
+        for name in 'ab':
+            for user_id in moving:
+                self.assertEqual(shard_router.session(name).query(Message)
+                                 .filter_by(user_id=user_id).count(), 0)
+        self.assertEqual(feed_ids(self.user_ids, 100),
+                         list(range(111, 99, -1)))
+        self.assertEqual(len(liked_message_ids(self.user_ids[0])), 1)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(self.on_shard_tags('c'), {(tagged, 'moved')})
+        self.assertEqual(tag_message_ids('moved', None, 10), [tagged])
+
+    def test_reshard_waits_once_per_batch(self):
+        moving = [u for u in self.user_ids
+                  if HashRing(['a', 'b', 'c'])[u] == 'c']
+        pin_users(['a', 'b', 'c'])
+        shard_router.configure(['a', 'b', 'c'])
+
+        with patch('shards.time.sleep') as sleep:
+            move_pinned(grace=7, log=lambda line: None, batch_size=2)
+        self.assertEqual(sleep.call_count, -(-len(moving) // 2))
+        sleep.assert_called_with(7)
+
+        self.assertEqual(ShardPin.query.count(), 0)
+        self.assertEqual(self.on_shard('c', Message),
+                         {i for u in moving for i in self.messages[u]})
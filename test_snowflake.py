@@ -0,0 +1,127 @@
+"""Snowflake id tests."""
+
+# run these tests like:
+#
+# python -m unittest test_snowflake.py
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+import snowflake
+from snowflake import (SnowflakeGenerator, backfill_ids, timestamp_of,
+                       to_millis, lease_worker_id, default_worker_id,
+                       BACKFILL_WORKER_ID, SEQUENCE_BITS, MAX_WORKER_ID)
+
+IDS_PER_WORKER = 20000
+
+
+def generate_ids(worker_id):
+    """Generate a batch of ids as worker `worker_id`."""
+
+    next_id = SnowflakeGenerator(worker_id)
+    return [next_id() for _ in range(IDS_PER_WORKER)]
+
+
+class SnowflakeTestCase(TestCase):
+    """Test uniqueness and ordering of generated ids."""
+
+    def test_monotonic(self):
+        ids = generate_ids(1)
+
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_embeds_time_and_worker(self):
+        before = datetime.utcnow()
+        snowflake = SnowflakeGenerator(7)()
+        after = datetime.utcnow()
+
+        self.assertEqual((snowflake >> SEQUENCE_BITS) & MAX_WORKER_ID, 7)
+        self.assertLessEqual(to_millis(before),
+                             to_millis(timestamp_of(snowflake)))
+        self.assertLessEqual(to_millis(timestamp_of(snowflake)),
+                             to_millis(after))
+
+    def test_unique_across_threads(self):
+        next_id = SnowflakeGenerator(1)
+
+        def batch(_):
+            ids = [next_id() for _ in range(IDS_PER_WORKER)]
+            # each thread sees its own ids strictly increasing
+            self.assertEqual(ids, sorted(set(ids)))
+            return ids
+
+        with ThreadPoolExecutor(8) as pool:
+            ids = [i for batch_ids in pool.map(batch, range(8))
+                   for i in batch_ids]
+
+        self.assertEqual(len(set(ids)), 8 * IDS_PER_WORKER)
+
+    def test_unique_across_worker_processes(self):
+        with ProcessPoolExecutor(4) as pool:
+            batches = list(pool.map(generate_ids, range(4)))
+
+        ids = [i for batch in batches for i in batch]
+        self.assertEqual(len(set(ids)), 4 * IDS_PER_WORKER)
+        for batch in batches:
+            self.assertEqual(batch, sorted(batch))
+
+    def test_backfill_ids(self):
+        same_time = datetime(2017, 1, 21, 11, 4, 53)
+        timestamps = [datetime(2018, 5, 1)] + [same_time] * 5000
+
+        ids = backfill_ids(timestamps)
+
+        self.assertEqual(len(set(ids)), len(ids))
+        # overflowing a millisecond spills into the next one
+        self.assertLess(max(ids[1:]), ids[0])
+        self.assertEqual(sorted(ids[1:]), ids[1:])
+        self.assertEqual((ids[0] >> SEQUENCE_BITS) & MAX_WORKER_ID,
+                         BACKFILL_WORKER_ID)
+        self.assertEqual(timestamp_of(ids[0]), datetime(2018, 5, 1))
+
+    def test_lease_worker_id(self):
+        # leases this process already holds (its own worker id) stay
+        held = len(snowflake._leases)
+        with tempfile.TemporaryDirectory() as tmp:
+            first = lease_worker_id(10, 2, tmp)
+            second = lease_worker_id(10, 2, tmp)
+            self.assertEqual((first, second), (10, 11))
+            with self.assertRaises(RuntimeError):
+                lease_worker_id(10, 2, tmp)
+
+            # the lease ends with its holder
+            snowflake._leases.pop(held).close()
+            self.assertEqual(lease_worker_id(10, 2, tmp), 10)
+            while len(snowflake._leases) > held:
+                snowflake._leases.pop().close()
+
+    def test_default_worker_id(self):
+        with patch.dict(os.environ, {'WARBLER_WORKER_ID': '3'}):
+            self.assertEqual(SnowflakeGenerator().worker_id, None)
+            self.assertEqual(default_worker_id(), 3)
+        with patch.dict(os.environ, {'WARBLER_WORKER_ID': '1023'}):
+            with self.assertRaises(ValueError):
+                default_worker_id()
+
+    def test_fallback_worker_id(self):
+        environ = {key: value for key, value in os.environ.items()
+                   if key not in ('WARBLER_WORKER_ID', 'FLASK_ENV')}
+
+        # unset in production: the first id fails, loudly
+        with patch.dict(os.environ, environ, clear=True):
+            next_id = SnowflakeGenerator()
+            with self.assertRaises(RuntimeError):
+                next_id()
+
+        # in development, leased on this host
+        environ['FLASK_ENV'] = 'development'
+        with patch.dict(os.environ, environ, clear=True), \
+                patch('snowflake.lease_worker_id', return_value=5) as lease:
+            snowflake = SnowflakeGenerator()()
+        lease.assert_called_once_with(0, BACKFILL_WORKER_ID)
+        self.assertEqual((snowflake >> SEQUENCE_BITS) & MAX_WORKER_ID, 5)
@@ -0,0 +1,128 @@
+"""Taken username and email filter tests."""
+
+# run these tests like:
+#
+# python -m unittest test_taken_names.py
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User
+from taken_names import BloomFilter, TakenNames, taken_names
+from testcase import DBTestCase
+
+
+class BloomFilterTestCase(TestCase):
+    """Test the filter's sizing and error rate."""
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f"user{i}")
+
+        self.assertTrue(all(f"user{i}" in bloom for i in range(1000)))
+        self.assertEqual(bloom.hashes, 7)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(10000, 0.01)
+        for i in range(10000):
+            bloom.add(f"user{i}")
+
+        false_positives = sum(f"other{i}" in bloom for i in range(20000))
+        self.assertLess(false_positives / 20000, 0.02)
+
+
+class TakenNamesTestCase(DBTestCase):
+    """Test availability checks against the users table."""
+
+    def setUp(self):
+        super().setUp()
+
+        User.signup("taken", "taken@test.com", "password", None)
+        db.session.commit()
+
+    def test_checks(self):
+        self.assertTrue(taken_names.username_taken("taken"))
+        self.assertTrue(taken_names.email_taken("taken@test.com"))
+        self.assertFalse(taken_names.username_taken("free"))
+        self.assertFalse(taken_names.email_taken("free@test.com"))
+
+    def test_free_names_skip_the_database(self):
+        taken_names.filters()
+        with patch('taken_names.username_exists') as exists:
+            self.assertFalse(taken_names.username_taken("free"))
+        exists.assert_not_called()
+
+    def test_refresh_sees_other_workers_signups(self):
+        names = TakenNames(capacity=100, refresh=0)
+        self.assertFalse(names.username_taken("later"))
+
+        User.signup("later", "later@test.com", "password", None)
+        db.session.commit()
+
+        self.assertTrue(names.username_taken("later"))
+        self.assertTrue(names.email_taken("later@test.com"))
+
+    def test_background_build(self):
+        names = TakenNames(capacity=100, background=True)
+
+        # no filters yet: asks the database, and starts building them
+        with patch.object(names, '_start') as start:
+            self.assertTrue(names.username_taken("taken"))
+            self.assertFalse(names.email_taken("free@test.com"))
+        start.assert_called()
+
+        names._update(0)
+        built = names._filters
+        with patch.object(names, '_start'), \
+                patch('taken_names.username_exists') as exists:
+            self.assertFalse(names.username_taken("free"))
+        exists.assert_not_called()
+
+        # due a rebuild: requests keep the old filters, and don't build
+        with patch.object(names, '_start'), \
+                patch.object(names, '_build') as build:
+            self.assertTrue(names.username_taken("taken"))
+        build.assert_not_called()
+
+        names._update(names.rebuild_every + 1)
+        self.assertIsNot(names._filters, built)
+        self.assertIn("taken", names._filters['usernames'])
+
+    def test_signup_rejects_before_hashing(self):
+        with patch('views.User.signup') as signup:
+            resp = self.client.post('/signup', data={
+                'username': 'taken', 'email': 'new@test.com',
+                'password': 'password'}, follow_redirects=True)
+        signup.assert_not_called()
+        self.assertIn("Username already taken", resp.get_data(as_text=True))
+
+        with patch('views.User.signup') as signup:
+            resp = self.client.post('/signup', data={
+                'username': 'new', 'email': 'taken@test.com',
+                'password': 'password'}, follow_redirects=True)
+        signup.assert_not_called()
+        self.assertIn("Email already taken", resp.get_data(as_text=True))
+
+    def test_signup_adds_to_the_filters(self):
+        names = TakenNames(capacity=100, refresh=3600)
+        with patch('views.taken_names', names):
+            self.client.post('/signup', data={
+                'username': 'newbie', 'email': 'newbie@test.com',
+                'password': 'password'})
+
+        usernames, emails = names.filters()
+        self.assertIn('newbie', usernames)
+        self.assertIn('newbie@test.com', emails)
+
+    def test_username_available(self):
+        resp = self.client.get('/api/username-available?username=taken')
+        self.assertEqual(resp.get_json(),
+                         {'username': 'taken', 'available': False})
+
+        resp = self.client.get('/api/username-available?username=free')
+        self.assertEqual(resp.get_json(),
+                         {'username': 'free', 'available': True})
+
+        resp = self.client.get('/api/username-available')
+        self.assertEqual(resp.status_code, 400)
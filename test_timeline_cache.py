@@ -0,0 +1,89 @@
+"""Timeline cache tests."""
+
+# run these tests like:
+#
+# python -m unittest test_timeline_cache.py
+
+from datetime import datetime, timedelta
+
+from models import db, User, Message
+from timeline_cache import TimelineCache
+from testcase import DBTestCase
+
+
+class TimelineCacheTestCase(DBTestCase):
+    """Test per-author ring buffers and the merged feed."""
+
+    def setUp(self):
+        super().setUp()
+
+        user1 = User.signup("test1", "email1@email.com", "password", None)
+        user1.id = 10
+        user2 = User.signup("test2", "email2@email.com", "password", None)
+        user2.id = 20
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        for i in range(6):
+            db.session.add(Message(id=100 + i,
+                                   text=f"warble {i}",
+                                   user_id=10 if i % 2 else 20,
+                                   timestamp=start + timedelta(minutes=i)))
+        db.session.commit()
+
+        self.cache = TimelineCache(size=3)
+
+    def test_recent(self):
+        self.assertEqual(self.cache.recent(10, 3), [105, 103, 101])
+        self.assertEqual(self.cache.recent(20, 2), [104, 102])
+
+    def test_feed_merges_authors(self):
+        self.assertEqual(self.cache.feed([10, 20], 3), [105, 104, 103])
+
+    def test_deep_page_falls_back_to_sql(self):
+        self.assertEqual(self.cache.feed([10, 20], 5),
+                         [105, 104, 103, 102, 101])
+
+    def test_add_to_warm_buffer(self):
+        self.cache.recent(10, 3)
+
+        msg = Message(id=200, text="newest", user_id=10,
+                      timestamp=datetime(2020, 1, 2))
+        db.session.add(msg)
+        db.session.commit()
+        self.cache.add(msg.user_id, msg.id)
+
+        # ring buffer drops the oldest entry
+        self.assertEqual(self.cache.recent(10, 3), [200, 105, 103])
+
+    def test_add_out_of_order(self):
+        self.cache.recent(10, 3)
+
+        # two posts committed, and added, in the opposite order of their ids
+        self.cache.add(10, 201)
+        self.cache.add(10, 200)
+        self.assertEqual(self.cache.recent(10, 3), [201, 200, 105])
+
+        self.cache.add(10, 104)
+        self.assertEqual(self.cache.recent(10, 3), [201, 200, 105])
+        self.cache.add(10, 200)
+        self.assertEqual(self.cache.recent(10, 3), [201, 200, 105])
+
+    def test_discard(self):
+        self.cache.recent(10, 3)
+
+        Message.query.filter_by(id=105).delete()
+        db.session.commit()
+        self.cache.discard(10)
+
+        self.assertEqual(self.cache.recent(10, 3), [103, 101])
+
+    def test_ttl_expiry(self):
+        self.cache.ttl = -1
+        self.cache.recent(10, 3)
+
+        db.session.add(Message(id=300, text="from another worker",
+                               user_id=10, timestamp=datetime(2020, 1, 3)))
+        db.session.commit()
+
+        self.assertEqual(self.cache.recent(10, 1), [300])
@@ -4,28 +4,17 @@
 #
 # python -m unittest test_user_model.py
 
-import os
-
-# Set database url to the warbler-test database.
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-from app import app
-from unittest import TestCase
 from sqlalchemy import exc
 from models import db, User, Message, Follows
-
-# Create all tables for tests.
-
-db.create_all()
+from testcase import DBTestCase
 
 
-class UserModelTestCase(TestCase):
+class UserModelTestCase(DBTestCase):
     """Test views for messages."""
 
     def setUp(self):
         """Create test client, add sample data."""
-        db.drop_all()
-        db.create_all()
+        super().setUp()
 
         user1 = User.signup("test1", "email1@email.com", "password", None)
         user1_id = 10
@@ -46,13 +35,6 @@ class UserModelTestCase(TestCase):
         self.user2 = user2
         self.user2_id = user2_id
 
-        self.client = app.test_client()
-
-    def tearDown(self):
-        res = super().tearDown()
-        db.session.rollback()
-        return res
-
     def test_user_model(self):
         """Does basic model work?"""
 
@@ -97,6 +79,34 @@ class UserModelTestCase(TestCase):
         self.assertTrue(self.user2.is_followed_by(self.user1))
         self.assertFalse(self.user1.is_followed_by(self.user2))
 
+    def test_follows_pages(self):
+        others = [User.signup(f"fan{i}", f"fan{i}@email.com", "password",
+                              None) for i in range(3)]
+        for i, other in enumerate(others):
+            other.id = 20 + i
+            other.following.append(self.user1)
+        self.user1.following.extend(others[:2])
+        db.session.commit()
+
+        self.assertEqual([u.id for u in self.user1.followers_page(limit=2)],
+                         [20, 21])
+        self.assertEqual([u.id for u in self.user1.followers_page(after=21)],
+                         [22])
+        self.assertEqual([u.id for u in self.user1.following_page()],
+                         [20, 21])
+
+        self.assertEqual(self.user1.following_ids([20, 22, 100]), {20})
+        self.assertEqual(self.user1.following_ids([]), set())
+
+    def test_counts(self):
+        self.user1.following.append(self.user2)
+        db.session.add(Message(text="warble", user_id=self.user1_id))
+        db.session.commit()
+
+        self.assertEqual(self.user1.counts(), {'messages': 1, 'following': 1,
+                                               'followers': 0, 'likes': 0})
+        self.assertEqual(self.user2.counts()['followers'], 1)
+
     ##############
     # Signup Tests
     def test_valid_signup(self):
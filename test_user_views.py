@@ -4,34 +4,20 @@
 #
 # FLASK_ENV=production python -m unittest test_message_views.py
 
-import os
+from unittest.mock import patch
 
-# Set database url to the warbler-test database.
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-from app import app, CURR_USER_KEY
-from unittest import TestCase
+from app import CURR_USER_KEY
 from models import db, connect_db, Message, User, Likes, Follows
-
-# Create all tables for tests.
-
-db.create_all()
-
-# Prevent WTForms from using CSRF and debug from intercepting redirects.
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['WTF_CSRF_ENABLED'] = False
+from testcase import DBTestCase
 
 
-class MessageViewTestCase(TestCase):
+class MessageViewTestCase(DBTestCase):
     """Test views for messages."""
 
     def setUp(self):
         """Create test client, add sample data."""
 
-        db.drop_all()
-        db.create_all()
-
-        self.client = app.test_client()
+        super().setUp()
 
         self.testuser = User.signup(username="testuser",
                                     email="test@test.com",
@@ -51,11 +37,6 @@ class MessageViewTestCase(TestCase):
 
         db.session.commit()
 
-    def tearDown(self):
-        resp = super().tearDown()
-        db.session.rollback()
-        return resp
-
     def test_users_index(self):
         with self.client as client:
             resp = client.get("/users")
@@ -217,6 +198,28 @@ class MessageViewTestCase(TestCase):
             self.assertNotIn("@hij", str(resp.data))
             self.assertNotIn("@testing", str(resp.data))
 
+    def test_followers_pages(self):
+        self.setup_followers()
+        db.session.add(Follows(user_being_followed_id=self.testuser_id,
+                               user_following_id=self.user2_id))
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            with patch('views.FOLLOWS_PAGE_SIZE', 1):
+                resp = client.get(f"/users/{self.testuser_id}/followers")
+                self.assertIn("@abc", str(resp.data))
+                self.assertNotIn("@efg", str(resp.data))
+                self.assertIn(f"followers?after={self.user1_id}",
+                              str(resp.data))
+
+                resp = client.get(f"/users/{self.testuser_id}/followers"
+                                  f"?after={self.user1_id}")
+                self.assertIn("@efg", str(resp.data))
+                self.assertNotIn("?after=", str(resp.data))
+
     def test_unauthorized_following_page_access(self):
         self.setup_followers()
         with self.client as client:
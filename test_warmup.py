@@ -0,0 +1,104 @@
+"""Hot key recording and warm-up tests."""
+
+# run these tests like:
+#
+# python -m unittest test_warmup.py
+
+import os
+import tempfile
+from unittest.mock import patch
+
+from app import CURR_USER_KEY
+from models import db, User, Follows
+from queries import post_message
+from timeline_cache import timeline_cache
+from warmup import hot_keys, warm_up
+from testcase import DBTestCase, app
+
+STEPS = ['templates', 'queries', 'users', 'authors', 'feeds', 'profiles']
+
+
+def quiet(line):
+    pass
+
+
+class WarmUpTestCase(DBTestCase):
+    """Test recording hot users and warming up for them."""
+
+    def setUp(self):
+        super().setUp()
+
+        ann = User.signup("ann", "ann@test.com", "password", None)
+        bob = User.signup("bob", "bob@test.com", "password", None)
+        db.session.flush()
+        db.session.add(Follows(user_following_id=ann.id,
+                               user_being_followed_id=bob.id))
+        db.session.commit()
+        self.ann_id = ann.id
+        self.bob_id = bob.id
+        post_message(self.bob_id, "hot warble")
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        for p in [patch.object(hot_keys, 'path',
+                               os.path.join(self.tmp.name, 'hot.json')),
+                  patch.object(hot_keys, 'interval', 0)]:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_record(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ann_id
+        # all within one interval
+        with patch.object(hot_keys, 'interval', 3600):
+            self.client.get('/')
+            for _ in range(3):
+                self.client.get(f'/users/{self.bob_id}')
+            self.client.get(f'/users/{self.ann_id}')
+            self.client.get('/users/999999')
+        hot_keys.flush()
+
+        self.assertEqual(hot_keys.load(), {'feeds': [self.ann_id],
+                                           'profiles': [self.bob_id,
+                                                        self.ann_id]})
+
+    def test_counts_decay(self):
+        for _ in range(3):
+            self.client.get(f'/users/{self.bob_id}')
+        # bob's 3 requests halve at each later merge
+        for _ in range(2):
+            self.client.get(f'/users/{self.ann_id}')
+
+        self.assertEqual(hot_keys.load()['profiles'],
+                         [self.ann_id, self.bob_id])
+
+    def test_warm_up(self):
+        timeline_cache.clear()
+        report = warm_up(app, keys={'feeds': [self.ann_id],
+                                    'profiles': [self.bob_id]},
+                         budget=30, log=quiet)
+
+        self.assertEqual([step['step'] for step in report], STEPS)
+        self.assertTrue(all(step['warmed'] == step['of'] for step in report))
+        self.assertEqual(report[2]['warmed'], 2)
+        # ann's feed and bob's profile were read into the buffers
+        self.assertEqual(set(timeline_cache._stale([self.ann_id,
+                                                    self.bob_id])),
+                         {self.ann_id, self.bob_id})
+
+    def test_recorded_keys(self):
+        self.client.get(f'/users/{self.bob_id}')
+        report = warm_up(app, budget=30, log=quiet)
+
+        self.assertEqual(report[-1], {'step': 'profiles', 'warmed': 1,
+                                      'of': 1,
+                                      'seconds': report[-1]['seconds']})
+
+    def test_budget(self):
+        report = warm_up(app, keys={'feeds': [self.ann_id]}, budget=0,
+                         log=quiet)
+
+        self.assertEqual(report, [{'step': 'templates', 'warmed': 0,
+                                   'of': report[0]['of'],
+                                   'seconds': report[0]['seconds']}])
+        self.assertGreater(report[0]['of'], 0)
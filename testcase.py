@@ -0,0 +1,146 @@
+"""Shared base class for tests that use the database.
+
+Test databases:
+
+- by default, Postgres `warbler-test` (or TEST_DATABASE_URL). When tests
+  run in parallel under pytest-xdist, each worker process gets its own
+  database (`warbler-test-gw0`, `warbler-test-gw1`, ...), created on
+  demand;
+- with WARBLER_TEST_SQLITE=1, an in-memory SQLite database, which is
+  much faster for model tests.
+
+The schema is created once per process. Every test runs inside one
+outer transaction that is rolled back when the test ends. The code under
+test works inside a SAVEPOINT: its commits only release the savepoint,
+and its rollbacks only go back to it. A fresh savepoint is started each
+time. Tests therefore never delete or recreate rows.
+
+run tests like:
+
+    python -m unittest
+    python -m pytest -n 4                       # pytest-xdist
+    WARBLER_TEST_SQLITE=1 python -m pytest test_user_model.py
+"""
+
+import os
+from unittest import TestCase
+
+from flask import _app_ctx_stack
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import scoped_session
+
+from app import create_app
+from models import db
+from timeline_cache import timeline_cache
+from author_cards import author_cards
+from taken_names import taken_names
+from notifications import notifier
+from snowflake import lease_worker_id, BACKFILL_WORKER_ID
+
+if 'WARBLER_WORKER_ID' not in os.environ:
+    # as gunicorn's workers do: one per test process (see snowflake.py)
+    os.environ['WARBLER_WORKER_ID'] = str(
+        lease_worker_id(0, BACKFILL_WORKER_ID))
+
+
+def database_url():
+    """Database for this test process."""
+
+    if os.environ.get('WARBLER_TEST_SQLITE'):
+        return 'sqlite://'
+
+    url = make_url(os.environ.get('TEST_DATABASE_URL',
+                                  'postgresql:///warbler-test'))
+    worker = os.environ.get('PYTEST_XDIST_WORKER')
+    if worker:
+        url.database = f"{url.database}-{worker}"
+        _create_database(url)
+    return str(url)
+
+
+def _create_database(url):
+    """Create the Postgres database at `url` unless it exists."""
+
+    maintenance_url = make_url(str(url))
+    maintenance_url.database = 'postgres'
+    engine = create_engine(maintenance_url, isolation_level='AUTOCOMMIT')
+    with engine.connect() as conn:
+        exists = conn.execute("SELECT 1 FROM pg_database WHERE datname = %s",
+                              url.database).scalar()
+        if not exists:
+            conn.execute(f'CREATE DATABASE "{url.database}"')
+    engine.dispose()
+
+
+app = create_app('testing')
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+
+if db.get_engine(app).dialect.name == 'sqlite':
+    # pysqlite's own transaction handling breaks SAVEPOINTs; let
+    # SQLAlchemy issue BEGIN itself.
+    @event.listens_for(db.get_engine(app), 'connect')
+    def _sqlite_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(db.get_engine(app), 'begin')
+    def _sqlite_begin(conn):
+        conn.execute('BEGIN')
+
+_schema_created = False
+
+
+class DBTestCase(TestCase):
+    """Test case running each test in a rolled-back transaction."""
+
+    @classmethod
+    def setUpClass(cls):
+        global _schema_created
+
+        super().setUpClass()
+        if not _schema_created:
+            db.drop_all()
+            db.create_all()
+            if db.engine.dialect.name == 'postgresql':
+                # sequences aren't rolled back: keep the user ids tests
+                # pick by hand clear of the ones signups are given
+                db.engine.execute(
+                    "ALTER SEQUENCE users_id_seq RESTART WITH 1000000")
+            _schema_created = True
+
+    def setUp(self):
+        # each undone as soon as it is done: a setUp that fails later on
+        # (here or in a subclass) still leaves the database as it was
+        self.connection = db.engine.connect()
+        self.addCleanup(self.connection.close)
+        self.transaction = self.connection.begin()
+        self.addCleanup(self.transaction.rollback)
+
+        factory = db.create_session({'bind': self.connection, 'binds': {}})
+
+        @event.listens_for(factory, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
+
+        def make_session():
+            session = factory()
+            session.begin_nested()
+            return session
+
+        app_session = db.session
+        db.session = scoped_session(make_session,
+                                    scopefunc=_app_ctx_stack.__ident_func__)
+        self.addCleanup(self._restore_session, app_session)
+        timeline_cache.clear()
+        author_cards.clear()
+        taken_names.clear()
+        notifier.clear()
+
+        self.client = app.test_client()
+
+    @staticmethod
+    def _restore_session(app_session):
+        db.session.remove()
+        db.session = app_session
@@ -0,0 +1,162 @@
+"""In-memory cache of each author's most recent messages.
+
+Every author that shows up on a profile page or in a home feed gets a
+fixed-size ring buffer holding the ids of their newest messages, newest
+first. Message ids are time-sortable (see snowflake.py), so ordering by id
+is ordering by time. Profile pages read their first page straight from
+the buffer, and home feeds are a k-way merge over the buffers of the
+followed authors. SQL is only needed to warm cold authors (in one batched
+query) and for pages deeper than the buffer.
+
+The cache lives in each worker process. Buffers expire after a TTL so that
+messages written through other workers show up within that window.
+"""
+
+import heapq
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+
+from queries import feed_ids, recent_ids_per_author
+
+
+class TimelineCache:
+    """Per-author ring buffers of recent message ids."""
+
+    def __init__(self, size=100, ttl=30, max_authors=10000):
+        self.size = size
+        self.ttl = ttl
+        self.max_authors = max_authors
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read cache sizing from the Flask app's config."""
+
+        self.size = app.config.setdefault('TIMELINE_CACHE_SIZE', self.size)
+        self.ttl = app.config.setdefault('TIMELINE_CACHE_TTL', self.ttl)
+        self.max_authors = app.config.setdefault(
+            'TIMELINE_CACHE_AUTHORS', self.max_authors)
+        self.clear()
+
+    def clear(self):
+        """Drop every buffer."""
+
+        with self._lock:
+            self._buffers.clear()
+
+    def add(self, user_id, message_id):
+        """Record a newly written message.
+
+        Only warm buffers are updated: a cold author's buffer is filled
+        from the database on first read, which already includes it.
+        """
+
+        with self._lock:
+            entry = self._buffers.get(user_id)
+            if entry is not None:
+                _insert_sorted(entry[1], message_id)
+
+    def discard(self, user_id):
+        """Forget an author's buffer (e.g. after one of their messages
+        was deleted), so it is re-read from the database next time."""
+
+        with self._lock:
+            self._buffers.pop(user_id, None)
+
+    def recent(self, user_id, limit):
+        """Return ids of the author's `limit` newest messages."""
+
+        if limit > self.size:
+            return self._query([user_id], limit)
+
+        return self._get([user_id])[user_id][:limit]
+
+    def feed(self, user_ids, limit, stale=False):
+        """Return ids of the `limit` newest messages across `user_ids`.
+
+        With `stale`, never touch the database: use the buffers however
+        old they are, and leave out authors without one. This is the
+        home page's fallback when the database is slow.
+        """
+
+        if stale:
+            buffers = self._stale(user_ids).values()
+        elif limit > self.size:
+            return self._query(user_ids, limit)
+        else:
+            buffers = self._get(user_ids).values()
+        merged = heapq.merge(*buffers, reverse=True)
+        return list(islice(merged, limit))
+
+    def _get(self, user_ids):
+        """Return {user_id: snapshot of buffer}, warming cold authors."""
+
+        now = time.monotonic()
+        found = {}
+        cold = []
+
+        with self._lock:
+            for user_id in set(user_ids):
+                entry = self._buffers.get(user_id)
+                if entry is None or now - entry[0] > self.ttl:
+                    cold.append(user_id)
+                else:
+                    self._buffers.move_to_end(user_id)
+                    found[user_id] = list(entry[1])
+
+        if cold:
+            warmed = self._load(cold)
+            with self._lock:
+                for user_id in cold:
+                    buffer = deque(warmed.get(user_id, ()), maxlen=self.size)
+                    self._buffers[user_id] = (now, buffer)
+                    self._buffers.move_to_end(user_id)
+                    found[user_id] = list(buffer)
+                while len(self._buffers) > self.max_authors:
+                    self._buffers.popitem(last=False)
+
+        return found
+
+    def _stale(self, user_ids):
+        """Return {user_id: snapshot of buffer} for authors with one."""
+
+        with self._lock:
+            return {user_id: list(self._buffers[user_id][1])
+                    for user_id in set(user_ids) if user_id in self._buffers}
+
+    def _query(self, user_ids, limit):
+        """Pages deeper than the buffers go straight to the database."""
+
+        return feed_ids(user_ids, limit)
+
+    def _load(self, user_ids):
+        """Fetch the newest `size` messages of each author in one query."""
+
+        return recent_ids_per_author(user_ids, self.size)
+
+
+def _insert_sorted(buffer, message_id):
+    """Insert `message_id` into `buffer` (a bounded deque, newest first)
+    where it sorts: concurrent posts can commit, and be added, out of
+    id order."""
+
+    position = 0
+    for position, other in enumerate(buffer):
+        if other <= message_id:
+            break
+    else:
+        position = len(buffer)
+
+    if position < len(buffer) and buffer[position] == message_id:
+        return
+    if len(buffer) == buffer.maxlen:
+        if position == len(buffer):
+            # older than every id kept: not among the newest
+            return
+        buffer.pop()
+    buffer.insert(position, message_id)
+
+
+timeline_cache = TimelineCache()
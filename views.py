@@ -0,0 +1,1061 @@
+"""Warbler routes and CLI commands."""
+
+import math
+import mimetypes
+import os
+from functools import lru_cache
+
+import click
+from flask import (Blueprint, Response, current_app, jsonify, render_template,
+                   request, flash, redirect, session, g, send_file, safe_join,
+                   abort, stream_with_context)
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+
+from app import CURR_USER_KEY
+from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
+from models import db, User, Message, Likes
+from timeline_cache import timeline_cache
+from author_cards import author_cards
+from queries import (user_by_id, followed_ids, liked_message_ids, like,
+                     messages_by_ids, message_by_id, user_messages_before,
+                     feed_after, post_message, post_messages, delete_message,
+                     delete_user_rows, tag_message_ids, mention_message_ids,
+                     notifications_before)
+from shards import (shard_router, create_shard_tables, pin_users,
+                    move_pinned)
+from archive import message_archive, create_partitions, archive_partitions
+from image_proxy import image_proxy
+from assets import build, precompressed
+from export import FORMATS as EXPORT_FORMATS, export_data, parse_cursor
+from broker import timeline_broker, Overflow
+from ratelimit import rate_limiter
+from taken_names import taken_names
+from deadlines import deadlines, DeadlineExceeded
+from profiler import request_profiler
+from hashtags import link_tags, backfill as backfill_tags
+from warmup import warm_up
+from engines import pool_status
+from notifications import notifier, coalesce, FOLLOW, LIKE
+from snowflake import timestamp_of
+
+bp = Blueprint('warbler', __name__)
+
+
+##############################################################################
+# User signup/login/logout
+
+
+@bp.before_app_request
+def rate_limit():
+    """Refuse requests over their endpoint's RATE_LIMITS."""
+
+    wait = rate_limiter.hit(request.endpoint, request.method,
+                            request.remote_addr, session.get(CURR_USER_KEY))
+    if wait:
+        resp = Response("Too many requests. Please slow down.", 429,
+                        mimetype='text/plain')
+        resp.headers['Retry-After'] = str(math.ceil(wait))
+        return resp
+
+
+@bp.before_app_request
+def add_user_to_g():
+    """If we're logged in, add curr user to Flask global."""
+
+    if CURR_USER_KEY in session:
+        g.user = user_by_id(session[CURR_USER_KEY])
+
+    else:
+        g.user = None
+
+
+def do_login(user):
+    """Log in user."""
+
+    session[CURR_USER_KEY] = user.id
+
+
+def do_logout():
+    """Logout user."""
+
+    if CURR_USER_KEY in session:
+        del session[CURR_USER_KEY]
+
+
+@bp.route('/signup', methods=["GET", "POST"])
+def signup():
+    """Handle user signup.
+
+    Create new user and add to DB. Redirect to home page.
+
+    If form not valid, present form.
+
+    If the there already is a user with that username: flash message
+    and re-present form. Taken usernames and emails are caught before
+    the password is hashed; see taken_names.py.
+    """
+
+    form = UserAddForm()
+
+    if form.validate_on_submit():
+        if taken_names.username_taken(form.username.data):
+            flash("Username already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+        if taken_names.email_taken(form.email.data):
+            flash("Email already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
+        try:
+            user = User.signup(
+                username=form.username.data,
+                password=form.password.data,
+                email=form.email.data,
+                image_url=form.image_url.data or User.image_url.default.arg,
+            )
+            db.session.commit()
+
+        except IntegrityError:
+            flash("Username already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
+        taken_names.add(user.username, user.email)
+        do_login(user)
+
+        return redirect("/")
+
+    else:
+        return render_template('users/signup.html', form=form)
+
+
+@bp.route('/api/username-available')
+def username_available():
+    """Is ?username= free? For checking the signup form as it is typed."""
+
+    username = request.args.get('username', '').strip()
+    if not username:
+        return jsonify(error="username is required"), 400
+
+    return jsonify(username=username,
+                   available=not taken_names.username_taken(username))
+
+
+@bp.route('/login', methods=["GET", "POST"])
+def login():
+    """Handle user login."""
+
+    form = LoginForm()
+
+    if form.validate_on_submit():
+        user = User.authenticate(form.username.data,
+                                 form.password.data)
+
+        if user:
+            do_login(user)
+            flash(f"Hello, {user.username}!", "success")
+            return redirect("/")
+
+        flash("Invalid credentials.", 'danger')
+
+    return render_template('users/login.html', form=form)
+
+
+@bp.route('/logout')
+def logout():
+    """Handle logout of user."""
+
+    do_logout()
+    flash(f"Logout successful!", "success")
+    return redirect('/')
+
+
+##############################################################################
+# General user routes:
+
+@bp.route('/users')
+def list_users():
+    """Page with listing of users.
+
+    Can take a 'q' param in querystring to search by that username.
+    """
+
+    search = request.args.get('q')
+
+    if not search:
+        users = User.query.all()
+    else:
+        users = User.query.filter(User.username.like(f"%{search}%")).all()
+
+    return render_template('users/index.html', users=users)
+
+
+@bp.route('/users/<int:user_id>')
+def users_show(user_id):
+    """Show user profile."""
+
+    user = user_by_id(user_id) or abort(404)
+    before = request.args.get('before', type=int)
+    # ids below this were archived, and their partitions dropped
+    boundary = message_archive.boundary()
+
+    if boundary is not None and before is not None and before <= boundary:
+        messages = []
+    elif before is None:
+        # the first page comes straight from the author's recent-message buffer
+        messages = messages_by_ids(timeline_cache.recent(user_id, 100))
+    else:
+        messages = user_messages_before(user_id, before, 100)
+
+    if len(messages) < 100 and boundary is not None:
+        # paged past the hot window: read through from the cold archive
+        cursor = messages[-1].id if messages else before
+        messages += message_archive.user_messages(
+            user_id, before=min(cursor or boundary, boundary),
+            limit=100 - len(messages))
+
+    return render_template('users/show.html', user=user, messages=messages)
+
+
+@bp.route('/users/<int:user_id>/following')
+def show_following(user_id):
+    """Show list of people this user is following."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = User.query.get_or_404(user_id)
+    users, after = _follows_page(user.following_page)
+    return render_template('users/following.html', user=user, users=users,
+                           followed=g.user.following_ids([u.id for u in users]),
+                           after=after)
+
+
+@bp.route('/users/<int:user_id>/followers')
+def users_followers(user_id):
+    """Show list of followers of this user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = User.query.get_or_404(user_id)
+    users, after = _follows_page(user.followers_page)
+    return render_template('users/followers.html', user=user, users=users,
+                           followed=g.user.following_ids([u.id for u in users]),
+                           after=after)
+
+
+FOLLOWS_PAGE_SIZE = 60
+
+
+def _follows_page(page):
+    """The page of users after ?after=, and the `after` of the next page
+    (None on the last page)."""
+
+    users = page(request.args.get('after', type=int), FOLLOWS_PAGE_SIZE + 1)
+    if len(users) > FOLLOWS_PAGE_SIZE:
+        return users[:FOLLOWS_PAGE_SIZE], users[FOLLOWS_PAGE_SIZE - 1].id
+    return users, None
+
+
+@bp.route('/users/follow/<int:follow_id>', methods=['POST'])
+def add_follow(follow_id):
+    """Add a follow for the currently-logged-in user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    followed_user = User.query.get_or_404(follow_id)
+    g.user.following.append(followed_user)
+    db.session.commit()
+    notifier.add(FOLLOW, followed_user.id, g.user.id)
+
+    return redirect(f"/users/{g.user.id}/following")
+
+
+@bp.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+def stop_following(follow_id):
+    """Have currently-logged-in-user stop following this user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    followed_user = User.query.get(follow_id)
+    g.user.following.remove(followed_user)
+    db.session.commit()
+
+    return redirect(f"/users/{g.user.id}/following")
+
+
+@bp.route('/users/<int:user_id>/likes')
+def show_likes(user_id):
+    """Show the current user's likes"""
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+    
+    likes = liked_message_ids(g.user.id)
+    messages = messages_by_ids(sorted(likes, reverse=True)[:100])
+    authors = author_cards.get_many(msg.user_id for msg in messages)
+
+    return render_template('users/likes.html', messages=messages,
+                           authors=authors)
+
+
+@bp.route('/users/profile', methods=["GET", "POST"])
+def profile():
+    """Update profile for current user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    form = UserEditForm()
+    curr_user_username = g.user.username
+
+    if form.validate_on_submit():
+        try:
+            user = User.authenticate(curr_user_username,
+                                 form.password.data)
+
+            user.username = form.username.data
+            user.email = form.email.data
+            user.image_url = form.image_url.data or User.image_url.default.arg
+            user.header_image_url = form.header_image_url.data or User.header_image_url.default.arg
+            user.bio = form.bio.data
+            db.session.commit()
+            author_cards.invalidate(user.id)
+            taken_names.add(user.username, user.email)
+
+            return redirect(f'/users/{g.user.id}')
+
+        except IntegrityError:
+            flash("That password is incorrect. Please try again", 'danger')
+            return render_template('users/edit.html', form=form)
+    return render_template('users/edit.html', form=form)
+
+
+@bp.route('/users/export')
+def export_user():
+    """Download all of the current user's data.
+
+    ?format= is ndjson (default) or zip; ?cursor= resumes an interrupted
+    download after the row with that cursor.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    fmt = request.args.get('format', 'ndjson')
+    cursor = request.args.get('cursor')
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+    if cursor:
+        try:
+            parse_cursor(cursor)
+        except ValueError:
+            abort(400)
+
+    mimetype, ext = EXPORT_FORMATS[fmt]
+    filename = f"warbler-{g.user.username}.{ext}"
+    return Response(stream_with_context(export_data(g.user, fmt, cursor)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition':
+                             f'attachment; filename="{filename}"'})
+
+
+@click.command('export-user')
+@click.argument('username')
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)),
+              default='ndjson')
+@click.option('--cursor', help="Resume after the row with this cursor.")
+@click.option('--output', type=click.File('wb'), default='-')
+@with_appcontext
+def export_user_command(username, fmt, cursor, output):
+    """Write all data of USERNAME to --output (default stdout)."""
+
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter(f"no user {username!r}", param_hint='USERNAME')
+
+    for chunk in export_data(user, fmt, cursor):
+        output.write(chunk)
+
+
+@click.command('post-messages')
+@click.argument('username')
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+@with_appcontext
+def post_messages_command(username, source, batch_size):
+    """Post each non-empty line of SOURCE (default stdin) as a message
+    by USERNAME, BATCH_SIZE per INSERT."""
+
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter(f"no user {username!r}", param_hint='USERNAME')
+
+    texts = [line.rstrip('\n') for line in source if line.strip()]
+    max_length = Message.text.type.length
+    for number, text in enumerate(texts, 1):
+        if len(text) > max_length:
+            raise click.BadParameter(
+                f"message {number} is over {max_length} characters",
+                param_hint='SOURCE')
+
+    for start in range(0, len(texts), batch_size):
+        _posted(user.id, post_messages(user.id,
+                                       texts[start:start + batch_size]))
+    click.echo(f"Posted {len(texts)} messages")
+
+
+@bp.route('/users/delete', methods=["POST"])
+def delete_user():
+    """Delete user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    do_logout()
+
+    delete_user_rows(g.user.id)
+    db.session.delete(g.user)
+    db.session.commit()
+    timeline_cache.discard(g.user.id)
+
+    return redirect("/signup")
+
+
+##############################################################################
+# Messages routes:
+
+@bp.route('/messages/new', methods=["GET", "POST"])
+def messages_add():
+    """Add a message:
+
+    Show form if GET. If valid, update message and redirect to user page.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    form = MessageForm()
+
+    if form.validate_on_submit():
+        _posted(g.user.id, [post_message(g.user.id, form.text.data)])
+        return redirect(f"/users/{g.user.id}")
+
+    return render_template('messages/new.html', form=form)
+
+
+BULK_MAX_MESSAGES = 100
+
+
+@bp.route('/messages/bulk', methods=["POST"])
+def messages_add_bulk():
+    """Add many messages in one call.
+
+    Takes JSON `{"messages": ["text", ...]}` (at most BULK_MAX_MESSAGES,
+    each 1-140 characters) and answers `{"ids": [...]}`, in order, as
+    strings: snowflakes are too big for JavaScript numbers. Only JSON is
+    accepted, which a cross-site form can't send.
+    """
+
+    if not g.user:
+        return jsonify(error="login required"), 401
+
+    body = request.get_json(silent=True) or {}
+    texts = body.get('messages')
+    error = _bulk_error(texts)
+    if error:
+        return jsonify(error=error), 400
+
+    ids = post_messages(g.user.id, texts)
+    _posted(g.user.id, ids)
+    return jsonify(ids=[str(msg_id) for msg_id in ids]), 201
+
+
+def _bulk_error(texts):
+    if not isinstance(texts, list) or not texts:
+        return "messages must be a non-empty list"
+    if len(texts) > BULK_MAX_MESSAGES:
+        return f"at most {BULK_MAX_MESSAGES} messages per call"
+    max_length = Message.text.type.length
+    for i, text in enumerate(texts):
+        if not isinstance(text, str) or not 0 < len(text) <= max_length:
+            return f"messages[{i}] must be 1-{max_length} characters"
+    return None
+
+
+def _posted(user_id, ids):
+    """Tell the caches and live streams about new messages."""
+
+    for msg_id in ids:
+        timeline_cache.add(user_id, msg_id)
+        timeline_broker.publish(user_id, msg_id)
+
+
+@bp.route('/messages/<int:message_id>', methods=["GET"])
+def messages_show(message_id):
+    """Show a message."""
+
+    msg = message_by_id(message_id) or abort(404)
+    return render_template('messages/show.html', message=msg,
+                           author=user_by_id(msg.user_id))
+
+
+@bp.route('/messages/<int:message_id>/delete', methods=["POST"])
+def messages_destroy(message_id):
+    """Delete a message."""
+
+    msg = message_by_id(message_id)
+
+    if not g.user or msg.user_id != g.user.id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    delete_message(msg)
+    timeline_cache.discard(msg.user_id)
+
+    return redirect(f"/users/{g.user.id}")
+
+##############################################################################
+# Tag timelines and mentions; see hashtags.py. Both page by message id with
+# ?before=.
+
+TAG_PAGE_SIZE = 50
+
+bp.add_app_template_filter(link_tags, 'link_tags')
+
+
+@bp.route('/tags/<tag>')
+def tag_timeline(tag):
+    """Show messages tagged #tag, newest first."""
+
+    tag = tag.lower()
+    ids = tag_message_ids(tag, request.args.get('before', type=int),
+                          TAG_PAGE_SIZE)
+    return _message_list(f"#{tag}", f"/tags/{tag}", ids)
+
+
+@bp.route('/mentions')
+def mentions_inbox():
+    """Show messages mentioning the current user, newest first."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    ids = mention_message_ids(g.user.id, request.args.get('before', type=int),
+                              TAG_PAGE_SIZE)
+    return _message_list("Mentions", "/mentions", ids)
+
+
+def _message_list(title, url, ids):
+    messages = messages_by_ids(ids)
+    authors = author_cards.get_many(msg.user_id for msg in messages)
+    likes = liked_message_ids(g.user.id) if g.user else set()
+    # a full page may have more after it
+    before = ids[-1] if len(ids) == TAG_PAGE_SIZE else None
+    return render_template('messages/list.html', title=title, url=url,
+                           messages=messages, authors=authors, likes=likes,
+                           before=before)
+
+
+##############################################################################
+# Notifications of follows and likes; see notifications.py. Pages go by
+# notification id with ?before=.
+
+NOTIFICATION_PAGE_SIZE = 50
+# actors named on each line; the rest are "and N others"
+NOTIFICATION_ACTORS = 3
+
+
+@bp.route('/notifications')
+def notifications_page():
+    """Show the current user's notifications, newest first, with the likes
+    of one warble and new followers each folded into one line."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    before = request.args.get('before', type=int)
+    events = notifications_before(g.user.id, before, NOTIFICATION_PAGE_SIZE)
+    groups = coalesce(events)
+    authors = author_cards.get_many(
+        actor_id for group in groups
+        for actor_id in group['actor_ids'][:NOTIFICATION_ACTORS])
+    messages = {msg.id: msg for msg in messages_by_ids(
+        [group['message_id'] for group in groups if group['message_id']])}
+
+    if (before is None and events and
+            events[0].id > g.user.notifications_seen_id):
+        g.user.notifications_seen_id = events[0].id
+        db.session.commit()
+        notifier.forget(g.user.id)
+
+    return render_template(
+        'users/notifications.html', groups=groups, authors=authors,
+        messages=messages, shown=NOTIFICATION_ACTORS, FOLLOW=FOLLOW,
+        when=timestamp_of,
+        before=events[-1].id if len(events) == NOTIFICATION_PAGE_SIZE
+        else None)
+
+
+##############################################################################
+# Like routes:
+
+
+@bp.route('/users/add_like/<int:msg_id>', methods=['POST'])
+def like_message(msg_id):
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+        
+    liked = Likes(user_id=g.user.id, message_id=msg_id)
+    session = shard_router.session_for(g.user.id)
+    session.add(liked)
+    session.commit()
+
+    msg = message_by_id(msg_id)
+    if msg is not None:
+        notifier.add(LIKE, msg.user_id, g.user.id, msg_id)
+    return redirect('/')
+
+
+@bp.route('/users/remove_like/<int:msg_id>', methods=['POST'])
+def remove_liked_message(msg_id):
+    liked = like(g.user.id, msg_id)
+    session = shard_router.session_for(g.user.id)
+    session.delete(liked)
+    session.commit()
+    return redirect('/')
+
+
+##############################################################################
+# Static asset routes:
+#
+# Build fingerprinted, precompressed assets before starting the app with:
+#
+#   FLASK_APP=app.py flask build-assets
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets():
+    """Minify, fingerprint and precompress everything under static/."""
+
+    manifest = build(current_app.static_folder)
+    click.echo(f"Built {len(manifest)} assets.")
+
+
+@bp.route('/static/build/<path:filename>')
+def built_static(filename):
+    """Serve a built asset, precompressed if the client accepts it."""
+
+    path = safe_join(os.path.join(current_app.static_folder, 'build'),
+                     filename)
+    if not os.path.isfile(path):
+        abort(404)
+
+    path, encoding = precompressed(path, request.accept_encodings)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    resp = send_file(path, mimetype=mimetype, conditional=True,
+                     cache_timeout=31536000)
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+
+##############################################################################
+# Image proxy routes:
+
+
+@bp.route('/img/<size>/<source_hash>')
+def image_variant(size, source_hash):
+    """Serve a resized, cached copy of a user image."""
+
+    webp = 'image/webp' in request.headers.get('Accept', '')
+    path, mimetype = image_proxy.variant(size, source_hash, webp=webp)
+
+    resp = send_file(path, mimetype=mimetype, conditional=True,
+                     cache_timeout=31536000)
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    resp.headers['Vary'] = 'Accept'
+    return resp
+
+
+##############################################################################
+# Admin pages: only for users listed in ADMIN_USERNAMES.
+
+
+@bp.route('/admin/profiles')
+def admin_profiles():
+    """List recent profiler captures per endpoint; see profiler.py."""
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    captures = {endpoint: request_profiler.captures(endpoint)
+                for endpoint in request_profiler.endpoints()}
+    return render_template('admin/profiles.html', captures=captures)
+
+
+@bp.route('/admin/profiles/<endpoint>/<filename>')
+def admin_profile_file(endpoint, filename):
+    """Serve one capture's flame graph, collapsed stacks or metadata."""
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    path = request_profiler.path(endpoint, filename) or abort(404)
+    mimetype = ('text/plain' if filename.endswith('.folded')
+                else mimetypes.guess_type(filename)[0])
+    return send_file(path, mimetype=mimetype)
+
+
+@bp.route('/admin/stats')
+def admin_stats():
+    """Engagement dashboard, as of the last `flask analytics` run."""
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    # numpy: imported by this page and the job only, not at worker start
+    from analytics import load_stats
+
+    stats = load_stats(current_app.config['ANALYTICS_DIR'])
+    return render_template('admin/stats.html', stats=stats)
+
+
+@bp.route('/admin/pool')
+def admin_pool():
+    """This worker's database connection pools and how long requests
+    waited for them; see engines.py."""
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    engines = {'default': db.get_engine()}
+    for name in shard_router.shard_names():
+        if name is not None:
+            engines[name] = db.get_engine(bind=name)
+    return jsonify(pool_status(engines))
+
+
+##############################################################################
+# Homepage and error pages
+
+
+@bp.route('/')
+def homepage():
+    """Show homepage:
+
+    - anon users: no messages
+    - logged in: 100 most recent messages of followed_users
+    """
+
+    if g.user:
+        author_ids = followed_ids(g.user.id) + [g.user.id]
+        likes = liked_message_ids(g.user.id)
+        stale = False
+        try:
+            # k-way merge over the followed authors' recent-message buffers
+            with deadlines.within(current_app.config['TIMELINE_BUDGET']):
+                message_ids = timeline_cache.feed(author_ids, 100)
+        except DeadlineExceeded:
+            # the database is slow: show the buffers as they last were
+            message_ids = timeline_cache.feed(author_ids, 100, stale=True)
+            stale = True
+        messages = messages_by_ids(message_ids)
+        authors = author_cards.get_many(msg.user_id for msg in messages)
+        return render_template('home.html', messages=messages, likes=likes,
+                               authors=authors, stale=stale)
+
+    else:
+        return render_template('home-anon.html')
+
+
+@bp.app_template_global()
+def stats(user):
+    """`user.counts()` for a stats bar, or None (no stats bar) when they
+    take longer than STATS_BUDGET."""
+
+    try:
+        with deadlines.within(current_app.config['STATS_BUDGET']):
+            return user.counts()
+    except DeadlineExceeded:
+        return None
+
+
+##############################################################################
+# Live timeline: server-sent events with each new warble from followed users
+# (and yourself), rendered like the timeline's own <li>s.
+
+STREAM_KEEPALIVE = 15
+STREAM_RETRY = 3
+STREAM_CATCH_UP = 100
+
+
+@bp.route('/stream/timeline')
+def stream_timeline():
+    """Stream new timeline messages as they are posted.
+
+    Resumes after the Last-Event-ID header sent on reconnect, or else after
+    ?after=, the newest message the page was rendered with.
+    """
+
+    if not g.user:
+        abort(401)
+
+    user_id = g.user.id
+    author_ids = followed_ids(user_id) + [user_id]
+    # templates read g.user after the stream has released its session
+    db.session.expunge(g.user)
+    after = (request.headers.get('Last-Event-ID', type=int) or
+             request.args.get('after', type=int))
+
+    def events():
+        with timeline_broker.subscribe(author_ids) as subscription:
+            yield f"retry: {STREAM_RETRY * 1000}\n\n"
+
+            missed = []
+            if after:
+                missed = [(author_id, msg_id) for msg_id, author_id in
+                          feed_after(author_ids, after, STREAM_CATCH_UP)]
+                missed.reverse()
+            # subscribed first, so these may be published again below
+            sent = {msg_id for _, msg_id in missed}
+            published = missed
+
+            while True:
+                for author_id, msg_id in published:
+                    html = _warble_html(msg_id, author_id == user_id,
+                                        author_cards.get(author_id))
+                    if html is not None:
+                        data = ''.join(f"data: {line}\n"
+                                       for line in html.splitlines())
+                        yield f"event: warble\nid: {msg_id}\n{data}\n"
+
+                # hand the connections back to the pools while idle
+                db.session.remove()
+                shard_router.remove()
+                try:
+                    published = subscription.get(timeout=STREAM_KEEPALIVE)
+                except Overflow:
+                    # too far behind: the client reconnects and catches up
+                    return
+                if not published:
+                    yield ": keepalive\n\n"
+                published = sorted((p for p in published if p[1] not in sent),
+                                   key=lambda p: p[1])
+
+    resp = Response(stream_with_context(events()),
+                    mimetype='text/event-stream')
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+@lru_cache(maxsize=1024)
+def _warble_html(message_id, own, author):
+    """Timeline <li> for a message, as seen by its author (own) or by a
+    follower; rendered once per process, not once per open stream. The
+    author's card is part of the key, so a profile edit renders afresh."""
+
+    msg = message_by_id(message_id)
+    if msg is None or author is None:
+        return None
+    return render_template('messages/_message.html', msg=msg, likes=(),
+                           authors={author.id: author})
+
+
+##############################################################################
+# Message partition maintenance (run periodically, e.g. from cron):
+#
+#   FLASK_APP=app.py flask maintain-partitions
+
+
+@click.command('maintain-partitions')
+@with_appcontext
+def maintain_partitions():
+    """Create upcoming message partitions and archive expired ones."""
+
+    with db.engine.begin() as conn:
+        created = create_partitions(
+            conn, current_app.config['MESSAGE_PARTITIONS_AHEAD'])
+        click.echo(f"Partitions present: {', '.join(created)}")
+
+        if message_archive.directory:
+            archived = archive_partitions(
+                conn, message_archive,
+                current_app.config['MESSAGE_RETENTION_MONTHS'])
+            click.echo(f"Archived: {', '.join(archived) or 'nothing'}")
+        else:
+            click.echo("MESSAGE_ARCHIVE_DIR is not set: expired partitions "
+                       "stay in the database", err=True)
+
+
+##############################################################################
+# Moving users between message shards; see shards.py:
+#
+#   FLASK_APP=app.py flask create-shards
+#   FLASK_APP=app.py flask reshard-pin a b c
+#   (deploy with MESSAGE_SHARDS = ['a', 'b', 'c'])
+#   FLASK_APP=app.py flask reshard-move
+
+
+@click.command('create-shards')
+@click.argument('names', nargs=-1)
+@with_appcontext
+def create_shards(names):
+    """Create the sharded tables on NAMES (default: MESSAGE_SHARDS)."""
+
+    for name in names or shard_router.names:
+        create_shard_tables(name)
+        click.echo(f"Shard {name}: ready")
+
+
+@click.command('reshard-pin')
+@click.argument('names', nargs=-1, required=True)
+@with_appcontext
+def reshard_pin(names):
+    """Pin the users that a ring over NAMES would move."""
+
+    if not shard_router.sharded:
+        raise click.UsageError("MESSAGE_SHARDS is empty: there is nothing "
+                               "to move users from")
+    binds = current_app.config.get('SQLALCHEMY_BINDS') or {}
+    unknown = set(names) - set(binds)
+    if unknown:
+        raise click.BadParameter(f"not in SQLALCHEMY_BINDS: {sorted(unknown)}",
+                                 param_hint='NAMES')
+    for name in names:
+        create_shard_tables(name)
+    click.echo(f"Pinned {pin_users(names)} users")
+
+
+@click.command('reshard-move')
+@click.option('--grace', type=float,
+              help="Seconds to wait for workers to see a move "
+                   "(default: twice SHARD_PIN_TTL).")
+@with_appcontext
+def reshard_move(grace):
+    """Move pinned users to the shard MESSAGE_SHARDS' ring gives them."""
+
+    if not shard_router.sharded:
+        raise click.UsageError("MESSAGE_SHARDS is empty")
+    if grace is None:
+        grace = 2 * shard_router.pin_ttl
+    move_pinned(grace, log=click.echo)
+
+
+##############################################################################
+# Indexing the tags and mentions of messages posted before they were parsed
+# at write time:
+#
+#   FLASK_APP=app.py flask backfill-tags --workers 4
+
+
+@click.command('backfill-tags')
+@click.option('--workers', default=4, show_default=True,
+              help="Processes indexing chunks in parallel.")
+@click.option('--chunk-size', default=10000, show_default=True,
+              help="Messages per chunk.")
+@with_appcontext
+def backfill_tags_command(workers, chunk_size):
+    """Index the hashtags and mentions of existing messages."""
+
+    total = backfill_tags(workers, chunk_size)
+    click.echo(f"Indexed {total} messages.")
+
+
+##############################################################################
+# Recomputing the /admin/stats numbers (run periodically, e.g. nightly from
+# cron); see analytics.py:
+#
+#   FLASK_APP=app.py flask analytics
+
+
+@click.command('analytics')
+@click.option('--from-snapshot', is_flag=True,
+              help="Aggregate the last snapshot again, without reading "
+                   "the database.")
+@with_appcontext
+def analytics_command(from_snapshot):
+    """Snapshot the tables and recompute the engagement stats."""
+
+    from analytics import run
+
+    directory = current_app.config['ANALYTICS_DIR']
+    if not directory:
+        raise click.UsageError("ANALYTICS_DIR is not set")
+    config = current_app.config
+    stats = run(directory, config['ANALYTICS_BATCH'], config['ANALYTICS_DAYS'],
+                config['ANALYTICS_TOP'], from_snapshot, log=click.echo)
+    click.echo(f"Stats of {stats['totals']['messages']} messages written "
+               f"to {directory}.")
+
+
+##############################################################################
+# Warming up (wsgi.py does this in each worker before it takes traffic);
+# see warmup.py:
+#
+#   FLASK_APP=app.py flask warm-up
+
+
+@click.command('warm-up')
+@click.option('--budget', type=float,
+              help="Seconds to spend at most (default: WARMUP_BUDGET).")
+@with_appcontext
+def warm_up_command(budget):
+    """Warm the caches up for the recorded hot users, and report."""
+
+    report = warm_up(current_app._get_current_object(), budget,
+                     log=click.echo)
+    warmed = sum(step['warmed'] for step in report)
+    click.echo(f"Warmed {warmed} items in {len(report)} steps.")
+
+
+##############################################################################
+# Turn off all caching in Flask
+#   (useful for dev; in production, this kind of stuff is typically
+#   handled elsewhere)
+#
+# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+
+# Responses from these endpoints never change and keep their own caching.
+CACHEABLE_ENDPOINTS = {'warbler.image_variant', 'warbler.built_static'}
+
+
+@bp.after_app_request
+def add_header(req):
+    """Add non-caching headers on every request."""
+
+    if request.endpoint in CACHEABLE_ENDPOINTS:
+        return req
+
+    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    req.headers["Pragma"] = "no-cache"
+    req.headers["Expires"] = "0"
+    req.headers['Cache-Control'] = 'public, max-age=0'
+    return req
+
+
+# Registered on the app's `flask` command by create_app.
+COMMANDS = [build_assets, maintain_partitions, export_user_command,
+            post_messages_command, create_shards, reshard_pin, reshard_move,
+            backfill_tags_command, analytics_command, warm_up_command]
@@ -0,0 +1,239 @@
+"""Warming a worker up before it takes traffic.
+
+A new worker starts with nothing compiled or cached: Jinja templates,
+SQLAlchemy's mappers and baked queries, the timeline buffers and author
+cards are all built by its first requests, which also find the
+database's own caches cold after a deploy. `warm_up` does that work up
+front, in this order:
+
+1. templates: compile every template;
+2. queries: configure the mappers and run each hot query once, so its
+   SQL is compiled and cached;
+3. users: look up the hot users as their own requests would, by id,
+   with whom they follow and what they liked;
+4. authors: load the author cards of the hot users and of whoever they
+   follow, AUTHOR_BATCH at a time;
+5. feeds: fill the timeline buffers behind the hot users' home pages;
+6. profiles: read the first page of the hot profiles.
+
+Which users are hot comes from a recorded list: `HotKeys` counts, in
+every worker, whose home page and whose profile were served, and every
+WARMUP_RECORD_INTERVAL seconds merges its counts into WARMUP_KEYS_PATH
+(older counts decay by half at each merge). The WARMUP_TOP most
+requested of each are warmed.
+
+Warming stops after WARMUP_BUDGET seconds, wherever it got to; a slow
+database must not keep a worker out of service. It returns a report of
+what each step warmed, which is also logged. Run it by hand with
+
+    FLASK_APP=app.py flask warm-up
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+from sqlalchemy.orm import configure_mappers
+
+from models import db
+from author_cards import author_cards
+from queries import (user_by_id, followed_ids, liked_message_ids,
+                     messages_by_ids, user_messages_before, feed_ids,
+                     feed_after, recent_ids_per_author, author_card_rows)
+from shards import shard_router
+from timeline_cache import timeline_cache
+
+# recorded key kind for each endpoint, and the id it is recorded under
+RECORDED = {
+    'warbler.homepage': ('feeds', lambda: g.user and g.user.id),
+    'warbler.users_show': ('profiles',
+                           lambda: request.view_args.get('user_id')),
+}
+DECAY = 0.5
+AUTHOR_BATCH = 100
+
+
+class HotKeys:
+    """Counts requested profiles and feeds, merged into a file shared by
+    every worker."""
+
+    def __init__(self, path=None, interval=60, top=200):
+        self.path = path
+        self.interval = interval
+        self.top = top
+        self._counts = {kind: Counter() for kind, _ in RECORDED.values()}
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure from WARMUP_* settings; WARMUP_KEYS_PATH None turns
+        recording off."""
+
+        self.path = app.config.setdefault('WARMUP_KEYS_PATH', self.path)
+        self.interval = app.config.setdefault('WARMUP_RECORD_INTERVAL',
+                                              self.interval)
+        self.top = app.config.setdefault('WARMUP_TOP', self.top)
+        app.after_request(self._record)
+
+    def _record(self, response):
+        recorded = RECORDED.get(request.endpoint)
+        if (not self.path or recorded is None or
+                response.status_code != 200):
+            return response
+
+        kind, key = recorded
+        user_id = key()
+        if user_id:
+            with self._lock:
+                self._counts[kind][user_id] += 1
+                due = time.monotonic() - self._flushed > self.interval
+            if due:
+                self.flush()
+        return response
+
+    def flush(self):
+        """Merge this worker's counts into the file."""
+
+        with self._lock:
+            counts = self._counts
+            self._counts = {kind: Counter() for kind in counts}
+            self._flushed = time.monotonic()
+
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = {}
+            for kind, old in self._read().items():
+                merged[kind] = Counter({int(user_id): count * DECAY
+                                        for user_id, count in old.items()})
+            for kind, new in counts.items():
+                merged.setdefault(kind, Counter()).update(new)
+
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump({kind: dict(counter.most_common(self.top))
+                           for kind, counter in merged.items()}, f)
+            os.replace(self.path + '.tmp', self.path)
+
+    def load(self):
+        """{kind: [user id, ...]}, most requested first."""
+
+        return {kind: [int(user_id) for user_id, _ in
+                       Counter(counts).most_common(self.top)]
+                for kind, counts in self._read().items()}
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+
+hot_keys = HotKeys()
+
+
+##############################################################################
+# Warming
+
+
+class _Budget:
+    """Runs warm-up steps until the time is up."""
+
+    def __init__(self, seconds, log):
+        self.deadline = time.monotonic() + seconds
+        self.log = log
+        self.report = []
+
+    def step(self, name, keys, warm):
+        """Call warm(key) for each of `keys`; returns whether there is
+        time left."""
+
+        start = time.monotonic()
+        warmed = 0
+        for key in keys:
+            if time.monotonic() > self.deadline:
+                break
+            warm(key)
+            warmed += 1
+        seconds = time.monotonic() - start
+
+        done = warmed == len(keys)
+        self.report.append({'step': name, 'warmed': warmed,
+                            'of': len(keys), 'seconds': round(seconds, 3)})
+        self.log(f"warm-up {name}: {warmed}/{len(keys)} in {seconds:.2f}s"
+                 f"{'' if done else ' (out of time)'}")
+        return done
+
+
+def warm_up(app, budget=None, keys=None, log=None):
+    """Warm `app` up within `budget` seconds (default WARMUP_BUDGET) for
+    the hot users in `keys` (default: the recorded ones). Returns the
+    report, one {'step', 'warmed', 'of', 'seconds'} per step run."""
+
+    if budget is None:
+        budget = app.config['WARMUP_BUDGET']
+    if log is None:
+        log = app.logger.info
+    run = _Budget(budget, log)
+
+    with app.app_context():
+        if keys is None:
+            keys = hot_keys.load() if hot_keys.path else {}
+        feeds = keys.get('feeds', [])
+        profiles = keys.get('profiles', [])
+        users = list(dict.fromkeys(feeds + profiles))
+
+        try:
+            _warm(app, run, feeds, profiles, users)
+        finally:
+            db.session.remove()
+            shard_router.remove()
+
+    return run.report
+
+
+def _warm(app, run, feeds, profiles, users):
+    templates = app.jinja_env.list_templates(extensions=['html'])
+    if not run.step('templates', templates, app.jinja_env.get_template):
+        return
+
+    queries = [
+        configure_mappers,
+        lambda: user_by_id(0),
+        lambda: followed_ids(0),
+        lambda: liked_message_ids(0),
+        lambda: messages_by_ids([0]),
+        lambda: user_messages_before(0, 1, 1),
+        lambda: feed_ids([0], 1),
+        lambda: feed_after([0], 0, 1),
+        lambda: recent_ids_per_author([0], 1),
+        lambda: author_card_rows([0]),
+    ]
+    if not run.step('queries', queries, lambda query: query()):
+        return
+
+    followed = {}
+
+    def look_up(user_id):
+        if user_by_id(user_id) is not None:
+            followed[user_id] = followed_ids(user_id)
+            liked_message_ids(user_id)
+    if not run.step('users', users, look_up):
+        return
+
+    authors = list(dict.fromkeys(
+        users + [author for ids in followed.values() for author in ids]))
+    batches = [authors[i:i + AUTHOR_BATCH]
+               for i in range(0, len(authors), AUTHOR_BATCH)]
+    if not run.step('authors', batches, author_cards.get_many):
+        return
+
+    if not run.step('feeds', feeds, lambda user_id: timeline_cache.feed(
+            followed.get(user_id, []) + [user_id], 100)):
+        return
+
+    run.step('profiles', profiles, lambda user_id: messages_by_ids(
+        timeline_cache.recent(user_id, 100)))
@@ -0,0 +1,23 @@
+"""Entrypoint for production WSGI servers, e.g. `gunicorn wsgi:app`
+(see gunicorn.conf.py for the settings).
+
+The app is created, then warmed up (see warmup.py), when this module is
+imported: before the server hands it any request. Under gunicorn's
+preload_app that happens once, in the master, and the forked workers
+start warm.
+"""
+
+from app import create_app
+from models import db
+from shards import shard_router
+from warmup import warm_up
+
+app = create_app()
+warm_up(app)
+
+# a database connection must not be shared by the processes forked from
+# this one: warming up's go back to their pools, which are emptied
+with app.app_context():
+    for bind in shard_router.shard_names():
+        db.get_engine(bind=bind).dispose()
+    db.get_engine().dispose()